@@ -1,6 +1,41 @@
+import os
 from pathlib import Path
 
 ROOT_DIR = Path(__file__).resolve().parent.parent
 UPLOADS_DIR = ROOT_DIR / "uploads"
 
-UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
\ No newline at end of file
+UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+
+# Execution layer, each can be tuned through an environment variable of the same name
+THREAD_POOL_SIZE = int(os.environ.get("THREAD_POOL_SIZE", 4)) # Threads for pandas/NumPy work that releases the GIL
+PROCESS_POOL_SIZE = int(os.environ.get("PROCESS_POOL_SIZE", 1)) # Processes for CSV parsing, 0 parses on the thread pool instead
+VALIDATION_WORKERS = int(os.environ.get("VALIDATION_WORKERS", os.cpu_count() or 1)) # Processes validating upload chunks in parallel, 0 validates on the thread pool
+MAX_CONCURRENT_UPLOADS = int(os.environ.get("MAX_CONCURRENT_UPLOADS", 2)) # Uploads beyond this are turned away until one finishes
+MAX_DECOMPRESSED_SIZE = int(os.environ.get("MAX_DECOMPRESSED_SIZE", 1024 * 1024 * 1024)) # Largest size a compressed upload may inflate to, in bytes
+
+# Chunked upload sessions, for files too large to send in a single request
+MAX_PART_SIZE = int(os.environ.get("MAX_PART_SIZE", 64 * 1024 * 1024)) # Largest part accepted, in bytes
+MAX_SESSION_SIZE = int(os.environ.get("MAX_SESSION_SIZE", 10 * 1024 * 1024 * 1024)) # Largest file assembled from parts, in bytes
+UPLOAD_SESSION_TTL = float(os.environ.get("UPLOAD_SESSION_TTL", 24 * 60 * 60)) # Seconds an unfinished session is kept for
+
+# "compact" keeps only the columns summaries need, in the narrowest safe types. "full" keeps every column at its parsed width
+DATASET_MODE = os.environ.get("DATASET_MODE", "compact")
+# "pandas" answers summaries from in-memory structures, "sqlite" imports each upload into an indexed SQLite database instead
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "pandas")
+COMPACTION_SEGMENTS = int(os.environ.get("COMPACTION_SEGMENTS", 8)) # Appended segments that trigger a background compaction into the main file
+# Publish every structure as memory-mapped files plus a version header, so all uvicorn workers share one copy of the dataset
+SHARED_DATASET = os.environ.get("SHARED_DATASET", "false").lower() in ("1", "true", "yes")
+
+# Summary result cache, entries are also dropped as soon as a new upload replaces the dataset
+SUMMARY_CACHE_SIZE = int(os.environ.get("SUMMARY_CACHE_SIZE", 10000)) # Most results kept at once, 0 disables the cache
+SUMMARY_CACHE_TTL = float(os.environ.get("SUMMARY_CACHE_TTL", 300)) # Seconds a result is kept for
+
+# Relative error of the percentiles in summaries. Smaller values need more buckets per user and day
+QUANTILE_ACCURACY = float(os.environ.get("QUANTILE_ACCURACY", 0.01))
+
+# Entries ranked per leaderboard and window, pages can reach this far down the ranking
+LEADERBOARD_DEPTH = int(os.environ.get("LEADERBOARD_DEPTH", 1000))
+
+# What uploads do with rows repeating an earlier transaction ID, unless the request says otherwise:
+# "allow" skips the check, "detect" counts them, "reject" refuses the upload, "keep_first" drops every repeat
+DUPLICATE_IDS = os.environ.get("DUPLICATE_IDS", "detect")
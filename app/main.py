@@ -1,9 +1,63 @@
-from fastapi import FastAPI
-from .routers import transactions
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+from .routers import transactions, uploads
+from .services import executor, metrics
+from .services.warmup import warm_up
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up in the background, so the server accepts connections straight away and reports readiness meanwhile"""
+    task = asyncio.create_task(warm_up.run())
+    yield
+    task.cancel()
+    executor.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(transactions.router)
+app.include_router(uploads.router)
+
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """Time every request, reporting where the time went in a Server-Timing header"""
+    start = time.perf_counter()
+    timings = metrics.start_request()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    route = request.scope.get("route")
+    metrics.request_seconds.observe(elapsed, request.method, getattr(route, "path", "unmatched"), str(response.status_code))
+    response.headers["Server-Timing"] = metrics.server_timing(timings, elapsed)
+    return response
 
 @app.get("/")
 async def root():
-    return {"message": "Hello World"}
\ No newline at end of file
+    return {"message": "Hello World"}
+
+@app.get("/health/live")
+async def liveness():
+    """The process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """
+    Whether queries will be answered quickly, which is once the stored data has been loaded and indexed
+
+    Returns:
+        JSONResponse: The warm-up stage and time taken so far, with any error, and a 503 status until it has succeeded
+    """
+    code = status.HTTP_200_OK if warm_up.ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(warm_up.status(), status_code=code)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Expose stage latencies, bytes and rows processed, and cache effectiveness for Prometheus to scrape
+
+    Returns:
+        PlainTextResponse: Every metric in the Prometheus text exposition format
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,63 +1,175 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, status, Query
-from typing import Annotated, Optional
+import csv
+import io
+import json
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import APIRouter, UploadFile, File, HTTPException, status, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Annotated, Iterable, Iterator, Literal, Optional
 
-from ..services.transaction_validator import validate_file
-from ..services.transaction_summary import get_summary
-from ..services.file_handler import save_file
+from ..services.transaction_validator import ingest_file
+from ..services.transaction_summary import get_summary, get_summary_series, get_batch_summaries, refresh_data, append_data, summary_cache
+from ..services.export import export_transactions, EXPORT_COLUMNS, StaleCursorError
+from ..services.leaderboard import get_leaderboard, leaderboard_cache
+from ..services.dataset import DatasetVersion
+from ..services.executor import upload_slot, UploadsBusyError
+from ..services.warmup import warm_up
+from ..services.file_handler import staging_path, upload_encoding
+from ..services.duplicates import DuplicateMode
+from ..config import DUPLICATE_IDS
 
 router = APIRouter()
 
+STREAM_BATCH_SIZE = 1000 # Entries sent per write when streaming JSON or newline-delimited JSON
+
+class BatchSummaryRequest(BaseModel):
+    """Request body for summarising many users at once"""
+    user_ids: Optional[list[str]] = Field(None, description="User IDs to summarise, leave out to summarise every user")
+    date_from: Optional[str] = Field(None, description="Start date (YYYY-MM-DD)")
+    date_to: Optional[str] = Field(None, description="End date (YYYY-MM-DD)")
+
 @router.post('/upload')
-async def upload(file: Annotated[UploadFile, File()]):
+async def upload(
+        file: Annotated[UploadFile, File()],
+        mode: Literal["replace", "append"] = Query("replace", description="Replace the stored transactions, or add to them"),
+        duplicates: DuplicateMode = Query(DUPLICATE_IDS, description="Allow, count, reject or drop rows repeating an earlier transaction ID")
+    ):
     """
     Allows the upload of a valid CSV file containing some transaction data
 
     Args:
-        file: The file must be of type .csv
+        file: The file must be of type .csv, or compressed as .csv.gz or .csv.zst. A Content-Encoding
+            of gzip or zstd on the file part is honoured whatever its name
+        mode: "replace" swaps out every stored transaction, "append" adds the file's rows to them,
+            so only the new rows are validated and aggregated
+        duplicates: "detect" counts rows repeating an earlier transaction ID in the file, "reject"
+            refuses a file holding any, "keep_first" saves the file without them and "allow" skips the check
     
     Returns:
-        dict: Success message with the file path
+        dict: Success message with the file path, the rows received and how many repeated an earlier ID
     """
-    if not file.filename.endswith('.csv'):
+    try:
+        encoding = upload_encoding(file.filename or "", file.headers.get("content-encoding"))
+    except Exception as e:
         raise HTTPException(
             status_code = status.HTTP_400_BAD_REQUEST,
-            detail="Only CSV files can be uploaded."
+            detail=str(e)
         )
     
     try:
-        await validate_file(file) # Attempt to validate the file
-        file.file.seek(0) # Set the seek pointer back to 0 to reset progress
-        saved_file = await save_file(file) # Save the file
-        return {"message": f"File uploaded successfully at {saved_file}"}
+        with upload_slot(): # Limit how many uploads compete with summaries for CPU at once
+            if mode == "append":
+                ingested = await ingest_file(file, staging_path(), encoding, duplicates) # Only the new rows are validated
+                await append_data(ingested.path)
+                warm_up.data_loaded()
+                return {"message": "File appended successfully", "rows": ingested.rows, "duplicates": ingested.duplicates}
+
+            # Validate, decompress and save the file in a single pass
+            ingested = await ingest_file(file, encoding=encoding, duplicates=duplicates)
+            await refresh_data(ingested.path) # Load the new upload into the backend so summaries see it
+            warm_up.data_loaded()
+        return {"message": f"File uploaded successfully at {ingested.path}", "rows": ingested.rows, "duplicates": ingested.duplicates}
+    except UploadsBusyError as e:
+        raise HTTPException(
+            status_code = status.HTTP_429_TOO_MANY_REQUESTS,
+            detail = str(e),
+            headers = {"Retry-After": "5"}
+        )
     except Exception as e:
         raise HTTPException(
             status_code = status.HTTP_400_BAD_REQUEST,
             detail = str(e)
         )
 
+@router.post('/summary/batch')
+async def summary_batch(request: BatchSummaryRequest):
+    """
+    Fetch the summary statistics for many users in one call, optionally filtered by date range.
+    Users without transactions are reported inline rather than failing the whole batch
+
+    Args:
+        request: The users and optional date range to summarise
+    
+    Returns:
+        StreamingResponse: One JSON object per line, holding either "data" or "error" for each user
+    """
+
+    try:
+        entries = await get_batch_summaries(request.user_ids, request.date_from, request.date_to)
+        return StreamingResponse(_ndjson(entries), media_type="application/x-ndjson")
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+@router.get('/summary/{user_id}/series')
+async def summary_series(
+        request: Request,
+        user_id: str,
+        bucket: Literal["day", "week", "month"] = Query("day", description="Width of each bucket, weeks start on Mondays"),
+        date_from: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
+        date_to: Optional[str] = Query(None, description="End date (YYYY-MM-DD)")
+    ):
+    """
+    Fetch a user's summary statistics for every day, week or month with transactions in one call,
+    optionally filtered by date range. The series is streamed, so long histories are never held
+    as one response in memory
+
+    Args:
+        user_id: The user ID to fetch statistics for
+        bucket: "day", "week" or "month"
+        date_from: Optional start date for filtering
+        date_to: Optional end date for filtering
+
+    Returns:
+        StreamingResponse: A JSON object whose "data" lists the start, count, total, maximum, minimum and average of each bucket
+    """
+    try:
+        entries = await get_summary_series(user_id, bucket, date_from, date_to)
+        # Only a request that would succeed can be answered with a 304, tagged with the version it was computed from
+        headers = _cache_validators(entries.version)
+        if _not_modified(request, headers):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return StreamingResponse(_json_data(entries.value), media_type="application/json", headers=headers)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
 @router.get('/summary/{user_id}')
 async def summary(
+        request: Request,
         user_id: str,
         date_from: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
-        date_to: Optional[str] = Query(None, description="End date (YYYY-MM-DD)")
+        date_to: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
+        quantiles: bool = Query(False, description="Also return the p50 (median), p90 and p99 transaction amounts")
     ):
 
     """ 
     Fetch the summary statistics from the uploaded CSV file for a particular user,
-    optionally filtered by date range
+    optionally filtered by date range. Responses carry ETag and Last-Modified headers
+    tied to the uploaded dataset, so conditional requests get a 304 until it changes
 
     Args:
         user_id: The user ID to fetch statistics for
         date_from: Optional start date for filtering
         date_to: Optional end date for filtering
+        quantiles: Whether to add percentiles of the amounts, within 1% by default
     
     Returns:
     dict: Summary of statics in the form of max, min and average transaction amounts
     """
 
     try:
-        summary = await get_summary(user_id, date_from, date_to)
-        return {"data": summary}
+        # Validated and served from the result cache first, so an unknown user or bad range is never a 304.
+        # The validators come from the version the summary was computed from, never a later one
+        summary = await get_summary(user_id, date_from, date_to, quantiles)
+        headers = _cache_validators(summary.version)
+        if _not_modified(request, headers):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return JSONResponse({"data": summary.value}, headers=headers)
     except FileNotFoundError as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -67,4 +179,152 @@ async def summary(
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
-        )
\ No newline at end of file
+        )
+
+@router.get('/leaderboard/{board}')
+async def leaderboard(
+        request: Request,
+        board: Literal["users", "products"],
+        by: Literal["spend", "count"] = Query("spend", description="Rank by total amount spent, or by number of transactions"),
+        date_from: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
+        date_to: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
+        limit: int = Query(100, ge=1, le=1000, description="Entries per page"),
+        offset: int = Query(0, ge=0, description="Number of top entries to skip")
+    ):
+    """
+    Rank users or products by spend or transaction count, optionally within a date range.
+    The ranking is built from daily totals prepared at upload and cached for the current
+    dataset, so paging through it is cheap. Responses carry the same validators as summaries
+
+    Args:
+        board: "users" or "products"
+        by: "spend" or "count"
+        date_from: Optional start date for filtering
+        date_to: Optional end date for filtering
+        limit: Entries per page
+        offset: Number of top entries to skip
+
+    Returns:
+        dict: The page of ranked entries, with the offset of the next page or null on the last
+    """
+    try:
+        page = await get_leaderboard(board, by, date_from, date_to, limit, offset)
+        # Only a request that would succeed can be answered with a 304, tagged with the version it was ranked from
+        headers = _cache_validators(page.version)
+        if _not_modified(request, headers):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return JSONResponse(page.value, headers=headers)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+@router.get('/transactions/{user_id}')
+async def transactions(
+        user_id: str,
+        date_from: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
+        date_to: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
+        cursor: Optional[str] = Query(None, description="The X-Next-Cursor of the previous page, which carries its date filters"),
+        limit: int = Query(1000, ge=1, le=10000, description="Most rows in the page"),
+        format: Literal["ndjson", "csv"] = Query("ndjson", description="Newline-delimited JSON, or CSV with a header row")
+    ):
+    """
+    Export the raw transactions of a user in timestamp order, a page at a time. Pages are read
+    straight from the per-user row index, and the cursor of the next page is returned in the
+    X-Next-Cursor header, which is left out on the last page
+
+    Args:
+        user_id: The user whose transactions to export
+        date_from: Optional start date for filtering
+        date_to: Optional end date for filtering
+        cursor: Where the previous page ended
+        limit: Most rows in the page
+        format: "ndjson" or "csv"
+
+    Returns:
+        StreamingResponse: The rows of the page. A cursor from before the latest upload gets a 409 response
+    """
+    try:
+        page = await export_transactions(user_id, date_from, date_to, cursor, limit)
+    except StaleCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    headers = {"X-Next-Cursor": page.next_cursor} if page.next_cursor is not None else {}
+    if format == "csv":
+        return StreamingResponse(_csv_rows(page.batches), media_type="text/csv", headers=headers)
+    rows = (dict(zip(EXPORT_COLUMNS, row)) for batch in page.batches for row in batch)
+    return StreamingResponse(_ndjson(rows), media_type="application/x-ndjson", headers=headers)
+
+@router.get('/cache/stats')
+async def cache_stats():
+    """
+    Report how effective the result caches are
+
+    Returns:
+        dict: Hit and miss counters of the summary and leaderboard caches
+    """
+    return {"summary": summary_cache.stats(), "leaderboard": leaderboard_cache.stats()}
+
+def _cache_validators(version: DatasetVersion) -> dict[str, str]:
+    """HTTP validators for responses computed from a version of the dataset"""
+    return {
+        "ETag": f'"{version.tag}"',
+        "Last-Modified": formatdate(version.modified_ns / 1e9, usegmt=True)
+    }
+
+def _not_modified(request: Request, validators: dict[str, str]) -> bool:
+    """Whether the client's cached copy is still current, following the precedence rules of RFC 9110"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or validators["ETag"] in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(validators["Last-Modified"]) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False # Unparseable dates are ignored, as the RFC requires
+
+    return False
+
+def _ndjson(entries: Iterable[dict]) -> Iterator[str]:
+    """Encode entries as newline-delimited JSON a batch at a time, so the response is never held whole in memory"""
+    lines = []
+    for entry in entries:
+        lines.append(json.dumps(entry) + "\n")
+        if len(lines) >= STREAM_BATCH_SIZE:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+def _json_data(entries: Iterable[dict]) -> Iterator[str]:
+    """Encode entries as the "data" list of a JSON object a batch at a time, so the response is never held whole in memory"""
+    yield '{"data": ['
+    separator = ""
+    lines = []
+    for entry in entries:
+        lines.append(separator + json.dumps(entry))
+        separator = ", "
+        if len(lines) >= STREAM_BATCH_SIZE:
+            yield "".join(lines)
+            lines = []
+    yield "".join(lines) + "]}"
+
+def _csv_rows(batches: Iterable[list[tuple]]) -> Iterator[str]:
+    """Encode batches of rows as CSV under the upload header, one write per batch"""
+    yield ",".join(EXPORT_COLUMNS) + "\n"
+    for batch in batches:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(batch)
+        yield buffer.getvalue()
@@ -0,0 +1,132 @@
+from contextlib import contextmanager
+from dataclasses import asdict
+from typing import Iterator, Literal, Optional
+from fastapi import APIRouter, HTTPException, status, Header, Path, Query, Request
+
+from ..services.upload_sessions import upload_sessions, UploadSession, SessionNotFoundError, MAX_PARTS
+from ..services.transaction_summary import refresh_data, append_data
+from ..services.warmup import warm_up
+from ..services.executor import upload_slot, UploadsBusyError
+from ..services.file_handler import staging_path
+from ..services.duplicates import DuplicateMode
+from ..config import DUPLICATE_IDS, UPLOADS_DIR
+
+router = APIRouter(prefix="/uploads")
+
+@router.post('')
+async def create_upload(
+        mode: Literal["replace", "append"] = Query("replace", description="Replace the stored transactions, or add to them"),
+        duplicates: DuplicateMode = Query(DUPLICATE_IDS, description="Allow, count, reject or drop rows repeating an earlier transaction ID")
+    ):
+    """
+    Start a chunked upload, for files too large or connections too unreliable for a single request
+
+    Args:
+        mode: "replace" or "append", applied once the upload is completed
+        duplicates: How rows repeating an earlier transaction ID are handled, as for /upload
+
+    Returns:
+        dict: The new session, whose ID the parts are sent to
+    """
+    return _session_body(upload_sessions.create(mode, duplicates))
+
+@router.get('/{session_id}')
+async def upload_status(session_id: str):
+    """
+    Report which parts of an upload have been received, so an interrupted upload can resume
+    by sending only the parts that are missing
+
+    Args:
+        session_id: The upload session
+
+    Returns:
+        dict: The session, with the size and SHA-256 of each part received
+    """
+    with _session_errors():
+        return _session_body(upload_sessions.get(session_id))
+
+@router.put('/{session_id}/parts/{number}')
+async def upload_part(
+        request: Request,
+        session_id: str,
+        number: int = Path(..., ge=1, le=MAX_PARTS, description="The part's position in the file, from 1"),
+        checksum: Optional[str] = Header(None, alias="X-Checksum-SHA256", description="Hex SHA-256 of the part")
+    ):
+    """
+    Send one part of an upload as the raw request body. Parts may be sent in any order and
+    resent safely; each is validated as soon as the parts before it have arrived
+
+    Args:
+        session_id: The upload session
+        number: The part's position in the file, from 1
+        checksum: Optional hex SHA-256 of the part, which is rejected if it does not match
+
+    Returns:
+        dict: The session including the new part
+    """
+    with _session_errors():
+        return _session_body(await upload_sessions.write_part(session_id, number, request.stream(), checksum))
+
+@router.post('/{session_id}/complete')
+async def complete_upload(session_id: str):
+    """
+    Assemble the parts of an upload and load it, replacing or adding to the stored transactions
+
+    Args:
+        session_id: The upload session, which no longer exists afterwards
+
+    Returns:
+        dict: Success message, with the rows received and how many repeated an earlier ID
+    """
+    with _session_errors():
+        session = upload_sessions.get(session_id)
+        with upload_slot(): # Completing loads the data, so it competes with summaries like any other upload
+            if session.mode == "append":
+                ingested = await upload_sessions.complete(session_id, staging_path())
+                await append_data(ingested.path)
+                warm_up.data_loaded()
+                return {"message": "File appended successfully", "rows": ingested.rows, "duplicates": ingested.duplicates}
+
+            ingested = await upload_sessions.complete(session_id, UPLOADS_DIR / "latest.csv")
+            await refresh_data(ingested.path)
+            warm_up.data_loaded()
+        return {"message": f"File uploaded successfully at {ingested.path}", "rows": ingested.rows, "duplicates": ingested.duplicates}
+
+@router.delete('/{session_id}')
+async def abort_upload(session_id: str):
+    """
+    Abandon an upload, discarding every part received
+
+    Args:
+        session_id: The upload session
+    """
+    with _session_errors():
+        upload_sessions.abort(session_id)
+    return {"message": "Upload aborted"}
+
+def _session_body(session: UploadSession) -> dict:
+    return {**asdict(session), "size": session.size}
+
+@contextmanager
+def _session_errors() -> Iterator[None]:
+    """Map upload session errors onto HTTP responses"""
+    try:
+        yield
+    except HTTPException:
+        raise
+    except SessionNotFoundError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except UploadsBusyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": "5"}
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
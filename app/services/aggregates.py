@@ -0,0 +1,868 @@
+from __future__ import annotations
+
+import math
+import os
+from datetime import date
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from ..config import QUANTILE_ACCURACY
+from .snapshot import restore_amounts
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+# Amounts closer to zero than this share a single bucket of a quantile sketch, and are reported as zero
+MIN_MAGNITUDE = 1e-9
+
+class Aggregate(NamedTuple):
+    """Running totals for a group of transactions, enough to derive max, min and average"""
+    count: int
+    total: float
+    minimum: float
+    maximum: float
+
+class Series(NamedTuple):
+    """Aggregates of consecutive time buckets, each labelled with the first day it covers"""
+    starts: np.ndarray
+    counts: np.ndarray
+    totals: np.ndarray
+    minimums: np.ndarray
+    maximums: np.ndarray
+
+# Bucket widths a series can be split into
+SERIES_BUCKETS = ("day", "week", "month")
+
+class UserIndex:
+    """
+    Per-user aggregates computed in a single group-by pass, answering unfiltered summaries
+    with a hash lookup instead of scanning the transactions
+    """
+
+    def __init__(
+            self,
+            user_ids: np.ndarray,
+            counts: np.ndarray,
+            totals: np.ndarray,
+            minimums: np.ndarray,
+            maximums: np.ndarray
+        ):
+        self.user_ids = user_ids
+        self.counts = counts
+        self.totals = totals
+        self.minimums = minimums
+        self.maximums = maximums
+        self._positions = {user_id: i for i, user_id in enumerate(user_ids.tolist())}
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "UserIndex":
+        """
+        Build the index from the transactions dataframe
+
+        Args:
+            df: the loaded transactions
+
+        Returns:
+            UserIndex: the aggregates of every user in the dataframe
+        """
+        grouped = _amounts(df).groupby(df['user_id'], sort=True, observed=True).agg(['count', 'sum', 'min', 'max'])
+        grouped = grouped[grouped['count'] > 0] # Users whose amounts are all missing have nothing to summarise
+
+        return cls(
+            grouped.index.to_numpy(dtype=str),
+            grouped['count'].to_numpy(dtype=np.int64),
+            grouped['sum'].to_numpy(dtype=np.float64),
+            grouped['min'].to_numpy(dtype=np.float64),
+            grouped['max'].to_numpy(dtype=np.float64)
+        )
+
+    def merge(self, other: "UserIndex") -> "UserIndex":
+        """
+        Combine with the index of further transactions, such as an appended segment
+
+        Args:
+            other: the index of the transactions to add
+
+        Returns:
+            UserIndex: the index of both sets of transactions together
+        """
+        grouped = pd.DataFrame({
+            'user_id': np.concatenate([self.user_ids, other.user_ids]),
+            'count': np.concatenate([self.counts, other.counts]),
+            'total': np.concatenate([self.totals, other.totals]),
+            'minimum': np.concatenate([self.minimums, other.minimums]),
+            'maximum': np.concatenate([self.maximums, other.maximums])
+        }).groupby('user_id', sort=True).agg({'count': 'sum', 'total': 'sum', 'minimum': 'min', 'maximum': 'max'})
+
+        return UserIndex(
+            grouped.index.to_numpy(dtype=str),
+            grouped['count'].to_numpy(dtype=np.int64),
+            grouped['total'].to_numpy(dtype=np.float64),
+            grouped['minimum'].to_numpy(dtype=np.float64),
+            grouped['maximum'].to_numpy(dtype=np.float64)
+        )
+
+    def get(self, user_id: str) -> Optional[Aggregate]:
+        """
+        Args:
+            user_id: the user to look up
+
+        Returns:
+            Optional[Aggregate]: the user's aggregates, or None if they have no transactions
+        """
+        position = self._positions.get(user_id)
+        if position is None:
+            return None
+
+        return Aggregate(
+            int(self.counts[position]),
+            float(self.totals[position]),
+            float(self.minimums[position]),
+            float(self.maximums[position])
+        )
+
+    def save(self, path: Path, source: tuple[int, int]) -> None:
+        """
+        Persist the index, tagged with the file it was built from
+
+        Args:
+            path: where to write the index
+            source: the (mtime_ns, size) of the transactions file the index describes
+        """
+        _save_arrays(
+            path,
+            source,
+            user_ids=self.user_ids,
+            counts=self.counts,
+            totals=self.totals,
+            minimums=self.minimums,
+            maximums=self.maximums
+        )
+
+    @classmethod
+    def load(cls, path: Path, source: tuple[int, int]) -> Optional["UserIndex"]:
+        """
+        Load a persisted index if it still describes the given transactions file
+
+        Args:
+            path: where the index was written
+            source: the (mtime_ns, size) of the current transactions file
+
+        Returns:
+            Optional[UserIndex]: the index, or None if it is missing or stale
+        """
+        arrays = _load_arrays(path, source)
+        return cls(**arrays) if arrays is not None else None
+
+class DailyRollup:
+    """
+    Per-user, per-day aggregates. Date filters always fall on day boundaries, so any
+    range query can be answered by combining at most one record per day in the window.
+
+    Each user's days are stored contiguously and in order, between offsets[i] and offsets[i + 1].
+    """
+
+    def __init__(
+            self,
+            user_ids: np.ndarray,
+            offsets: np.ndarray,
+            days: np.ndarray,
+            counts: np.ndarray,
+            totals: np.ndarray,
+            minimums: np.ndarray,
+            maximums: np.ndarray
+        ):
+        self.user_ids = user_ids
+        self.offsets = offsets
+        self.days = days
+        self.counts = counts
+        self.totals = totals
+        self.minimums = minimums
+        self.maximums = maximums
+        self._positions = {user_id: i for i, user_id in enumerate(user_ids.tolist())}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "DailyRollup":
+        """
+        Build the rollup from the transactions dataframe
+
+        Args:
+            df: the loaded transactions
+
+        Returns:
+            DailyRollup: the daily aggregates of every user in the dataframe
+        """
+        days = df['timestamp'].to_numpy(dtype='datetime64[D]')
+        grouped = _amounts(df).groupby([df['user_id'], days], sort=True, observed=True).agg(['count', 'sum', 'min', 'max'])
+        return cls._from_grouped(grouped[grouped['count'] > 0])
+
+    def merge(self, other: "DailyRollup") -> "DailyRollup":
+        """
+        Combine with the rollup of further transactions, such as an appended segment.
+        The cost follows the number of daily records rather than the number of transactions
+
+        Args:
+            other: the rollup of the transactions to add
+
+        Returns:
+            DailyRollup: the rollup of both sets of transactions together
+        """
+        grouped = pd.DataFrame({
+            'user_id': np.concatenate([self._row_users(), other._row_users()]),
+            'day': np.concatenate([self.days, other.days]),
+            'count': np.concatenate([self.counts, other.counts]),
+            'sum': np.concatenate([self.totals, other.totals]),
+            'min': np.concatenate([self.minimums, other.minimums]),
+            'max': np.concatenate([self.maximums, other.maximums])
+        }).groupby(['user_id', 'day'], sort=True).agg({'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'})
+        return self._from_grouped(grouped)
+
+    @classmethod
+    def _from_grouped(cls, grouped: pd.DataFrame) -> "DailyRollup":
+        """Build the rollup from aggregates indexed by user then day, with count, sum, min and max columns"""
+        # Rows are sorted by user then day, so each user's days form one contiguous run
+        row_users = grouped.index.get_level_values(0).to_numpy(dtype=str)
+        starts = np.flatnonzero(np.r_[True, row_users[1:] != row_users[:-1]]) if len(row_users) else np.empty(0, dtype=np.int64)
+        offsets = np.append(starts, len(grouped)).astype(np.int64)
+        user_ids = row_users[starts]
+
+        return cls(
+            user_ids,
+            offsets,
+            grouped.index.get_level_values(1).to_numpy(dtype='datetime64[D]'),
+            grouped['count'].to_numpy(dtype=np.int64),
+            grouped['sum'].to_numpy(dtype=np.float64),
+            grouped['min'].to_numpy(dtype=np.float64),
+            grouped['max'].to_numpy(dtype=np.float64)
+        )
+
+    def _row_users(self) -> np.ndarray:
+        """The user of every daily record"""
+        return np.repeat(self.user_ids, np.diff(self.offsets))
+
+    def has_user(self, user_id: str) -> bool:
+        """Whether the user has any transactions at all, regardless of date"""
+        return user_id in self._positions
+
+    def get(self, user_id: str, start: Optional[date] = None, end: Optional[date] = None) -> Optional[Aggregate]:
+        """
+        Combine a user's daily aggregates over a window of days
+
+        Args:
+            user_id: the user to look up
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+
+        Returns:
+            Optional[Aggregate]: the combined aggregates, or None if there are no transactions in the window
+        """
+        position = self._positions.get(user_id)
+        if position is None:
+            return None
+
+        first, last = _day_range(self.offsets, self.days, position, start, end)
+        if first >= last:
+            return None
+
+        # Averages stay exact because totals and counts are combined, never the daily averages
+        return Aggregate(
+            int(self.counts[first:last].sum()),
+            float(self.totals[first:last].sum()),
+            float(self.minimums[first:last].min()),
+            float(self.maximums[first:last].max())
+        )
+
+    def series(self, user_id: str, bucket: str, start: Optional[date] = None, end: Optional[date] = None) -> Optional[Series]:
+        """
+        Combine a user's daily aggregates into consecutive day, week or month buckets
+
+        Args:
+            user_id: the user to look up
+            bucket: "day", "week" (starting on Mondays) or "month"
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+
+        Returns:
+            Optional[Series]: the aggregates of every bucket with transactions, or None if the user has no transactions at all
+        """
+        position = self._positions.get(user_id)
+        if position is None:
+            return None
+
+        first, last = _day_range(self.offsets, self.days, position, start, end)
+        return bucket_series(
+            self.days[first:last],
+            self.counts[first:last],
+            self.totals[first:last],
+            self.minimums[first:last],
+            self.maximums[first:last],
+            bucket
+        )
+
+    def window(self, start: Optional[date] = None, end: Optional[date] = None) -> UserIndex:
+        """
+        Combine every user's daily aggregates over a window of days in one vectorised group-by
+
+        Args:
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+
+        Returns:
+            UserIndex: aggregates of each user with transactions in the window
+        """
+        owners = np.repeat(np.arange(len(self.user_ids)), np.diff(self.offsets))
+        in_window = np.ones(len(self.days), dtype=bool)
+        if start is not None:
+            in_window &= self.days >= np.datetime64(start, 'D')
+        if end is not None:
+            in_window &= self.days < np.datetime64(end, 'D')
+
+        grouped = pd.DataFrame({
+            'owner': owners[in_window],
+            'count': self.counts[in_window],
+            'total': self.totals[in_window],
+            'minimum': self.minimums[in_window],
+            'maximum': self.maximums[in_window]
+        }).groupby('owner', sort=True).agg({'count': 'sum', 'total': 'sum', 'minimum': 'min', 'maximum': 'max'})
+
+        return UserIndex(
+            self.user_ids[grouped.index.to_numpy()],
+            grouped['count'].to_numpy(dtype=np.int64),
+            grouped['total'].to_numpy(dtype=np.float64),
+            grouped['minimum'].to_numpy(dtype=np.float64),
+            grouped['maximum'].to_numpy(dtype=np.float64)
+        )
+
+    def save(self, path: Path, source: tuple[int, int]) -> None:
+        """
+        Persist the rollup, tagged with the file it was built from
+
+        Args:
+            path: where to write the rollup
+            source: the (mtime_ns, size) of the transactions file the rollup describes
+        """
+        _save_arrays(
+            path,
+            source,
+            user_ids=self.user_ids,
+            offsets=self.offsets,
+            days=self.days,
+            counts=self.counts,
+            totals=self.totals,
+            minimums=self.minimums,
+            maximums=self.maximums
+        )
+
+    @classmethod
+    def load(cls, path: Path, source: tuple[int, int]) -> Optional["DailyRollup"]:
+        """
+        Load a persisted rollup if it still describes the given transactions file
+
+        Args:
+            path: where the rollup was written
+            source: the (mtime_ns, size) of the current transactions file
+
+        Returns:
+            Optional[DailyRollup]: the rollup, or None if it is missing or stale
+        """
+        arrays = _load_arrays(path, source)
+        return cls(**arrays) if arrays is not None else None
+
+class QuantileRollup:
+    """
+    Per-user, per-day quantile sketches, so percentiles over any range of days are found by
+    merging a few small histograms rather than sorting the raw amounts.
+
+    Amounts are counted in logarithmic buckets whose bounds grow by a factor of
+    (1 + accuracy) / (1 - accuracy). Each bucket is reported by a value within that relative
+    accuracy of everything it holds, so a quantile is within the accuracy of the exact amount
+    at its rank (NumPy's "lower" quantile). Amounts of either sign are supported, and those
+    smaller than MIN_MAGNITUDE are reported as zero. Sketches merge by adding bucket counts,
+    which loses nothing, so the bound holds over any range of days and across appended segments.
+
+    Each user's records are stored contiguously, ordered by day then bucket, between
+    offsets[i] and offsets[i + 1].
+    """
+
+    def __init__(
+            self,
+            user_ids: np.ndarray,
+            offsets: np.ndarray,
+            days: np.ndarray,
+            buckets: np.ndarray,
+            counts: np.ndarray,
+            accuracy: float = QUANTILE_ACCURACY
+        ):
+        self.user_ids = user_ids
+        self.offsets = offsets
+        self.days = days
+        self.buckets = buckets
+        self.counts = counts
+        self.accuracy = float(accuracy)
+        self._positions = {user_id: i for i, user_id in enumerate(user_ids.tolist())}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, accuracy: float = QUANTILE_ACCURACY) -> "QuantileRollup":
+        """
+        Build the sketches from the transactions dataframe
+
+        Args:
+            df: the loaded transactions
+            accuracy: the relative error allowed in a quantile
+
+        Returns:
+            QuantileRollup: the daily sketches of every user in the dataframe
+        """
+        amounts = restore_amounts(df['transaction_amount'].to_numpy())
+        valid = ~np.isnan(amounts) # Missing amounts are left out, as they are from the other aggregates
+        grouped = pd.DataFrame({
+            'user_id': df['user_id'][valid],
+            'day': df['timestamp'].to_numpy(dtype='datetime64[D]')[valid],
+            'bucket': bucket_keys(amounts[valid], accuracy)
+        }).groupby(['user_id', 'day', 'bucket'], sort=True, observed=True).size()
+        return cls._from_grouped(grouped, accuracy)
+
+    def merge(self, other: "QuantileRollup") -> "QuantileRollup":
+        """
+        Combine with the sketches of further transactions, such as an appended segment
+
+        Args:
+            other: the sketches of the transactions to add, built with the same accuracy
+
+        Returns:
+            QuantileRollup: the sketches of both sets of transactions together
+        """
+        if other.accuracy != self.accuracy:
+            raise ValueError(f"Cannot merge sketches of accuracy {self.accuracy} and {other.accuracy}")
+
+        grouped = pd.DataFrame({
+            'user_id': np.concatenate([self._row_users(), other._row_users()]),
+            'day': np.concatenate([self.days, other.days]),
+            'bucket': np.concatenate([self.buckets, other.buckets]),
+            'count': np.concatenate([self.counts, other.counts])
+        }).groupby(['user_id', 'day', 'bucket'], sort=True)['count'].sum()
+        return self._from_grouped(grouped, self.accuracy)
+
+    @classmethod
+    def _from_grouped(cls, grouped: pd.Series, accuracy: float) -> "QuantileRollup":
+        """Build the sketches from counts indexed by user, day and bucket"""
+        row_users = grouped.index.get_level_values(0).to_numpy(dtype=str)
+        starts = np.flatnonzero(np.r_[True, row_users[1:] != row_users[:-1]]) if len(row_users) else np.empty(0, dtype=np.int64)
+
+        return cls(
+            row_users[starts],
+            np.append(starts, len(grouped)).astype(np.int64),
+            grouped.index.get_level_values(1).to_numpy(dtype='datetime64[D]'),
+            grouped.index.get_level_values(2).to_numpy(dtype=np.int32),
+            grouped.to_numpy(dtype=np.int64),
+            accuracy
+        )
+
+    def _row_users(self) -> np.ndarray:
+        """The user of every record"""
+        return np.repeat(self.user_ids, np.diff(self.offsets))
+
+    def quantiles(
+            self,
+            user_id: str,
+            quantiles: tuple[float, ...],
+            start: Optional[date] = None,
+            end: Optional[date] = None
+        ) -> Optional[list[float]]:
+        """
+        Estimate quantiles of a user's amounts over a window of days
+
+        Args:
+            user_id: the user to look up
+            quantiles: the quantiles to estimate, each between 0 and 1
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+
+        Returns:
+            Optional[list[float]]: the estimate of each quantile, or None if there are no transactions in the window
+        """
+        position = self._positions.get(user_id)
+        if position is None:
+            return None
+
+        first, last = _day_range(self.offsets, self.days, position, start, end)
+        if first >= last:
+            return None
+
+        # Merge the daily sketches into one histogram, then find the bucket holding each rank
+        buckets = self.buckets[first:last]
+        lowest = int(buckets.min())
+        cumulative = np.cumsum(np.bincount(buckets - lowest, weights=self.counts[first:last]))
+        ranks = np.asarray(quantiles, dtype=np.float64) * (cumulative[-1] - 1)
+        found = np.searchsorted(cumulative, ranks, side='right') + lowest
+        return bucket_values(found, self.accuracy).tolist()
+
+    def save(self, path: Path, source: tuple[int, int]) -> None:
+        """
+        Persist the sketches, tagged with the file they were built from
+
+        Args:
+            path: where to write the sketches
+            source: the (mtime_ns, size) of the transactions file the sketches describe
+        """
+        _save_arrays(
+            path,
+            source,
+            user_ids=self.user_ids,
+            offsets=self.offsets,
+            days=self.days,
+            buckets=self.buckets,
+            counts=self.counts,
+            accuracy=np.array(self.accuracy)
+        )
+
+    @classmethod
+    def load(cls, path: Path, source: tuple[int, int], accuracy: float = QUANTILE_ACCURACY) -> Optional["QuantileRollup"]:
+        """
+        Load persisted sketches if they still describe the given transactions file at the configured accuracy
+
+        Args:
+            path: where the sketches were written
+            source: the (mtime_ns, size) of the current transactions file
+            accuracy: the relative error the sketches must have been built with
+
+        Returns:
+            Optional[QuantileRollup]: the sketches, or None if they are missing or stale
+        """
+        arrays = _load_arrays(path, source)
+        if arrays is None or float(arrays.pop('accuracy', np.nan)) != accuracy:
+            return None
+        return cls(**arrays, accuracy=accuracy)
+
+class DailyTotals:
+    """
+    Per-day transaction counts and totals of every value of one column, for ranking those values
+    over a window of days. Records are stored day by day, so any window is one contiguous run of
+    records, combined with a bincount whose cost follows the days in the window rather than the rows.
+
+    The records of days[i] lie between offsets[i] and offsets[i + 1], and each record's code indexes keys.
+    Subclasses name the column they total.
+    """
+
+    column = ''
+
+    def __init__(
+            self,
+            keys: np.ndarray,
+            days: np.ndarray,
+            offsets: np.ndarray,
+            codes: np.ndarray,
+            counts: np.ndarray,
+            totals: np.ndarray
+        ):
+        self.keys = keys
+        self.days = days
+        self.offsets = offsets
+        self.codes = codes
+        self.counts = counts
+        self.totals = totals
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "DailyTotals":
+        """
+        Build the totals from the transactions dataframe
+
+        Args:
+            df: the loaded transactions
+
+        Returns:
+            DailyTotals: the daily totals of every value of the column
+        """
+        days = df['timestamp'].to_numpy(dtype='datetime64[D]')
+        grouped = _amounts(df).groupby([days, df[cls.column]], sort=True, observed=True).agg(['count', 'sum'])
+        return cls._from_grouped(grouped[grouped['count'] > 0])
+
+    def merge(self, other: "DailyTotals") -> "DailyTotals":
+        """
+        Combine with the totals of further transactions, such as an appended segment
+
+        Args:
+            other: the totals of the transactions to add
+
+        Returns:
+            DailyTotals: the totals of both sets of transactions together
+        """
+        grouped = pd.DataFrame({
+            'day': np.concatenate([self._record_days(), other._record_days()]),
+            'key': np.concatenate([self.keys[self.codes], other.keys[other.codes]]),
+            'count': np.concatenate([self.counts, other.counts]),
+            'sum': np.concatenate([self.totals, other.totals])
+        }).groupby(['day', 'key'], sort=True).agg({'count': 'sum', 'sum': 'sum'})
+        return self._from_grouped(grouped)
+
+    @classmethod
+    def _from_grouped(cls, grouped: pd.DataFrame) -> "DailyTotals":
+        """Build the totals from counts and sums indexed by day then key"""
+        record_days = grouped.index.get_level_values(0).to_numpy(dtype='datetime64[D]')
+        keys, codes = np.unique(grouped.index.get_level_values(1).to_numpy(dtype=str), return_inverse=True)
+        # Records are sorted by day, so the first record of each distinct day starts its run
+        days, starts = np.unique(record_days, return_index=True)
+
+        return cls(
+            keys,
+            days,
+            np.append(starts, len(grouped)).astype(np.int64),
+            codes.astype(np.int32),
+            grouped['count'].to_numpy(dtype=np.int64),
+            grouped['sum'].to_numpy(dtype=np.float64)
+        )
+
+    def _record_days(self) -> np.ndarray:
+        """The day of every record"""
+        return np.repeat(self.days, np.diff(self.offsets))
+
+    def window(self, start: Optional[date] = None, end: Optional[date] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Combine the daily totals over a window of days
+
+        Args:
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: the count and total of every key, zero where it has no transactions in the window
+        """
+        first = np.searchsorted(self.days, np.datetime64(start, 'D'), side='left') if start is not None else 0
+        last = np.searchsorted(self.days, np.datetime64(end, 'D'), side='left') if end is not None else len(self.days)
+        records = slice(self.offsets[first], self.offsets[max(first, last)])
+
+        codes = self.codes[records]
+        counts = np.bincount(codes, weights=self.counts[records], minlength=len(self.keys)).astype(np.int64)
+        totals = np.bincount(codes, weights=self.totals[records], minlength=len(self.keys))
+        return counts, totals
+
+    def top(
+            self,
+            by: str,
+            limit: int,
+            start: Optional[date] = None,
+            end: Optional[date] = None
+        ) -> tuple[list[tuple[str, int, float]], int]:
+        """
+        Rank the keys with transactions in a window of days
+
+        Args:
+            by: "spend" to rank by total amount, "count" to rank by number of transactions
+            limit: how many of the highest ranked keys to return
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+
+        Returns:
+            tuple: the (key, count, total) of the top keys, highest first with ties in key order,
+                and how many keys had transactions in the window
+        """
+        counts, totals = self.window(start, end)
+        present = np.flatnonzero(counts > 0)
+        values = (totals if by == "spend" else counts)[present]
+
+        # Only the entries that can reach the top are sorted, found in linear time by partitioning
+        if limit < len(values):
+            threshold = np.partition(values, len(values) - limit)[len(values) - limit]
+            candidates = np.flatnonzero(values >= threshold)
+        else:
+            candidates = np.arange(len(values))
+        ranked = present[candidates[np.lexsort((candidates, -values[candidates]))[:limit]]]
+
+        entries = [(str(key), int(count), float(total)) for key, count, total in zip(self.keys[ranked], counts[ranked], totals[ranked])]
+        return entries, len(present)
+
+    def save(self, path: Path, source: tuple[int, int]) -> None:
+        """
+        Persist the totals, tagged with the file they were built from
+
+        Args:
+            path: where to write the totals
+            source: the (mtime_ns, size) of the transactions file the totals describe
+        """
+        _save_arrays(
+            path,
+            source,
+            keys=self.keys,
+            days=self.days,
+            offsets=self.offsets,
+            codes=self.codes,
+            counts=self.counts,
+            totals=self.totals
+        )
+
+    @classmethod
+    def load(cls, path: Path, source: tuple[int, int]) -> Optional["DailyTotals"]:
+        """
+        Load persisted totals if they still describe the given transactions file
+
+        Args:
+            path: where the totals were written
+            source: the (mtime_ns, size) of the current transactions file
+
+        Returns:
+            Optional[DailyTotals]: the totals, or None if they are missing or stale
+        """
+        arrays = _load_arrays(path, source)
+        return cls(**arrays) if arrays is not None else None
+
+class UserTotals(DailyTotals):
+    """Daily counts and totals of each user"""
+    column = 'user_id'
+
+class ProductTotals(DailyTotals):
+    """Daily counts and totals of each product"""
+    column = 'product_id'
+
+def bucket_series(
+        days: np.ndarray,
+        counts: np.ndarray,
+        totals: np.ndarray,
+        minimums: np.ndarray,
+        maximums: np.ndarray,
+        bucket: str
+    ) -> Series:
+    """
+    Combine daily aggregates into buckets in one vectorised pass, as every bucket is a run of whole days
+
+    Args:
+        days: the day of each record, in order
+        counts: transactions on each day
+        totals: sum of each day's amounts
+        minimums: smallest amount of each day
+        maximums: largest amount of each day
+        bucket: "day", "week" (starting on Mondays) or "month"
+
+    Returns:
+        Series: the aggregates of every bucket holding at least one day
+    """
+    days = days.astype('datetime64[D]')
+    if bucket == "week":
+        # Day zero of the epoch was a Thursday, three days after the Monday its week began on
+        starts = days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+    elif bucket == "month":
+        starts = days.astype('datetime64[M]').astype('datetime64[D]')
+    elif bucket == "day":
+        starts = days
+    else:
+        raise ValueError(f"Unknown bucket {bucket}, expected one of {', '.join(SERIES_BUCKETS)}")
+
+    if len(days) == 0:
+        return Series(starts, counts, totals, minimums, maximums)
+
+    boundaries = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    return Series(
+        starts[boundaries],
+        np.add.reduceat(counts, boundaries),
+        np.add.reduceat(totals, boundaries),
+        np.minimum.reduceat(minimums, boundaries),
+        np.maximum.reduceat(maximums, boundaries)
+    )
+
+def bucket_keys(amounts: np.ndarray, accuracy: float) -> np.ndarray:
+    """
+    Map amounts to the ordered buckets of a quantile sketch: 0 holds amounts near zero,
+    positive keys hold positive amounts and negative keys negative ones, each growing with magnitude
+
+    Args:
+        amounts: the amounts to map, without missing values
+        accuracy: the relative error allowed in a quantile
+
+    Returns:
+        np.ndarray: the bucket of every amount
+    """
+    log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+    lowest = math.ceil(math.log(MIN_MAGNITUDE) / log_gamma)
+
+    magnitudes = np.clip(np.abs(amounts), MIN_MAGNITUDE, np.finfo(np.float64).max)
+    keys = (np.ceil(np.log(magnitudes) / log_gamma) - lowest + 1).astype(np.int32)
+    keys[np.abs(amounts) < MIN_MAGNITUDE] = 0
+    return np.where(amounts < 0, -keys, keys)
+
+def bucket_values(keys: np.ndarray, accuracy: float) -> np.ndarray:
+    """
+    The value reported for each bucket of a quantile sketch, within the accuracy of every amount in it
+
+    Args:
+        keys: buckets from bucket_keys
+        accuracy: the relative error the buckets were built with
+
+    Returns:
+        np.ndarray: the value of every bucket
+    """
+    gamma = (1 + accuracy) / (1 - accuracy)
+    lowest = math.ceil(math.log(MIN_MAGNITUDE) / math.log(gamma))
+
+    # A bucket holds magnitudes in (gamma^(i-1), gamma^i], and this point is equally far from both ends in relative terms
+    with np.errstate(over='ignore'):
+        magnitudes = 2 * gamma ** (np.abs(keys) + lowest - 1.0) / (gamma + 1)
+    return np.where(keys == 0, 0.0, np.sign(keys) * magnitudes)
+
+def _day_range(
+        offsets: np.ndarray,
+        days: np.ndarray,
+        position: int,
+        start: Optional[date],
+        end: Optional[date]
+    ) -> tuple[int, int]:
+    """
+    The records of one user that fall within a window of days
+
+    Args:
+        offsets: where each user's records begin
+        days: the day of every record, in order within each user
+        position: the user's position in offsets
+        start: optional first day to include
+        end: optional day to stop before
+
+    Returns:
+        tuple[int, int]: the first record in the window and the one after the last, equal when it is empty
+    """
+    first, last = offsets[position], offsets[position + 1]
+    user_days = days[first:last]
+    if start is not None:
+        first += np.searchsorted(user_days, np.datetime64(start, 'D'), side='left')
+    if end is not None:
+        last = offsets[position] + np.searchsorted(user_days, np.datetime64(end, 'D'), side='left')
+    return int(first), int(last)
+
+def _amounts(df: pd.DataFrame) -> pd.Series:
+    """The transaction amounts as float64, whatever width the dataframe stores them in"""
+    return pd.Series(restore_amounts(df['transaction_amount'].to_numpy()), index=df.index)
+
+def _save_arrays(path: Path, source: tuple[int, int], **arrays: np.ndarray) -> None:
+    """
+    Write named arrays to a single .npz file, tagged with the transactions file they came from
+
+    Args:
+        path: where to write the arrays
+        source: the (mtime_ns, size) of the transactions file
+        arrays: the arrays to store
+    """
+    temp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}") # Workers warming at once each write their own
+    with open(temp_path, "wb") as f:
+        np.savez(f, source=np.array(source, dtype=np.int64), **arrays)
+    os.replace(temp_path, path) # Readers only ever see a complete file
+
+def _load_arrays(path: Path, source: tuple[int, int]) -> Optional[dict[str, np.ndarray]]:
+    """
+    Read back arrays written by _save_arrays
+
+    Args:
+        path: where the arrays were written
+        source: the (mtime_ns, size) of the current transactions file
+
+    Returns:
+        Optional[dict[str, np.ndarray]]: the arrays, or None if the file is missing, unreadable or stale
+    """
+    try:
+        with np.load(path, allow_pickle=False) as stored:
+            if tuple(stored['source'].tolist()) != tuple(source):
+                return None
+            return {name: stored[name] for name in stored.files if name != 'source'}
+    except (OSError, KeyError, ValueError):
+        return None # A missing or unreadable file is simply rebuilt
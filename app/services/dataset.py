@@ -0,0 +1,756 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Awaitable, BinaryIO, Callable, Optional
+
+import numpy as np
+
+from ..config import UPLOADS_DIR, DATASET_MODE, SHARED_DATASET, COMPACTION_SEGMENTS
+from .aggregates import DailyRollup, ProductTotals, QuantileRollup, UserIndex, UserTotals
+from .executor import run_in_process, run_in_thread
+from .metrics import rows_processed, timed
+from .range_index import UserSlices
+from .snapshot import EncodedColumn, read_snapshot, remove_stale_snapshots, restore_amounts, snapshot_path, write_snapshot
+from .transaction_validator import REQUIRED_HEADERS, TIMESTAMP_FORMAT
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+class DatasetError(Exception):
+    """Raised when the uploaded dataset cannot be turned into usable data"""
+    pass
+
+class StaleDatasetError(DatasetError):
+    """Raised when the file a dataset was created for has been replaced on disk before it was loaded"""
+    pass
+
+DATASET_PATH = UPLOADS_DIR / "latest.csv"
+COMPACT = DATASET_MODE == "compact"
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class DatasetVersion:
+    """Identifies one particular state of the uploaded transactions file"""
+    generation: int # Bumped by every upload handled in this process
+    mtime_ns: int # Catches out-of-band changes made to the file on disk
+    size: int
+    segments: int = 0 # Appended segments not yet compacted into the file
+    segments_mtime_ns: int = 0
+
+    @property
+    def tag(self) -> str:
+        """Compact string form of the version, safe to embed in cache keys"""
+        tag = f"{self.generation}-{self.mtime_ns}-{self.size}"
+        return f"{tag}-{self.segments}" if self.segments else tag
+
+    @property
+    def modified_ns(self) -> int:
+        """When the data last changed, counting appends as well as replacements"""
+        return max(self.mtime_ns, self.segments_mtime_ns)
+
+class Dataset:
+    """
+    Everything derived from a single version of the transactions file, together with any
+    segments appended to it since it was uploaded.
+
+    Each component is built at most once: concurrent callers asking for a component
+    that is still being built wait on the same load rather than starting their own.
+    When shared, every component large enough to matter is mapped from files that all
+    processes serving the dataset map together, rather than held privately.
+
+    A dataset created by an append is given the dataset it extends, and takes over whatever
+    that one had already loaded, so only the new segment's rows are read and aggregated.
+    """
+
+    def __init__(
+            self,
+            path: Path,
+            version: DatasetVersion,
+            shared: bool = False,
+            segments: tuple[Path, ...] = (),
+            previous: Optional["Dataset"] = None
+        ):
+        self.path = path
+        self.version = version
+        self.shared = shared
+        self.segments = segments
+        self._previous = previous
+        self._lock = threading.Lock()
+        self._loads: dict[str, Future] = {}
+
+    async def frame(self) -> pd.DataFrame:
+        """
+        The transactions sorted by timestamp, mapped from the columnar snapshot of the file.
+        In compact mode transaction_id is left out and timestamps and amounts keep their narrowed types.
+        Appended segments are merged in, which copies the columns until the segments are compacted
+        """
+        if not self.segments:
+            return await self._base_frame()
+        return await self._load_once("frame", self._merge_frames)
+
+    async def user_index(self) -> UserIndex:
+        """Per-user aggregates, read from disk when a matching index was persisted earlier"""
+        if not self.segments:
+            return await self._load_once("user_index", self._read_user_index)
+        return await self._load_once("user_index", lambda: self._read_merged("user_index", UserIndex))
+
+    async def daily_rollup(self) -> DailyRollup:
+        """Per-user, per-day aggregates, read from disk when a matching rollup was persisted earlier"""
+        if not self.segments:
+            return await self._load_once("daily_rollup", self._read_daily_rollup)
+        return await self._load_once("daily_rollup", lambda: self._read_merged("daily_rollup", DailyRollup))
+
+    async def quantile_rollup(self) -> QuantileRollup:
+        """Per-user, per-day quantile sketches, read from disk when matching sketches were persisted earlier"""
+        if not self.segments:
+            return await self._load_once("quantile_rollup", self._read_quantile_rollup)
+        return await self._load_once("quantile_rollup", lambda: self._read_merged("quantile_rollup", QuantileRollup))
+
+    async def user_totals(self) -> UserTotals:
+        """Daily counts and totals of each user, arranged for ranking users over a window of days"""
+        if not self.segments:
+            return await self._load_once("user_totals", lambda: self._read_persisted("user_totals", UserTotals))
+        return await self._load_once("user_totals", lambda: self._read_merged("user_totals", UserTotals))
+
+    async def product_totals(self) -> ProductTotals:
+        """Daily counts and totals of each product, arranged for ranking products over a window of days"""
+        if not self.segments:
+            return await self._load_once("product_totals", lambda: self._read_persisted("product_totals", ProductTotals))
+        return await self._load_once("product_totals", lambda: self._read_merged("product_totals", ProductTotals))
+
+    async def user_slices(self) -> UserSlices:
+        """
+        Each user's transactions as contiguous time-sorted positions, locating any time range of them with
+        two binary searches. Only exports use them, so they are built on first use rather than by warm
+        """
+        return await self._load_once("user_slices", self._build_user_slices)
+
+    async def transaction_ids(self) -> EncodedColumn:
+        """
+        Transaction IDs in the same row order as the frame. Compact frames leave them out, so they are
+        mapped from the snapshots and only decoded for the rows asked for
+        """
+        return await self._load_once("transaction_ids", self._map_transaction_ids)
+
+    async def warm(self) -> None:
+        """Build every component up front, so the first queries after an upload are fast"""
+        await self.frame()
+        await self.user_index()
+        await self.daily_rollup()
+        await self.quantile_rollup()
+        await self.user_totals()
+        await self.product_totals()
+        self._previous = None # Everything worth taking over has been, so let the older dataset go
+
+    @property
+    def source(self) -> tuple[int, ...]:
+        """The on-disk identity of the file, which survives restarts unlike the generation"""
+        return (self.version.mtime_ns, self.version.size)
+
+    @property
+    def layout(self) -> tuple[int, ...]:
+        """The on-disk identity of the file together with its appended segments"""
+        return self.source + (len(self.segments),) if self.segments else self.source
+
+    async def _load_once(self, name: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run the loader for a component once and share its result with every caller
+
+        Args:
+            name: The component being loaded
+            loader: Coroutine function building the component
+
+        Returns:
+            Any: The loaded component
+        """
+        with self._lock:
+            future = self._loads.get(name)
+            is_owner = future is None
+            if is_owner:
+                future = self._loads[name] = Future()
+
+        if is_owner:
+            try:
+                inherited = self._inherited(name)
+                future.set_result(inherited if inherited is not None else await loader())
+            except BaseException as e:
+                future.set_exception(e)
+                with self._lock:
+                    self._loads.pop(name, None) # Let the next caller retry a failed load
+
+        # wrap_future hands the shared result over safely, even to callers on another thread's event loop
+        return await asyncio.wrap_future(future)
+
+    def _extended(self) -> Optional["Dataset"]:
+        """The dataset this one extends, if it covers the same file and a leading run of the same segments"""
+        previous = self._previous
+        if previous is None or previous.source != self.source or previous.segments != self.segments[:len(previous.segments)]:
+            return None
+        return previous
+
+    def _inherited(self, name: str) -> Any:
+        """
+        A component the dataset this one extends has already loaded, if it is equally valid here
+
+        Args:
+            name: The component being loaded
+
+        Returns:
+            Any: The previous dataset's component, or None if it has to be loaded afresh
+        """
+        previous = self._extended()
+        if previous is None:
+            return None
+        # Components covering every segment only carry over when no segments were added
+        if not (name == "base_frame" or name.startswith("segment:")) and previous.segments != self.segments:
+            return None
+        return _loaded(previous._loads.get(name))
+
+    async def _base_frame(self) -> pd.DataFrame:
+        """The transactions of the uploaded file alone, without any appended segments"""
+        return await self._load_once("base_frame", self._read_frame)
+
+    async def _segment_frame(self, segment: Path) -> pd.DataFrame:
+        """The transactions of one appended segment"""
+        async def read() -> pd.DataFrame:
+            stat = await run_in_thread(os.stat, segment)
+            return await self._read_columns(segment, (stat.st_mtime_ns, stat.st_size))
+        return await self._load_once(f"segment:{segment.name}", read)
+
+    async def _read_frame(self) -> pd.DataFrame:
+        return await self._read_columns(self.path, self.source)
+
+    async def _read_columns(self, csv_path: Path, source: tuple[int, ...]) -> pd.DataFrame:
+        """Memory-map the columnar snapshot of a file, converting the CSV into one first if needed"""
+        columns_path = snapshot_path(csv_path, source)
+
+        dataframe = await run_in_thread(read_snapshot, columns_path, COMPACT)
+        if dataframe is None:
+            # Parsing holds the GIL for long stretches, so it runs in another process which hands back only the snapshot
+            with timed("parse"):
+                await run_in_process(convert_to_snapshot, csv_path, columns_path, source)
+            dataframe = await run_in_thread(read_snapshot, columns_path, COMPACT)
+            if dataframe is None:
+                raise DatasetError("Failed to convert the transaction data")
+            rows_processed.inc(len(dataframe), "parse")
+
+        return dataframe
+
+    async def _merge_frames(self) -> pd.DataFrame:
+        frames = [await self._base_frame()]
+        for segment in self.segments:
+            frames.append(await self._segment_frame(segment))
+        return await run_in_thread(merge_frames, frames)
+
+    async def _map_transaction_ids(self) -> EncodedColumn:
+        frames = [await self._base_frame()] # Converts the file into a snapshot first if needed
+        sources = [(self.path, self.source)]
+        for segment in self.segments:
+            frames.append(await self._segment_frame(segment))
+            stat = await run_in_thread(os.stat, segment)
+            sources.append((segment, (stat.st_mtime_ns, stat.st_size)))
+
+        parts = []
+        for csv_path, source in sources:
+            column = await run_in_thread(EncodedColumn.map, snapshot_path(csv_path, source), "transaction_id")
+            if column is None:
+                raise DatasetError("Failed to read the transaction IDs")
+            parts.extend(column.parts)
+
+        # Segments are merged into timestamp order, so rows are mapped back through the same ordering
+        order = await run_in_thread(merge_order, frames) if self.segments else None
+        return EncodedColumn(parts, order)
+
+    async def _read_merged(self, name: str, structure: type) -> Any:
+        """
+        Combine the structure of the uploaded file with the structure of each appended segment,
+        starting from the previous dataset's structure when this one extends it
+
+        Args:
+            name: The name the structure is persisted under
+            structure: A class providing load, from_frame, save and merge
+
+        Returns:
+            Any: The structure covering the file and every segment
+        """
+        previous = self._extended()
+        merged = _loaded(previous._loads.get(name)) if previous is not None else None
+        start = len(previous.segments) if merged is not None else 0
+
+        if merged is None:
+            merged = await self._read_persisted(name, structure)
+
+        # Only the appended rows are aggregated, the rest is combined from aggregates that already exist
+        for segment in self.segments[start:]:
+            addition = await run_in_thread(structure.from_frame, await self._segment_frame(segment))
+            merged = await run_in_thread(merged.merge, addition)
+        return merged
+
+    async def _read_user_index(self) -> UserIndex:
+        return await self._read_persisted("user_index", UserIndex)
+
+    async def _read_daily_rollup(self) -> DailyRollup:
+        return await self._read_persisted("daily_rollup", DailyRollup)
+
+    async def _read_quantile_rollup(self) -> QuantileRollup:
+        return await self._read_persisted("quantile_rollup", QuantileRollup)
+
+    async def _build_user_slices(self) -> UserSlices:
+        if not self.shared:
+            return await run_in_thread(UserSlices.from_frame, await self.frame())
+
+        path = shared_path(self.path, "user_slices", self.layout)
+        slices = await run_in_thread(UserSlices.load, path)
+        if slices is None:
+            built = await run_in_thread(UserSlices.from_frame, await self.frame())
+            await run_in_thread(built.save, path)
+            # Map the published copy too, so this process holds no private copy of its own
+            slices = await run_in_thread(UserSlices.load, path) or built
+        return slices
+
+    async def _read_persisted(self, name: str, structure: type) -> Any:
+        """
+        Reuse a structure persisted next to this file if it was built from it, otherwise build and persist it
+
+        Args:
+            name: The name the structure is persisted under
+            structure: A class providing load, from_frame and save
+
+        Returns:
+            Any: The loaded or freshly built structure
+        """
+        path = derived_path(self.path, name)
+
+        loaded = await run_in_thread(structure.load, path, self.source)
+        if loaded is None:
+            frame = await self._base_frame()
+            loaded = await run_in_thread(structure.from_frame, frame)
+            # A dataset still loading after its file was replaced must not overwrite what the new file persisted
+            if await run_in_thread(file_source, self.path) == self.source:
+                await run_in_thread(loaded.save, path, self.source)
+        return loaded
+
+def _loaded(future: Optional[Future]) -> Any:
+    """The result of a load that has already completed successfully, otherwise None"""
+    if future is None or not future.done() or future.exception() is not None:
+        return None
+    return future.result()
+
+def parse_transactions_csv(path: Path | BinaryIO) -> pd.DataFrame:
+    """
+    Parse an uploaded CSV, which is the expensive step the snapshot exists to avoid repeating
+
+    Args:
+        path: The transactions file, or the file already opened
+
+    Returns:
+        pd.DataFrame: The transactions, sorted by timestamp
+    """
+    # Read CSV with appropriate data types, straight from the file rather than via an in-memory string
+    dataframe = pd.read_csv(
+        path,
+        usecols=REQUIRED_HEADERS,
+        dtype={
+            'transaction_id': 'str',
+            'user_id': 'str',
+            'product_id': 'str',
+            'transaction_amount': 'float64'
+        },
+        parse_dates=['timestamp'],
+        date_format=TIMESTAMP_FORMAT
+    )
+
+    if dataframe.empty:
+        raise DatasetError("No transaction data available")
+
+    # Sort the dataframe by timestamp for better indexing, the snapshot keeps this order so it is only done once
+    return dataframe.sort_values('timestamp', ignore_index=True)
+
+def convert_to_snapshot(csv_path: Path, columns_path: Path, source: Optional[tuple[int, ...]] = None) -> None:
+    """
+    Parse a transactions CSV and publish it as a columnar snapshot. Runs on the process pool
+
+    Args:
+        csv_path: The transactions file
+        columns_path: Where to write the snapshot
+        source: The (mtime_ns, size) the snapshot is named after, checked against the file that is opened
+
+    Raises:
+        StaleDatasetError: If the file was replaced, so the snapshot would hold another version under this name
+    """
+    with open(csv_path, "rb") as f:
+        # The identity of the open file, which a later replacement cannot change while it is being read
+        stat = os.fstat(f.fileno())
+        if source is not None and (stat.st_mtime_ns, stat.st_size) != tuple(source):
+            raise StaleDatasetError("The transaction data was replaced while loading, please try again")
+        dataframe = parse_transactions_csv(f)
+    write_snapshot(dataframe, columns_path)
+
+def file_source(path: Path) -> Optional[tuple[int, int]]:
+    """
+    Args:
+        path: A transactions file
+
+    Returns:
+        Optional[tuple[int, int]]: The (mtime_ns, size) identifying the file's current version, None if it is missing
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def merge_frames(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Combine the frames of the uploaded file and its segments into one, sorted by timestamp
+
+    Args:
+        frames: frames read from snapshots, all with the same columns
+
+    Returns:
+        pd.DataFrame: every transaction, in timestamp order
+    """
+    columns = {}
+    for column in frames[0].columns:
+        parts = [frame[column] for frame in frames]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            columns[column] = pd.api.types.union_categoricals(parts) # Each snapshot has its own dictionary of values
+        elif len({part.dtype for part in parts}) > 1 and any(part.dtype == np.float32 for part in parts):
+            # Amounts stay float32 only if every snapshot narrowed them, otherwise each is restored to its exact values
+            columns[column] = np.concatenate([restore_amounts(part.to_numpy()) for part in parts])
+        else:
+            columns[column] = np.concatenate([part.to_numpy() for part in parts])
+
+    merged = pd.DataFrame(columns)
+    return merged.take(merge_order(frames)).reset_index(drop=True)
+
+def merge_order(frames: list[pd.DataFrame]) -> np.ndarray:
+    """
+    Args:
+        frames: frames read from snapshots, all with the same columns
+
+    Returns:
+        np.ndarray: for each row of the merged frame, its position among the frames laid end to end
+    """
+    return np.argsort(np.concatenate([frame['timestamp'].to_numpy() for frame in frames]), kind='stable')
+
+def concatenate_csv(base: Path, segments: tuple[Path, ...], destination: Path) -> None:
+    """
+    Write the uploaded file followed by the rows of each segment as one CSV. Segments whose
+    columns match the file are copied byte for byte, others are reordered to match it
+
+    Args:
+        base: the uploaded transactions file
+        segments: the appended segments, in order
+        destination: where to write the combined file
+    """
+    with open(base, "rb") as source:
+        header = source.readline()
+    columns = header.decode("utf-8").strip().split(",")
+
+    with open(destination, "w+b") as output:
+        with open(base, "rb") as source:
+            shutil.copyfileobj(source, output)
+        for segment in segments:
+            _ensure_newline(output)
+            with open(segment, "rb") as source:
+                if source.readline() == header:
+                    shutil.copyfileobj(source, output)
+                    continue
+            frame = pd.read_csv(segment, dtype=str, keep_default_na=False)
+            output.write(frame.reindex(columns=columns, fill_value="").to_csv(header=False, index=False).encode("utf-8"))
+
+def _ensure_newline(output) -> None:
+    """Terminate the last line written so far, in case its file had no trailing newline"""
+    if output.tell() == 0:
+        return
+    output.seek(-1, os.SEEK_END)
+    if output.read(1) != b"\n":
+        output.write(b"\n")
+
+def derived_path(dataset_path: Path, name: str) -> Path:
+    """Structures derived from the transactions file are kept right next to it"""
+    return dataset_path.with_name(f"{dataset_path.stem}.{name}.npz")
+
+def shared_path(dataset_path: Path, name: str, layout: tuple[int, ...]) -> Path:
+    """Structures shared between processes are published per version, so a mapped copy is never overwritten"""
+    return dataset_path.with_name(f"{dataset_path.stem}.{name}.{'-'.join(map(str, layout))}")
+
+def segments_path(dataset_path: Path) -> Path:
+    """Appended segments are kept in a directory next to the file, one CSV per append"""
+    return dataset_path.with_name(f"{dataset_path.stem}.segments")
+
+def version_path(dataset_path: Path) -> Path:
+    """The header naming the version of the transactions file every process should serve"""
+    return dataset_path.with_name(f"{dataset_path.stem}.version")
+
+def read_version_header(path: Path) -> Optional[DatasetVersion]:
+    """
+    Args:
+        path: the version header
+
+    Returns:
+        Optional[DatasetVersion]: the published version, or None if nothing has been published
+    """
+    try:
+        with open(path) as f:
+            return DatasetVersion(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+def write_version_header(path: Path, version: DatasetVersion) -> None:
+    """
+    Publish a version for every process to switch to. The header is replaced in one step,
+    so readers see either the old version or the new one and never a mix
+
+    Args:
+        path: the version header
+        version: the version whose structures have all been published
+    """
+    temp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    with open(temp_path, "w") as f:
+        json.dump(asdict(version), f)
+    os.replace(temp_path, path)
+
+class DatasetCache:
+    """
+    Process-wide cache holding the dataset built from the latest upload.
+
+    The version is recomputed from a cheap stat() on every lookup, so a file replaced
+    behind the application's back is picked up on the next request.
+
+    When shared, the version comes from a header published next to the file instead. The
+    process handling an upload builds and publishes every structure first, then replaces the
+    header, and every other process switches to the new version on its next lookup without
+    parsing anything itself.
+
+    Appends are kept as segments beside the file. Once enough have built up they are compacted
+    into the file in the background, so lookups go back to reading a single mapped snapshot.
+    """
+
+    def __init__(self, path: Path, shared: bool = SHARED_DATASET, compaction_segments: int = COMPACTION_SEGMENTS):
+        self.path = path
+        self.shared = shared
+        self.compaction_segments = compaction_segments
+        self.header_path = version_path(path)
+        self.segments_dir = segments_path(path)
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._generation = 0
+        self._current: Optional[Dataset] = None
+        self._header: Optional[tuple[tuple[int, int], Optional[DatasetVersion]]] = None # Header file identity and its contents
+        self._segments: Optional[tuple[int, tuple[Path, ...]]] = None # Segments directory mtime and its segments
+
+    def current_version(self) -> DatasetVersion:
+        """
+        Returns:
+            DatasetVersion: The version of the file currently on disk, or the published version when shared
+
+        Raises:
+            FileNotFoundError: If nothing has been uploaded yet
+        """
+        if self.shared:
+            published = self._published_version()
+            if published is not None:
+                return published
+
+        return self._version_on_disk(self._generation)
+
+    def current(self) -> Dataset:
+        """
+        Returns:
+            Dataset: The dataset matching the file on disk, replacing any stale one
+        """
+        with self._lock:
+            version = self.current_version()
+            if self._current is None or self._current.version != version:
+                self._current = Dataset(self.path, version, self.shared, self._list_segments()[:version.segments])
+            return self._current
+
+    async def refresh(self) -> Dataset:
+        """
+        Mark the file as replaced by an upload and load the new version straight away.
+        When shared, the new version is published to the other processes once it is loaded
+
+        Returns:
+            Dataset: The freshly loaded dataset
+        """
+        with self._lock:
+            shutil.rmtree(self.segments_dir, ignore_errors=True) # Segments extended the file that was replaced
+            self._segments = None
+            dataset = self._current = self._next_dataset()
+
+        return await self._publish(dataset)
+
+    async def append(self, segment: Path) -> Dataset:
+        """
+        Add a validated upload to the dataset as a new segment. Only the new rows are read,
+        and the aggregates are updated from the ones already loaded
+
+        Args:
+            segment: The validated upload, which is moved into the dataset
+
+        Returns:
+            Dataset: The dataset including the new segment
+        """
+        with self._lock:
+            if not self.path.exists():
+                os.replace(segment, self.path) # Nothing to append to, so the segment becomes the file
+                first_upload = True
+            else:
+                existing = self._list_segments()
+                # Named by time so they sort in the order they were added, surviving restarts and compactions
+                number = max(time.time_ns(), int(existing[-1].stem) + 1 if existing else 0)
+                self.segments_dir.mkdir(exist_ok=True)
+                os.replace(segment, self.segments_dir / f"{number:020d}.csv")
+                self._segments = None
+                first_upload = False
+
+        if first_upload:
+            return await self.refresh()
+
+        with self._lock:
+            dataset = self._current = self._next_dataset(previous=self._current)
+
+        dataset = await self._publish(dataset)
+        if len(dataset.segments) >= self.compaction_segments:
+            self.compact_in_background()
+        return dataset
+
+    async def compact(self) -> Optional[Dataset]:
+        """
+        Fold every appended segment into the file. The combined file, its snapshot and its aggregates
+        are all prepared before anything is replaced, so lookups carry on against the segmented
+        dataset until the compacted one is ready
+
+        Returns:
+            Optional[Dataset]: The compacted dataset, or None if there was nothing to compact
+        """
+        if not self._compaction_lock.acquire(blocking=False):
+            return None # Already being compacted
+        try:
+            dataset = self.current()
+            if not dataset.segments:
+                return None
+
+            temp_path = self.path.with_name(f".{self.path.name}.compact-{os.getpid()}.tmp")
+            try:
+                await run_in_thread(concatenate_csv, self.path, dataset.segments, temp_path)
+                stat = await run_in_thread(os.stat, temp_path)
+                source = (stat.st_mtime_ns, stat.st_size) # Renaming keeps both, so this is the identity the file will have
+
+                await run_in_process(convert_to_snapshot, temp_path, snapshot_path(self.path, source))
+                # The aggregates already cover every segment, so they are persisted rather than rebuilt
+                await run_in_thread((await dataset.user_index()).save, derived_path(self.path, "user_index"), source)
+                await run_in_thread((await dataset.daily_rollup()).save, derived_path(self.path, "daily_rollup"), source)
+                await run_in_thread((await dataset.quantile_rollup()).save, derived_path(self.path, "quantile_rollup"), source)
+                await run_in_thread((await dataset.user_totals()).save, derived_path(self.path, "user_totals"), source)
+                await run_in_thread((await dataset.product_totals()).save, derived_path(self.path, "product_totals"), source)
+
+                compacted = Dataset(self.path, DatasetVersion(0, *source), self.shared)
+                await compacted.warm()
+
+                with self._lock:
+                    stat = os.stat(self.path)
+                    if (stat.st_mtime_ns, stat.st_size) != dataset.source or not all(segment.exists() for segment in dataset.segments):
+                        return None # Replaced by a new upload in the meantime, so there is nothing left to compact
+                    os.replace(temp_path, self.path)
+                    # Only now that the compacted file is in place is the replaced file's snapshot stale
+                    remove_stale_snapshots(snapshot_path(self.path, source))
+                    for segment in dataset.segments:
+                        _remove_segment(segment)
+                    self._segments = None
+                    # Segments appended while compacting stay as segments of the compacted file
+                    dataset = self._current = self._next_dataset(previous=compacted)
+            finally:
+                if temp_path.exists():
+                    temp_path.unlink()
+
+            return await self._publish(dataset)
+        finally:
+            self._compaction_lock.release()
+
+    def compact_in_background(self) -> None:
+        """Compact on a thread of its own, so neither the upload nor the event loop waits for it"""
+        def run() -> None:
+            try:
+                asyncio.run(self.compact())
+            except Exception:
+                logger.exception("Compacting appended segments failed, they will be retried on the next append")
+
+        threading.Thread(target=run, name="dataset-compaction", daemon=True).start()
+
+    def _next_dataset(self, previous: Optional[Dataset] = None) -> Dataset:
+        """A dataset for the files on disk under a new generation. Must be called holding the lock"""
+        published = self._published_version() if self.shared else None
+        # Generations count uploads across every process sharing the dataset
+        self._generation = max(self._generation, published.generation if published else 0) + 1
+        version = self._version_on_disk(self._generation)
+        return Dataset(self.path, version, self.shared, self._list_segments()[:version.segments], previous)
+
+    async def _publish(self, dataset: Dataset) -> Dataset:
+        """Load a new dataset, then make it the one every process serves"""
+        await dataset.warm()
+
+        if self.shared:
+            write_version_header(self.header_path, dataset.version)
+            with self._lock:
+                self._current = dataset # Lookups made while loading were still served the previous version
+        return dataset
+
+    def _version_on_disk(self, generation: int) -> DatasetVersion:
+        stat = os.stat(self.path)
+        segments = self._list_segments()
+        # Keyed on the segment files rather than their directory, whose mtime also moves whenever a
+        # segment's snapshot is written into it, which would make a freshly published dataset look stale
+        segments_mtime_ns = max((_modified_ns(segment) for segment in segments), default=0)
+        return DatasetVersion(generation, stat.st_mtime_ns, stat.st_size, len(segments), segments_mtime_ns)
+
+    def _list_segments(self) -> tuple[Path, ...]:
+        """The appended segments in the order they were added, only listed again when the directory changes"""
+        try:
+            mtime_ns = os.stat(self.segments_dir).st_mtime_ns
+        except FileNotFoundError:
+            return ()
+
+        cached = self._segments
+        if cached is None or cached[0] != mtime_ns:
+            cached = self._segments = (mtime_ns, tuple(sorted(self.segments_dir.glob("*.csv"))))
+        return cached[1]
+
+    def _published_version(self) -> Optional[DatasetVersion]:
+        """The version in the header, only read again when the header file has been replaced"""
+        try:
+            stat = os.stat(self.header_path)
+        except FileNotFoundError:
+            return None
+
+        identity = (stat.st_ino, stat.st_mtime_ns)
+        if self._header is None or self._header[0] != identity:
+            self._header = (identity, read_version_header(self.header_path))
+        return self._header[1]
+
+def _modified_ns(path: Path) -> int:
+    """When a file was last changed, 0 if it was removed since it was listed"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def _remove_segment(segment: Path) -> None:
+    """Delete a compacted segment along with its snapshot"""
+    segment.unlink(missing_ok=True)
+    for columns in segment.parent.glob(f"{segment.stem}.*.columns"):
+        shutil.rmtree(columns, ignore_errors=True)
+
+dataset_cache = DatasetCache(DATASET_PATH)
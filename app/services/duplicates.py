@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+from typing import Literal, get_args
+
+import numpy as np
+
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+# "allow" skips the check, "detect" counts repeated IDs, "reject" refuses the upload and "keep_first" drops every repeat
+DuplicateMode = Literal["allow", "detect", "reject", "keep_first"]
+DUPLICATE_MODES = get_args(DuplicateMode)
+NO_ID = np.uint64(0) # Stands in for missing IDs, which never count as duplicates
+LOOKUP_BLOCK = 1 << 20 # Records checked against the repeated hashes at a time
+
+def hash_ids(ids: pd.Series) -> np.ndarray:
+    """
+    64-bit hashes of a chunk's transaction IDs, one per record. Runs in a worker process alongside
+    validation, so only 8 bytes per row are sent back rather than the IDs themselves.
+
+    Args:
+        ids: The transaction_id column parsed from the chunk
+
+    Returns:
+        np.ndarray: uint64 hashes in record order, NO_ID for missing IDs
+    """
+    hashes = pd.util.hash_array(ids.to_numpy(dtype=object), categorize=False)
+    hashes[hashes == NO_ID] = 1 # Keep the placeholder free, a collision with it is as unlikely as any other
+    hashes[ids.isna().to_numpy()] = NO_ID
+    return hashes
+
+class IdHashes:
+    """
+    The hashed transaction IDs of a whole upload, in file order, from which repeated IDs are found
+    with one sort. Each record costs 8 bytes however long its ID, where a set of the ID strings costs
+    well over 100, and a false match needs two of a few million IDs to share all 64 bits of a hash.
+    """
+
+    def __init__(self):
+        self._parts: list[np.ndarray] = [] # Hashes of each chunk, in file order
+
+    def add(self, hashes: np.ndarray) -> None:
+        """
+        Args:
+            hashes: Hashes of the next chunk's records, from hash_ids
+        """
+        self._parts.append(hashes)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(part.nbytes for part in self._parts)
+
+    def duplicates(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Positions of the records after the header whose ID already appeared in an
+                earlier record, ascending. The first record with each ID is never included
+        """
+        if len(self._parts) != 1:
+            self._parts = [np.concatenate(self._parts) if self._parts else np.empty(0, dtype=np.uint64)]
+        hashes = self._parts[0]
+
+        # Sorting the values alone is far cheaper than an argsort, and usually shows there is nothing to do
+        ordered = np.sort(hashes)
+        repeated = np.unique(ordered[1:][(ordered[1:] == ordered[:-1]) & (ordered[1:] != NO_ID)])
+        del ordered
+        if len(repeated) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        # Only records holding a repeated ID are ranked, keeping the first of each. A bitmap of the
+        # repeated hashes' low bits, a one hash Bloom filter small enough to stay in cache, rules out most
+        # records before the binary search, and they are checked a block at a time to bound the temporaries
+        size = 1 << max(16, (len(repeated) * 8 - 1).bit_length())
+        mask = np.uint64(size - 1)
+        bitmap = np.zeros(size, dtype=bool)
+        bitmap[repeated & mask] = True
+
+        candidates = []
+        for start in range(0, len(hashes), LOOKUP_BLOCK):
+            block = hashes[start:start + LOOKUP_BLOCK]
+            maybe = np.flatnonzero(bitmap[block & mask])
+            slots = np.minimum(np.searchsorted(repeated, block[maybe]), len(repeated) - 1)
+            candidates.append(maybe[repeated[slots] == block[maybe]] + start)
+        candidates = np.concatenate(candidates)
+        _, first = np.unique(hashes[candidates], return_index=True)
+        return np.delete(candidates, first)
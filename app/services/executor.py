@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+from ..config import THREAD_POOL_SIZE, PROCESS_POOL_SIZE, VALIDATION_WORKERS, MAX_CONCURRENT_UPLOADS
+
+class UploadsBusyError(Exception):
+    """Raised when an upload arrives while the maximum number of uploads are already in progress"""
+    pass
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+_validation_pool: Optional[ProcessPoolExecutor] = None
+_upload_slots = threading.BoundedSemaphore(MAX_CONCURRENT_UPLOADS)
+
+def thread_pool() -> ThreadPoolExecutor:
+    """The shared pool for pandas/NumPy work, which releases the GIL for most of its run time"""
+    global _thread_pool
+    with _lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix="dataset")
+        return _thread_pool
+
+def process_pool() -> Executor:
+    """The shared pool for CSV parsing, which holds the GIL too long to share a process with requests"""
+    global _process_pool
+    if PROCESS_POOL_SIZE <= 0:
+        return thread_pool()
+
+    with _lock:
+        if _process_pool is None:
+            # Spawned rather than forked, as forking a process that is already running threads is unsafe
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PROCESS_POOL_SIZE,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+def validation_pool() -> Optional[Executor]:
+    """
+    The shared pool validating upload chunks across every core, or None when chunks
+    should be validated in the calling thread instead
+    """
+    global _validation_pool
+    if VALIDATION_WORKERS <= 0:
+        return None
+
+    with _lock:
+        if _validation_pool is None:
+            _validation_pool = ProcessPoolExecutor(
+                max_workers=VALIDATION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _validation_pool
+
+async def run_in_thread(function: Callable[..., T], *args: Any) -> T:
+    """
+    Run blocking work on the thread pool, keeping the event loop free for other requests
+
+    Args:
+        function: The blocking callable
+        args: Arguments to call it with
+
+    Returns:
+        The result of the call
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context() # Carries the request's context, so stages timed on the thread still reach its Server-Timing
+    return await loop.run_in_executor(thread_pool(), functools.partial(context.run, function, *args))
+
+async def run_in_process(function: Callable[..., T], *args: Any) -> T:
+    """
+    Run CPU-bound work on the process pool. The function and its arguments must be picklable,
+    and results should be small as they are copied back to this process.
+
+    Args:
+        function: A module-level callable
+        args: Arguments to call it with
+
+    Returns:
+        The result of the call
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(process_pool(), functools.partial(function, *args))
+
+@contextmanager
+def upload_slot() -> Iterator[None]:
+    """
+    Hold one of the limited upload slots for the duration of an upload
+
+    Raises:
+        UploadsBusyError: If every slot is taken
+    """
+    if not _upload_slots.acquire(blocking=False):
+        raise UploadsBusyError("Too many uploads in progress, please try again shortly")
+    try:
+        yield
+    finally:
+        _upload_slots.release()
+
+def shutdown() -> None:
+    """Stop the pools, waiting for any work already submitted"""
+    global _thread_pool, _process_pool, _validation_pool
+    with _lock:
+        for pool in (_validation_pool, _process_pool, _thread_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        _thread_pool = _process_pool = _validation_pool = None
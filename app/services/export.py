@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import date
+from typing import Iterator, Optional
+
+import numpy as np
+
+from ..config import STORAGE_BACKEND
+from .dataset import Dataset
+from .snapshot import EncodedColumn, restore_amounts
+from .executor import run_in_thread
+from .metrics import timed
+from .sqlite_store import transaction_store
+from .transaction_summary import SummaryError, current_version, parse_date, parse_date_range, with_current_dataset
+from .transaction_validator import REQUIRED_HEADERS
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+class ExportError(Exception):
+    """Raised when a page of transactions cannot be exported"""
+    pass
+
+class StaleCursorError(ExportError):
+    """Raised when a cursor was issued for a version of the dataset that has since been replaced"""
+    pass
+
+EXPORT_COLUMNS = REQUIRED_HEADERS
+SQLITE = STORAGE_BACKEND == "sqlite"
+EXPORT_BATCH_ROWS = 1000 # Rows decoded at a time while a page is written
+
+@dataclass
+class ExportPage:
+    """One page of a user's transactions, decoded a batch at a time as the response is written"""
+    batches: Iterator[list[tuple]] # Rows with the values of EXPORT_COLUMNS
+    next_cursor: Optional[str] # None on the last page
+
+async def export_transactions(
+        user_id: str,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 1000
+    ) -> ExportPage:
+    """
+    Return a page of a user's transactions in timestamp order, served from the per-user row index
+
+    Args:
+        user_id: the user whose transactions to export
+        date_from: optional start date for filtering, taken from the cursor when one is given
+        date_to: optional end date for filtering, taken from the cursor when one is given
+        cursor: where the previous page ended, None for the first page
+        limit: most rows in the page
+
+    Returns:
+        ExportPage: the rows of the page and the cursor of the next one
+
+    Raises:
+        StaleCursorError: if the dataset has changed since the cursor was issued
+        ExportError: if the request cannot be served for any other reason
+    """
+    try:
+        version = current_version().tag if SQLITE else None
+        state = decode_cursor(cursor) if cursor is not None else None
+        if state is not None:
+            if state["user_id"] != user_id:
+                raise ExportError("The cursor belongs to another user")
+            date_from, date_to = state["date_from"], state["date_to"]
+        start, end = parse_date_range(date_from, date_to)
+
+        if SQLITE:
+            _check_cursor(state, version)
+            return await _stored_page(user_id, start, end, state, limit, version)
+
+        async def page(dataset: Dataset) -> ExportPage:
+            # Checked against the dataset the page is read from, whatever is published meanwhile
+            _check_cursor(state, dataset.version.tag)
+            return await _dataset_page(dataset, user_id, start, end, state, limit, dataset.version.tag)
+        return await with_current_dataset(page)
+
+    except ExportError:
+        raise
+    except (SummaryError, ValueError) as e:
+        raise ExportError(str(e))
+    except Exception as e:
+        raise ExportError(f"Error in transaction export: {e}")
+
+def _check_cursor(state: Optional[dict], version: str) -> None:
+    """
+    Args:
+        state: the decoded cursor, None for the first page
+        version: tag of the dataset version the page would be read from
+
+    Raises:
+        StaleCursorError: if the cursor was issued for another version
+    """
+    if state is not None and state["version"] != version:
+        raise StaleCursorError("The data has changed since this cursor was issued, start again without a cursor")
+
+def encode_cursor(version: str, user_id: str, start: Optional[date], end: Optional[date], position) -> str:
+    """
+    Args:
+        version: tag of the dataset version the position refers to
+        user_id: the user being exported
+        start: first day of the export, if limited
+        end: day the export stops before, if limited
+        position: where the next page begins, in whatever form the backend uses
+
+    Returns:
+        str: an opaque, URL safe cursor
+    """
+    state = {
+        "version": version,
+        "user_id": user_id,
+        "date_from": start.isoformat() if start is not None else None,
+        "date_to": end.isoformat() if end is not None else None,
+        "position": position
+    }
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    Args:
+        cursor: a cursor made by encode_cursor
+
+    Returns:
+        dict: the state the cursor holds
+
+    Raises:
+        ExportError: if the cursor is malformed
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(state, dict) or set(state) != {"version", "user_id", "date_from", "date_to", "position"}:
+            raise ValueError("Unexpected cursor contents")
+        for day in (state["date_from"], state["date_to"]):
+            if day is not None:
+                parse_date(day)
+        return state
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError, SummaryError):
+        raise ExportError("Invalid cursor")
+
+async def _dataset_page(
+        dataset: Dataset,
+        user_id: str,
+        start: Optional[date],
+        end: Optional[date],
+        state: Optional[dict],
+        limit: int,
+        version: str
+    ) -> ExportPage:
+    """A page located with two binary searches in the user's time-sorted slice, whatever its depth"""
+    with timed("dataset_load"):
+        slices = await dataset.user_slices()
+        frame = await dataset.frame()
+        transaction_ids = await dataset.transaction_ids()
+
+    if not slices.has_user(user_id):
+        raise ExportError(f"No transactions found for user {user_id}")
+
+    first, last = slices.locate(
+        user_id,
+        np.datetime64(start, 'D') if start is not None else None,
+        np.datetime64(end, 'D') if end is not None else None
+    )
+    position = state["position"] if state is not None else first
+    if not isinstance(position, int) or not first <= position <= last:
+        raise ExportError("Invalid cursor")
+
+    stop = min(last, position + limit)
+    next_cursor = encode_cursor(version, user_id, start, end, stop) if stop < last else None
+    return ExportPage(_frame_batches(frame, transaction_ids, np.asarray(slices.rows[position:stop])), next_cursor)
+
+def _frame_batches(frame: pd.DataFrame, transaction_ids: EncodedColumn, rows: np.ndarray) -> Iterator[list[tuple]]:
+    """
+    Decode rows of the frame a batch at a time, so only the batch being written is held as Python values
+
+    Args:
+        frame: the dataset's transactions
+        transaction_ids: the transaction IDs, in the same order as the frame
+        rows: the positions in the frame to decode, in the order to write them
+    """
+    for batch_start in range(0, len(rows), EXPORT_BATCH_ROWS):
+        batch = rows[batch_start:batch_start + EXPORT_BATCH_ROWS]
+        part = frame.iloc[batch]
+
+        timestamps = np.datetime_as_string(part['timestamp'].to_numpy(dtype='datetime64[s]'), unit='s')
+        amounts = restore_amounts(part['transaction_amount'].to_numpy())
+        yield list(zip(
+            transaction_ids.take(batch).tolist(),
+            _values(part['user_id']),
+            _values(part['product_id']),
+            np.char.replace(timestamps, "T", " ").tolist(),
+            np.where(np.isnan(amounts), None, amounts).tolist()
+        ))
+
+def _values(column: pd.Series) -> list:
+    """A column's values as Python objects, None where they are missing"""
+    return np.where(column.isna().to_numpy(), None, column.to_numpy(dtype=object)).tolist()
+
+async def _stored_page(
+        user_id: str,
+        start: Optional[date],
+        end: Optional[date],
+        state: Optional[dict],
+        limit: int,
+        version: str
+    ) -> ExportPage:
+    """A page read from the SQLite backend, continuing from the last row of the previous page"""
+    after = state["position"] if state is not None else None
+    if after is not None and (not isinstance(after, list) or len(after) != 2 or not all(isinstance(value, int) for value in after)):
+        raise ExportError("Invalid cursor")
+
+    with timed("query"):
+        # One row beyond the page tells whether another page follows
+        rows = await run_in_thread(transaction_store.rows, user_id, start, end, tuple(after) if after else None, limit + 1)
+        if not rows and after is None and not await run_in_thread(transaction_store.has_user, user_id):
+            raise ExportError(f"No transactions found for user {user_id}")
+
+    page = rows[:limit]
+    next_cursor = encode_cursor(version, user_id, start, end, list(page[-1][-2:])) if len(rows) > limit else None
+    batches = [[row[:len(EXPORT_COLUMNS)] for row in page[i:i + EXPORT_BATCH_ROWS]] for i in range(0, len(page), EXPORT_BATCH_ROWS)]
+    return ExportPage(iter(batches), next_cursor)
@@ -1,67 +1,231 @@
 import os
+import shutil
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import AsyncIterator, Iterator, Optional, Sequence
 from fastapi import UploadFile
-from ..config import UPLOADS_DIR
+from ..config import UPLOADS_DIR, MAX_DECOMPRESSED_SIZE
+from .metrics import bytes_processed, record_stage
+
+try:
+    import zstandard # Optional, only needed to accept .csv.zst uploads
+except ImportError:
+    zstandard = None
 
 class FileTooLargeError(Exception):
     """Raised when an uploaded file exceeds the allowed size."""
     pass
 
-MAX_FILE_SIZE = 95 * 1024 * 1024 # 95mb limit, this would have been 100mb but Github applies 100mb limit so it is difficult to test
-CHUNK_SIZE = 8192 # 8kb chunk size to allow for reading into memory
-
-async def load_from_disk() -> bytes:
-    """
-    Attempts to load the transactions file by using the path in config.py
-
-    Returns:
-        Some bytes-like object to be processed by the upload endpoint
-    """
-    file_path = UPLOADS_DIR / "latest.csv"
+class DecompressionError(Exception):
+    """Raised when a compressed upload is corrupt, truncated or in an unsupported format."""
+    pass
 
-    try:
-        with open(file_path, "r", encoding='utf-8') as file:
-            return file.read()
-    except Exception as e:
-        raise
+MAX_FILE_SIZE = 95 * 1024 * 1024 # 95mb limit, this would have been 100mb but Github applies 100mb limit so it is difficult to test
+CHUNK_SIZE = 1024 * 1024 # 1mb chunks keep memory bounded while keeping the number of reads low
+ZSTD_INPUT_SIZE = 1024 # zstd cannot cap its output, so input is fed in slices small enough that one slice inflates to at most ~32mb
+UPLOAD_SUFFIXES = {".csv": None, ".csv.gz": "gzip", ".csv.zst": "zstd"} # Accepted file names, and the compression each implies
+CONTENT_ENCODINGS = {"identity": None, "gzip": "gzip", "x-gzip": "gzip", "zstd": "zstd"}
 
-async def load_file(file: UploadFile) -> bytes:
+async def read_upload(file: UploadFile) -> AsyncIterator[bytes]:
     """
-    Only loads the file into memory, on user upload, if it passes file constraints
+    Streams the uploaded file in chunks, enforcing the file constraints as it goes
 
     Args: 
         file: The CSV file of transaction data a user wishes to upload
     
-    Returns:
-        bytes: Some bytes-like object ready for data validation
+    Yields:
+        bytes: The next chunk of the file
     """
-
+    file_size = 0
+    reading = 0.0 # Time spent waiting on reads, not on whatever the caller does with each chunk
     try:
-        # Load the file using chunking to verify file size
-        file_size = 0
-        while chunk := await file.read(CHUNK_SIZE):
+        while True:
+            start = time.perf_counter()
+            chunk = await file.read(CHUNK_SIZE)
+            reading += time.perf_counter() - start
+            if not chunk:
+                break
+
             file_size += len(chunk)
             if file_size > MAX_FILE_SIZE:
-                raise FileTooLargeError("File is too large") # No need to read more than necessary, limit is 100mb
+                raise FileTooLargeError("File uploaded exceeds 95mb limit") # No need to read more than necessary, limit is 100mb
+            yield chunk
+    finally:
+        record_stage("read_upload", reading)
+        bytes_processed.inc(file_size, "read_upload")
 
-        file.file.seek(0) # Reset seek pointer to 0 so that it reads all contents
-        return await file.read()
-    except:
-        raise
-
-async def save_file(file: UploadFile) -> str:
+def upload_encoding(filename: str, content_encoding: Optional[str] = None) -> Optional[str]:
     """
-    Attempts to save the transactions CSV file to the uploads folder
+    Work out how an upload is compressed, from its Content-Encoding header or else its file name
 
     Args:
-        file: The validated file to be uploaded
-    
+        filename: The name the file was uploaded with
+        content_encoding: The Content-Encoding header sent with the file, if any
+
     Returns:
-        str: The raw path of the file object
+        Optional[str]: "gzip" or "zstd", or None for a plain CSV
+
+    Raises:
+        DecompressionError: If the file is not a CSV, or is compressed in a way that is not supported
     """
+    suffix = next((suffix for suffix in UPLOAD_SUFFIXES if filename.lower().endswith(suffix)), None)
+    if suffix is None:
+        raise DecompressionError("Only CSV files can be uploaded, optionally compressed as .csv.gz or .csv.zst.")
+
+    encoding = UPLOAD_SUFFIXES[suffix]
+    if content_encoding is not None and content_encoding.strip().lower() != "identity":
+        if content_encoding.strip().lower() not in CONTENT_ENCODINGS:
+            raise DecompressionError(f"Unsupported Content-Encoding: {content_encoding}")
+        encoding = CONTENT_ENCODINGS[content_encoding.strip().lower()]
+
+    if encoding == "zstd" and zstandard is None:
+        raise DecompressionError("zstd compressed uploads need the zstandard package installed")
+    return encoding
+
+class StreamDecompressor:
+    """
+    Decompresses an upload chunk by chunk, so neither the compressed nor the decompressed file is
+    ever held whole in memory. Output is produced in bounded pieces and counted against the
+    decompressed size limit as it goes, which stops a decompression bomb after at most one piece.
+    """
+
+    def __init__(self, encoding: str, max_size: int = MAX_DECOMPRESSED_SIZE):
+        self.encoding = encoding
+        self.max_size = max_size
+        self.size = 0 # Decompressed bytes produced so far
+        self._decompressor = self._new_decompressor()
+
+    def decompress(self, chunk: bytes) -> Iterator[bytes]:
+        """
+        Args:
+            chunk: The next compressed bytes of the upload
+
+        Yields:
+            bytes: Decompressed pieces of at most CHUNK_SIZE bytes (or ~32mb for zstd)
+        """
+        try:
+            pieces = self._gzip(chunk) if self.encoding == "gzip" else self._zstd(chunk)
+            for piece in pieces:
+                self.size += len(piece)
+                if self.size > self.max_size:
+                    raise FileTooLargeError(f"File exceeds the {self.max_size // (1024 * 1024)}mb limit once decompressed")
+                yield piece
+        except zlib.error as e:
+            raise DecompressionError(f"File could not be decompressed: {e}")
+        except Exception as e:
+            if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                raise DecompressionError(f"File could not be decompressed: {e}")
+            raise
+
+    def close(self) -> None:
+        """Check the compressed stream ended cleanly, rather than being cut off part way"""
+        if not self._decompressor.eof:
+            raise DecompressionError("Compressed file is truncated")
+
+    def _gzip(self, chunk: bytes) -> Iterator[bytes]:
+        data = chunk
+        while data:
+            if self._decompressor.eof:
+                self._decompressor = self._new_decompressor() # gzip files may hold several members back to back
+            piece = self._decompressor.decompress(data, CHUNK_SIZE)
+            # Input is left over either because the output cap was reached, or because a member ended
+            data = self._decompressor.unconsumed_tail or self._decompressor.unused_data
+            if piece:
+                yield piece
+
+    def _zstd(self, chunk: bytes) -> Iterator[bytes]:
+        for start in range(0, len(chunk), ZSTD_INPUT_SIZE):
+            data = chunk[start:start + ZSTD_INPUT_SIZE]
+            while data:
+                if self._decompressor.eof:
+                    self._decompressor = self._new_decompressor() # Later frames of a multi-frame file
+                piece = self._decompressor.decompress(data)
+                data = self._decompressor.unused_data if self._decompressor.eof else b""
+                if piece:
+                    yield piece
+
+    def _new_decompressor(self):
+        if self.encoding == "gzip":
+            return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS) # Expect a gzip header and trailer
+        return zstandard.ZstdDecompressor().decompressobj()
+
+def staging_path() -> Path:
+    """A unique place to save an upload that is added to the dataset rather than replacing it"""
+    return UPLOADS_DIR / f".append-{uuid.uuid4().hex}.csv"
+
+class UploadWriter:
+    """
+    Writes an upload to a temporary file next to its destination, which is only replaced
+    once the upload is committed. Uncommitted files are removed on exit.
+    """
+
+    def __init__(self, destination: Path = UPLOADS_DIR / "latest.csv"):
+        self.destination = destination
+        self.temp_path = destination.with_name(f".{destination.name}.{uuid.uuid4().hex}.tmp")
+        self._file = None
+        self._committed = False
+
+    def __enter__(self) -> "UploadWriter":
+        self.destination.parent.mkdir(parents=True, exist_ok=True) # Only write to disk if the upload directory exists
+        self._file = open(self.temp_path, "wb")
+        return self
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+
+    def drop_records(self, positions: Sequence[int]) -> None:
+        """
+        Remove CSV records from the written file before it is committed, streaming it through a second
+        temporary file so memory stays bounded by the read size. Records are counted as the CSV parser
+        counts them: a quoted field may carry a record over several lines, and blank lines are not records
+
+        Args:
+            positions: Records to remove, ascending, counted from 0 at the first record after the header
+        """
+        self._file.close()
+        filtered_path = self.temp_path.with_name(f"{self.temp_path.name}.filtered")
+        try:
+            with open(self.temp_path, "rb") as source, open(filtered_path, "wb") as target:
+                target.write(source.readline()) # The header
+                drops = iter(positions)
+                next_drop = next(drops, None)
+                record = 0
+                quoted = False # Whether the current record has a quoted field still open at the end of the line
+                dropping = False
+                for line in source:
+                    if not quoted:
+                        if not line.strip():
+                            target.write(line)
+                            continue
+                        dropping = record == next_drop
+                        if dropping:
+                            next_drop = next(drops, None)
+                        record += 1
+                    # Escaped quotes come in pairs, so an odd count opens or closes a quoted field
+                    if line.count(b'"') % 2:
+                        quoted = not quoted
+                    if not dropping:
+                        target.write(line)
+            os.replace(filtered_path, self.temp_path)
+        finally:
+            filtered_path.unlink(missing_ok=True)
+            self._file = open(self.temp_path, "ab")
+
+    def commit(self) -> str:
+        """
+        Atomically move the completed upload into place
 
-    file_path = UPLOADS_DIR / "latest.csv"
-    UPLOADS_DIR.mkdir(parents=True, exist_ok=True) # Only write to disk if the uplaod directory exists
+        Returns:
+            str: The raw path of the saved file
+        """
+        self._file.close()
+        os.replace(self.temp_path, self.destination) # Readers never see a partially written file
+        self._committed = True
+        return str(self.destination)
 
-    with open(file_path, "wb") as f:
-        f.write(file.file.read())
-    return str(file_path)
\ No newline at end of file
+    def __exit__(self, *exc_info) -> None:
+        self._file.close()
+        if not self._committed:
+            self.temp_path.unlink(missing_ok=True)
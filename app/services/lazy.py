@@ -0,0 +1,28 @@
+import importlib
+from types import ModuleType
+from typing import Any
+
+class LazyModule(ModuleType):
+    """
+    Stands in for a heavy module until one of its attributes is first used, so importing the
+    app stays fast and the real import happens during warm-up or the first request that needs it.
+    Once loaded, the module's namespace is copied in, so later lookups cost the same as a real module.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+
+    def __getattr__(self, attribute: str) -> Any:
+        module = importlib.import_module(self.__name__) # The import lock makes concurrent first uses safe
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Args:
+        name: The module to import once it is first used
+
+    Returns:
+        ModuleType: A stand-in that behaves as the module
+    """
+    return LazyModule(name)
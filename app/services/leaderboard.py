@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from datetime import date
+from typing import Awaitable, Callable, Optional, TypedDict
+
+from ..config import LEADERBOARD_DEPTH, STORAGE_BACKEND, SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL
+from .aggregates import DailyTotals
+from .dataset import Dataset, DatasetVersion
+from .executor import run_in_thread
+from .metrics import timed
+from .result_cache import ResultCache
+from .sqlite_store import transaction_store
+from .transaction_summary import Versioned, current_version, parse_date_range, with_current_dataset
+
+class LeaderboardError(Exception):
+    """Raised when a leaderboard cannot be produced"""
+    pass
+
+class Leaderboard(TypedDict):
+    """One page of a leaderboard"""
+    data: list[dict]
+    entries: int # Users or products with transactions in the window, ranked or not
+    offset: int
+    limit: int
+    next_offset: Optional[int]
+
+# The column each leaderboard ranks, and the dataset component holding its daily totals
+BOARDS = {
+    "users": ("user_id", Dataset.user_totals),
+    "products": ("product_id", Dataset.product_totals)
+}
+METRICS = ("spend", "count")
+
+# The (key, count, total) of each ranked entry, and how many entries had transactions in the window
+Ranking = tuple[list[tuple[str, int, float]], int]
+
+SQLITE = STORAGE_BACKEND == "sqlite"
+
+# Rankings rather than pages are cached, so every page of a leaderboard is served from one entry
+leaderboard_cache = ResultCache(SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL)
+
+async def get_leaderboard(
+        board: str,
+        by: str = "spend",
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0
+    ) -> Versioned[Leaderboard]:
+    """
+    Return one page of the users or products with the highest spend or transaction count
+
+    Args:
+        board: "users" or "products"
+        by: "spend" to rank by total amount, "count" to rank by number of transactions
+        date_from: optional start date for filtering
+        date_to: optional end date for filtering
+        limit: entries per page
+        offset: rank to start the page after
+
+    Returns:
+        Versioned[Leaderboard]: the page, with the offset of the next one if the ranking goes on, and
+            the version it was ranked from
+    """
+    if board not in BOARDS or by not in METRICS:
+        raise LeaderboardError(f"Unknown leaderboard {board} by {by}")
+    if offset + limit > LEADERBOARD_DEPTH:
+        raise LeaderboardError(f"Leaderboards only rank the top {LEADERBOARD_DEPTH} entries")
+
+    try:
+        date_from_parsed, date_to_parsed = parse_date_range(date_from, date_to)
+        key = (board, by, date_from_parsed, date_to_parsed)
+
+        async def ranking_of(version: DatasetVersion, rank: Callable[[], Awaitable[Ranking]]) -> Versioned[Ranking]:
+            found, ranking = leaderboard_cache.get(version, key)
+            if not found:
+                ranking = await rank()
+                leaderboard_cache.put(version, key, ranking)
+            return Versioned(version, ranking)
+
+        if SQLITE:
+            ranking = await ranking_of(current_version(), lambda: _stored_rank(board, by, date_from_parsed, date_to_parsed))
+        else:
+            # Cached under the version of the dataset whose daily totals are ranked
+            ranking = await with_current_dataset(lambda dataset: ranking_of(
+                dataset.version, lambda: _rank(dataset, board, by, date_from_parsed, date_to_parsed)
+            ))
+
+    except Exception as e:
+        raise LeaderboardError(f"Error in leaderboard extraction: {e}")
+
+    ranked, entries = ranking.value
+    column = BOARDS[board][0]
+    page = [
+        {"rank": rank, column: key, "count": count, "total": round(total, 2)}
+        for rank, (key, count, total) in enumerate(ranked[offset:offset + limit], start=offset + 1)
+    ]
+    next_offset = offset + limit if offset + limit < min(entries, LEADERBOARD_DEPTH) else None
+    return Versioned(ranking.version, Leaderboard(data=page, entries=entries, offset=offset, limit=limit, next_offset=next_offset))
+
+async def _rank(dataset: Dataset, board: str, by: str, date_from: Optional[date], date_to: Optional[date]) -> Ranking:
+    """
+    Rank the top LEADERBOARD_DEPTH entries of a leaderboard from a dataset's daily totals
+
+    Args:
+        dataset: the dataset to rank
+        board: "users" or "products"
+        by: "spend" or "count"
+        date_from: optional first day to include
+        date_to: optional day to stop before
+
+    Returns:
+        Ranking: the (key, count, total) of each ranked entry, and how many had transactions in the window
+    """
+    component = BOARDS[board][1]
+    with timed("dataset_load"):
+        totals: DailyTotals = await component(dataset)
+    with timed("aggregate"):
+        return await run_in_thread(totals.top, by, LEADERBOARD_DEPTH, date_from, date_to)
+
+async def _stored_rank(board: str, by: str, date_from: Optional[date], date_to: Optional[date]) -> Ranking:
+    """Rank the top LEADERBOARD_DEPTH entries of a leaderboard with one query against the SQLite backend"""
+    with timed("query"):
+        return await run_in_thread(transaction_store.top, BOARDS[board][0], by, LEADERBOARD_DEPTH, date_from, date_to)
@@ -0,0 +1,152 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
+
+# Upper bounds of the latency buckets, in seconds, from sub-millisecond lookups to multi-second uploads
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage timings of the request being served, reported back in its Server-Timing header
+_request_timings: ContextVar[Optional[dict[str, float]]] = ContextVar("request_timings", default=None)
+
+class Histogram:
+    """
+    A Prometheus histogram with one series per combination of label values. Observing is a
+    bisect and a few additions under a lock, so it is cheap enough for every request.
+    """
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...], buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series: dict[tuple[str, ...], list] = {} # Label values -> [bucket counts, sum, count]
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            snapshot = [(values, list(counts), total, count) for values, (counts, total, count) in self._series.items()]
+        for values, counts, total, count in sorted(snapshot):
+            labels = _labels(self.labels, values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}'
+            yield f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {count}'
+            yield f"{self.name}_sum{{{labels}}} {total}"
+            yield f"{self.name}_count{{{labels}}} {count}"
+
+class Counter:
+    """A Prometheus counter with one series per combination of label values"""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...]):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._series: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float, *label_values: str) -> None:
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            snapshot = sorted(self._series.items())
+        for values, total in snapshot:
+            yield f"{self.name}{{{_labels(self.labels, values)}}} {total}"
+
+stage_seconds = Histogram("transactions_stage_duration_seconds", "Time spent in each stage of handling a request", ("stage",))
+request_seconds = Histogram("transactions_http_request_duration_seconds", "Time taken to respond to each request", ("method", "route", "status"))
+bytes_processed = Counter("transactions_bytes_processed_total", "Bytes processed by each stage", ("stage",))
+rows_processed = Counter("transactions_rows_processed_total", "CSV rows processed by each stage", ("stage",))
+
+_metrics = [stage_seconds, request_seconds, bytes_processed, rows_processed]
+_collectors: list[Callable[[], Iterator[str]]] = [] # Produce metrics held elsewhere, such as cache counters, when scraped
+
+def register_collector(collector: Callable[[], Iterator[str]]) -> None:
+    """
+    Add metrics that are read from their source at scrape time rather than recorded as they happen
+
+    Args:
+        collector: Yields lines of Prometheus text
+    """
+    _collectors.append(collector)
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Time a block of work as a stage, both in the stage histogram and in the current request's Server-Timing
+
+    Args:
+        stage: Name of the stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Record time spent in a stage that was measured by the caller"""
+    stage_seconds.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds # Repeated stages are reported as their total
+
+def start_request() -> dict[str, float]:
+    """
+    Begin collecting stage timings for the request being served
+
+    Returns:
+        dict[str, float]: Seconds spent in each stage, filled in as the request is handled
+    """
+    timings: dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+def server_timing(timings: dict[str, float], total: float) -> str:
+    """
+    Args:
+        timings: Seconds spent in each stage of a request
+        total: Seconds taken by the whole request
+
+    Returns:
+        str: The value of a Server-Timing header, in milliseconds
+    """
+    entries = [f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(entries)
+
+def render() -> str:
+    """
+    Returns:
+        str: Every metric in the Prometheus text exposition format
+    """
+    lines = [line for metric in _metrics for line in metric.render()]
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
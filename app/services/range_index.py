@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .snapshot import map_arrays, write_arrays
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+class UserSlices:
+    """
+    The transactions regrouped by user, with each user's rows stored contiguously and in
+    timestamp order between offsets[i] and offsets[i + 1].
+
+    Any time range of a user's transactions becomes two binary searches, giving the positions
+    in the dataframe of exactly the rows it holds, in timestamp order, at any file size.
+    """
+
+    def __init__(self, user_ids: np.ndarray, offsets: np.ndarray, timestamps: np.ndarray, rows: np.ndarray):
+        self.user_ids = user_ids
+        self.offsets = offsets
+        self.timestamps = timestamps
+        self.rows = rows # Position of each entry in the dataframe the slices were built from
+        self._positions = {user_id: i for i, user_id in enumerate(user_ids.tolist())}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "UserSlices":
+        """
+        Build the slices from the transactions dataframe
+
+        Args:
+            df: the loaded transactions, sorted by timestamp
+
+        Returns:
+            UserSlices: every user's transactions as contiguous sorted arrays
+        """
+        codes, user_ids = pd.factorize(df['user_id'], sort=True)
+        # A stable sort on the user alone keeps each user's rows in timestamp order
+        order = np.argsort(codes, kind='stable')
+        order = order[codes[order] >= 0] # Rows without a user ID cannot be looked up
+
+        offsets = np.searchsorted(codes[order], np.arange(len(user_ids) + 1)).astype(np.int64)
+
+        return cls(
+            np.asarray(user_ids, dtype=str),
+            offsets,
+            df['timestamp'].to_numpy(dtype='datetime64[ns]')[order],
+            order.astype(np.int64)
+        )
+
+    def save(self, path: Path) -> None:
+        """
+        Publish the slices as files other processes can map
+
+        Args:
+            path: the directory to publish to, named after the version of the transactions file
+        """
+        write_arrays(
+            path,
+            user_ids=self.user_ids,
+            offsets=self.offsets,
+            timestamps=self.timestamps,
+            rows=self.rows
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["UserSlices"]:
+        """
+        Memory-map slices published by save. Nothing is copied or rebuilt apart from the user
+        lookup, so every process mapping them shares a single copy in the page cache
+
+        Args:
+            path: the directory the slices were published to
+
+        Returns:
+            Optional[UserSlices]: the slices, or None if they have not been published
+        """
+        arrays = map_arrays(path)
+        if arrays is None:
+            return None
+
+        try:
+            return cls(arrays['user_ids'], arrays['offsets'], arrays['timestamps'], arrays['rows'])
+        except KeyError:
+            return None # Incomplete, so it is rebuilt
+
+    def has_user(self, user_id: str) -> bool:
+        """Whether the user has any transactions at all, regardless of time"""
+        return user_id in self._positions
+
+    def locate(
+            self,
+            user_id: str,
+            start: Optional[np.datetime64] = None,
+            end: Optional[np.datetime64] = None
+        ) -> tuple[int, int]:
+        """
+        Find the span of a user's transactions falling within a time range
+
+        Args:
+            user_id: the user to look up
+            start: optional first instant to include
+            end: optional instant to stop before, it is not included
+
+        Returns:
+            tuple[int, int]: positions [first, last) into the slice arrays, empty if there are no matches
+        """
+        position = self._positions.get(user_id)
+        if position is None:
+            return (0, 0)
+
+        first, last = int(self.offsets[position]), int(self.offsets[position + 1])
+        user_timestamps = self.timestamps[first:last]
+        lower = first + int(np.searchsorted(user_timestamps, start, side='left')) if start is not None else first
+        upper = first + int(np.searchsorted(user_timestamps, end, side='left')) if end is not None else last
+        return (lower, max(lower, upper))
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+class ResultCache:
+    """
+    Bounded LRU cache with a time-to-live, for results computed from one version of the dataset.
+
+    Entries only ever belong to a single dataset version: the first lookup made with a newer
+    version empties the cache, so replaced data can never be served.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._version: Optional[Hashable] = None
+
+    def get(self, version: Hashable, key: Hashable) -> tuple[bool, Any]:
+        """
+        Args:
+            version: the dataset version the caller is working with
+            key: the normalised query
+
+        Returns:
+            tuple[bool, Any]: whether the result was cached, and the result if so
+        """
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key] # Expired
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, version: Hashable, key: Hashable, value: Any) -> None:
+        """
+        Args:
+            version: the dataset version the result was computed from
+            key: the normalised query
+            value: the result
+        """
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            if self._version != version:
+                return # Computed from a version the cache has since moved on from
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False) # Evict the least recently used
+
+    def clear(self) -> None:
+        """Drop every entry, keeping the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: hit and miss counters, and the number of entries held
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries)
+            }
+
+    def _check_version(self, version: Hashable) -> None:
+        if self._version != version:
+            self._entries.clear()
+            self._version = version
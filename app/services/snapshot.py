@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+ENCODED_COLUMNS = ["transaction_id", "user_id", "product_id"] # Stored as integer codes plus a dictionary of values
+OPTIONAL_COLUMNS = ["transaction_id"] # Not needed for summaries, so compact datasets leave them out
+AMOUNT_DECIMALS = 2 # Amounts are money, float32 is only used when every value survives the round trip at this precision
+
+def snapshot_path(dataset_path: Path, source: tuple[int, int]) -> Path:
+    """
+    Each snapshot lives in its own directory named after the file it was converted from,
+    so a new upload never overwrites a snapshot another reader may still have mapped
+
+    Args:
+        dataset_path: the transactions CSV
+        source: the (mtime_ns, size) of that CSV
+
+    Returns:
+        Path: the snapshot directory
+    """
+    mtime_ns, size = source
+    return dataset_path.with_name(f"{dataset_path.stem}.{mtime_ns}-{size}.columns")
+
+def write_snapshot(df: pd.DataFrame, path: Path) -> None:
+    """
+    Write the transactions as one typed .npy file per column, with ID columns dictionary encoded
+
+    Args:
+        df: the parsed transactions, in the row order readers should see
+        path: the snapshot directory to create
+    """
+    temp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    shutil.rmtree(temp_path, ignore_errors=True)
+    temp_path.mkdir(parents=True)
+
+    for column in ENCODED_COLUMNS:
+        codes, values = pd.factorize(df[column])
+        # Store the codes in the narrowest width pandas would pick itself, so reading them back needs no cast
+        encoded = pd.Categorical.from_codes(codes, categories=values)
+        np.save(temp_path / f"{column}.codes.npy", encoded.codes)
+        np.save(temp_path / f"{column}.values.npy", np.asarray(values, dtype=str))
+
+    # Whole seconds is the precision uploads are validated to, stored as int64 epoch seconds
+    np.save(temp_path / "timestamp.npy", df['timestamp'].to_numpy(dtype='datetime64[s]'))
+    np.save(temp_path / "transaction_amount.npy", _narrow_amounts(df['transaction_amount'].to_numpy(dtype=np.float64)))
+
+    try:
+        os.rename(temp_path, path) # Readers only ever see a complete snapshot
+    except OSError:
+        shutil.rmtree(temp_path, ignore_errors=True) # Someone else already published this snapshot
+
+    remove_stale_snapshots(path)
+
+def remove_stale_snapshots(path: Path) -> None:
+    """
+    Remove the snapshots a newer one replaces. Newer snapshots are kept, such as one prepared by a compaction
+    that is still running, and so is the snapshot of the file now on disk, which may still be being served.
+    Mapped copies stay readable until their readers let go
+
+    Args:
+        path: the snapshot directory that is now the most recent
+    """
+    stem = path.name.split(".")[0]
+    dataset_path = path.with_name(f"{stem}.csv")
+    try:
+        stat = os.stat(dataset_path)
+        live = snapshot_path(dataset_path, (stat.st_mtime_ns, stat.st_size))
+    except FileNotFoundError:
+        live = None
+
+    mtime_ns = _source_mtime_ns(path)
+    for stale in path.parent.glob(f"{stem}.*.columns"):
+        if stale in (path, live):
+            continue
+        stale_mtime_ns = _source_mtime_ns(stale)
+        if stale_mtime_ns is not None and mtime_ns is not None and stale_mtime_ns < mtime_ns:
+            shutil.rmtree(stale, ignore_errors=True)
+
+def _source_mtime_ns(path: Path) -> Optional[int]:
+    """The mtime of the file a snapshot was converted from, read back from its name"""
+    try:
+        return int(path.name.split(".")[-2].split("-")[0])
+    except (IndexError, ValueError):
+        return None
+
+def read_snapshot(path: Path, compact: bool = True) -> Optional[pd.DataFrame]:
+    """
+    Memory-map a snapshot as a dataframe. Numeric columns and ID codes are used straight
+    from the page cache without being copied, which is also shared with other processes
+
+    Args:
+        path: the snapshot directory
+        compact: leave out optional columns and keep narrowed types, otherwise widen every column back to its parsed type
+
+    Returns:
+        Optional[pd.DataFrame]: the transactions, or None if there is no complete snapshot
+    """
+    if not path.is_dir():
+        return None
+
+    try:
+        columns = {}
+        for column in ENCODED_COLUMNS:
+            if compact and column in OPTIONAL_COLUMNS:
+                continue
+            columns[column] = read_encoded_column(path, column)
+
+        timestamps = np.load(path / "timestamp.npy", mmap_mode="r")
+        amounts = np.load(path / "transaction_amount.npy", mmap_mode="r")
+        if compact:
+            columns['timestamp'] = timestamps
+            columns['transaction_amount'] = amounts
+        else:
+            columns['timestamp'] = timestamps.astype('datetime64[ns]')
+            columns['transaction_amount'] = restore_amounts(amounts)
+
+        return pd.DataFrame(columns, copy=False)
+    except (OSError, ValueError):
+        return None # An unreadable snapshot is simply rebuilt from the CSV
+
+def read_encoded_column(path: Path, column: str) -> pd.Categorical:
+    """
+    Args:
+        path: the snapshot directory
+        column: a dictionary encoded column
+
+    Returns:
+        pd.Categorical: the column, with its codes memory-mapped
+    """
+    codes = np.load(path / f"{column}.codes.npy", mmap_mode="r")
+    values = np.load(path / f"{column}.values.npy", allow_pickle=False)
+    return pd.Categorical.from_codes(codes, categories=values, validate=False)
+
+class EncodedColumn:
+    """
+    A dictionary encoded column memory-mapped from one or more snapshots, values included, so
+    reading a few rows decodes only those rows however large the column is.
+
+    The parts are laid end to end, and order maps each row of the combined column to its
+    position among them, for columns whose snapshots were merged and re-sorted.
+    """
+
+    def __init__(self, parts: list[tuple[np.ndarray, np.ndarray]], order: Optional[np.ndarray] = None):
+        self.parts = parts
+        self.order = order
+        self._starts = np.cumsum([0] + [len(codes) for codes, _ in parts])
+
+    @classmethod
+    def map(cls, path: Path, column: str) -> Optional["EncodedColumn"]:
+        """
+        Args:
+            path: the snapshot directory
+            column: a dictionary encoded column
+
+        Returns:
+            Optional[EncodedColumn]: the column, or None if the snapshot is missing or unreadable
+        """
+        try:
+            codes = np.load(path / f"{column}.codes.npy", mmap_mode="r")
+            values = np.load(path / f"{column}.values.npy", mmap_mode="r", allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        return cls([(codes, values)])
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            rows: positions in the combined column
+
+        Returns:
+            np.ndarray: the decoded values at those positions, None where the value was missing
+        """
+        positions = self.order[rows] if self.order is not None else np.asarray(rows)
+        part_of = np.searchsorted(self._starts, positions, side='right') - 1
+
+        decoded = np.full(len(positions), None, dtype=object)
+        for part, (codes, values) in enumerate(self.parts):
+            in_part = np.flatnonzero(part_of == part)
+            part_codes = np.asarray(codes[positions[in_part] - self._starts[part]])
+            present = part_codes >= 0 # Missing values are factorized to -1
+            decoded[in_part[present]] = values[part_codes[present]].tolist()
+        return decoded
+
+def restore_amounts(amounts: np.ndarray) -> np.ndarray:
+    """
+    Widen transaction amounts to float64 for arithmetic, undoing any narrowing applied by the snapshot
+
+    Args:
+        amounts: amounts as stored in a dataframe, float32 or float64
+
+    Returns:
+        np.ndarray: float64 amounts with exactly the values that were uploaded
+    """
+    if amounts.dtype == np.float32:
+        return np.round(amounts.astype(np.float64), AMOUNT_DECIMALS)
+    return np.asarray(amounts, dtype=np.float64)
+
+def write_arrays(path: Path, **arrays: np.ndarray) -> None:
+    """
+    Publish named arrays as a directory of .npy files that readers can memory-map, replacing
+    any older versions of it. Like a snapshot, the directory only appears once complete
+
+    Args:
+        path: the directory to create, named after the version of the data it holds
+        arrays: the arrays to store
+    """
+    temp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    shutil.rmtree(temp_path, ignore_errors=True)
+    temp_path.mkdir(parents=True)
+
+    for name, array in arrays.items():
+        np.save(temp_path / f"{name}.npy", np.ascontiguousarray(array))
+
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        shutil.rmtree(temp_path, ignore_errors=True) # Someone else already published these arrays
+
+    stem, _, _ = path.name.rpartition(".")
+    for stale in path.parent.glob(f"{stem}.*"):
+        if stale != path and stale.is_dir() and ".tmp-" not in stale.name: # Leave directories still being written alone
+            shutil.rmtree(stale, ignore_errors=True)
+
+def map_arrays(path: Path) -> Optional[dict[str, np.ndarray]]:
+    """
+    Memory-map arrays published by write_arrays, read-only and shared with every other process mapping them
+
+    Args:
+        path: the directory holding the arrays
+
+    Returns:
+        Optional[dict[str, np.ndarray]]: the arrays by name, or None if the directory is missing or unreadable
+    """
+    if not path.is_dir():
+        return None
+
+    try:
+        return {file.stem: np.load(file, mmap_mode="r", allow_pickle=False) for file in path.glob("*.npy")}
+    except (OSError, ValueError):
+        return None # Unreadable arrays are simply rebuilt
+
+def _narrow_amounts(amounts: np.ndarray) -> np.ndarray:
+    """Halve the width of the amounts when rounding restores every value exactly, otherwise keep float64"""
+    narrowed = amounts.astype(np.float32)
+    restored = np.round(narrowed.astype(np.float64), AMOUNT_DECIMALS)
+    if np.array_equal(restored, amounts, equal_nan=True):
+        return narrowed
+    return amounts
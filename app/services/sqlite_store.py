@@ -0,0 +1,444 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from ..config import UPLOADS_DIR
+from .aggregates import Aggregate, Series, UserIndex, bucket_series
+from .dataset import DatasetVersion
+from .executor import run_in_process
+from .transaction_validator import REQUIRED_HEADERS, TIMESTAMP_FORMAT
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+class StoreError(Exception):
+    """Raised when the uploaded transactions cannot be imported into the database"""
+    pass
+
+DATABASE_PATH = UPLOADS_DIR / "transactions.db"
+IMPORT_BATCH_SIZE = 100_000 # Rows parsed and inserted per step of an import, which bounds its memory use
+
+SCHEMA = """
+CREATE TABLE transactions (
+    transaction_id TEXT,
+    user_id TEXT NOT NULL,
+    product_id TEXT,
+    timestamp INTEGER NOT NULL,
+    transaction_amount REAL
+);
+CREATE TABLE metadata (
+    generation INTEGER NOT NULL
+);
+"""
+
+# Covers every column a summary reads, so a query only walks the index entries of one user
+INDEX = "CREATE INDEX transactions_user_time ON transactions (user_id, timestamp, transaction_amount)"
+
+class SqliteStore:
+    """
+    The transactions held in a SQLite database rather than in memory.
+
+    Each import builds a complete new database beside the current one and swaps it in with a
+    single rename, so readers only ever see a fully indexed database. Every thread keeps its
+    own read-only connection, reopened once the file has been replaced.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._version: Optional[tuple[tuple[int, int], DatasetVersion]] = None # Database file identity and its version
+
+    def current_version(self) -> DatasetVersion:
+        """
+        Returns:
+            DatasetVersion: The version of the database currently on disk
+
+        Raises:
+            FileNotFoundError: If nothing has been imported yet
+        """
+        stat = os.stat(self.path)
+        identity = (stat.st_ino, stat.st_mtime_ns)
+        cached = self._version
+        if cached is not None and cached[0] == identity:
+            return cached[1]
+
+        row = self._connection().execute("SELECT generation FROM metadata").fetchone()
+        version = DatasetVersion(row[0], stat.st_mtime_ns, stat.st_size)
+        self._version = (identity, version)
+        return version
+
+    def aggregate(self, user_id: str, start: Optional[date] = None, end: Optional[date] = None) -> Optional[Aggregate]:
+        """
+        Aggregate a user's transactions within a range of days, as one indexed range query
+
+        Args:
+            user_id: the user to look up
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+
+        Returns:
+            Optional[Aggregate]: the aggregates, or None if there are no valid amounts in the range
+        """
+        lower, upper = _bounds(start, end)
+        count, total, minimum, maximum = self._connection().execute(
+            """
+            SELECT COUNT(transaction_amount), SUM(transaction_amount), MIN(transaction_amount), MAX(transaction_amount)
+            FROM transactions
+            WHERE user_id = ? AND timestamp >= ? AND timestamp < ?
+            """,
+            (user_id, lower, upper)
+        ).fetchone()
+
+        if count == 0:
+            return None
+        return Aggregate(count, total, minimum, maximum)
+
+    def amounts(self, user_id: str, start: Optional[date] = None, end: Optional[date] = None) -> np.ndarray:
+        """
+        A user's valid amounts within a range of days, read from the covering index
+
+        Args:
+            user_id: the user to look up
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+
+        Returns:
+            np.ndarray: the amounts, in no particular order
+        """
+        lower, upper = _bounds(start, end)
+        rows = self._connection().execute(
+            """
+            SELECT transaction_amount
+            FROM transactions
+            WHERE user_id = ? AND timestamp >= ? AND timestamp < ? AND transaction_amount IS NOT NULL
+            """,
+            (user_id, lower, upper)
+        ).fetchall()
+        return np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+
+    def series(self, user_id: str, bucket: str, start: Optional[date] = None, end: Optional[date] = None) -> Optional[Series]:
+        """
+        Aggregate a user's transactions into day, week or month buckets. The index yields each day
+        in order, and the days are combined into buckets the same way as the daily rollup
+
+        Args:
+            user_id: the user to look up
+            bucket: "day", "week" (starting on Mondays) or "month"
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+
+        Returns:
+            Optional[Series]: the aggregates of every bucket with valid amounts, or None if the user has no transactions at all
+        """
+        lower, upper = _bounds(start, end)
+        # SQLite's integer division rounds towards zero, so the remainder is taken off first to floor
+        # timestamps before 1970 onto the day they fall in, as NumPy does for the daily rollup
+        rows = self._connection().execute(
+            """
+            SELECT (timestamp - ((timestamp % 86400) + 86400) % 86400) / 86400 AS day,
+                COUNT(transaction_amount), SUM(transaction_amount), MIN(transaction_amount), MAX(transaction_amount)
+            FROM transactions
+            WHERE user_id = ? AND timestamp >= ? AND timestamp < ?
+            GROUP BY day
+            HAVING COUNT(transaction_amount) > 0
+            ORDER BY day
+            """,
+            (user_id, lower, upper)
+        ).fetchall()
+
+        if not rows and not self.has_user(user_id):
+            return None
+
+        days, counts, totals, minimums, maximums = zip(*rows) if rows else ((), (), (), (), ())
+        return bucket_series(
+            np.asarray(days, dtype=np.int64).astype('datetime64[D]'),
+            np.asarray(counts, dtype=np.int64),
+            np.asarray(totals, dtype=np.float64),
+            np.asarray(minimums, dtype=np.float64),
+            np.asarray(maximums, dtype=np.float64),
+            bucket
+        )
+
+    def rows(
+            self,
+            user_id: str,
+            start: Optional[date],
+            end: Optional[date],
+            after: Optional[tuple[int, int]],
+            limit: int
+        ) -> list[tuple]:
+        """
+        A page of a user's transactions in timestamp order. Pages continue from the (timestamp, rowid)
+        of the last row of the one before, so each is a seek in the index however deep it is
+
+        Args:
+            user_id: the user to look up
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+            after: the (timestamp, rowid) to continue after, None for the first page
+            limit: most rows to return
+
+        Returns:
+            list[tuple]: the transaction ID, user ID, product ID, timestamp, amount, epoch seconds and rowid of each row
+        """
+        lower, upper = _bounds(start, end)
+        last_timestamp, last_rowid = after if after is not None else (lower, 0) # Rowids start at 1
+        return self._connection().execute(
+            """
+            SELECT transaction_id, user_id, product_id, strftime('%Y-%m-%d %H:%M:%S', timestamp, 'unixepoch'),
+                transaction_amount, timestamp, rowid
+            FROM transactions
+            WHERE user_id = ? AND timestamp >= ? AND timestamp < ? AND (timestamp, rowid) > (?, ?)
+            ORDER BY timestamp, rowid
+            LIMIT ?
+            """,
+            (user_id, lower, upper, last_timestamp, last_rowid, limit)
+        ).fetchall()
+
+    def has_user(self, user_id: str) -> bool:
+        """Whether the user has any transactions at all, regardless of time"""
+        return self._connection().execute(
+            "SELECT 1 FROM transactions WHERE user_id = ? LIMIT 1", (user_id,)
+        ).fetchone() is not None
+
+    def user_ids(self) -> list[str]:
+        """Every user with transactions, in sorted order"""
+        return [row[0] for row in self._connection().execute("SELECT DISTINCT user_id FROM transactions ORDER BY user_id")]
+
+    def window(self, start: Optional[date] = None, end: Optional[date] = None) -> UserIndex:
+        """
+        Aggregate every user over a range of days, in one pass over the covering index
+
+        Args:
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+
+        Returns:
+            UserIndex: aggregates of every user with valid amounts in the range
+        """
+        lower, upper = _bounds(start, end)
+        rows = self._connection().execute(
+            """
+            SELECT user_id, COUNT(transaction_amount), SUM(transaction_amount), MIN(transaction_amount), MAX(transaction_amount)
+            FROM transactions
+            WHERE timestamp >= ? AND timestamp < ?
+            GROUP BY user_id
+            HAVING COUNT(transaction_amount) > 0
+            ORDER BY user_id
+            """,
+            (lower, upper)
+        ).fetchall()
+
+        user_ids, counts, totals, minimums, maximums = zip(*rows) if rows else ((), (), (), (), ())
+        return UserIndex(
+            np.asarray(user_ids, dtype=str),
+            np.asarray(counts, dtype=np.int64),
+            np.asarray(totals, dtype=np.float64),
+            np.asarray(minimums, dtype=np.float64),
+            np.asarray(maximums, dtype=np.float64)
+        )
+
+    def top(
+            self,
+            column: str,
+            by: str,
+            limit: int,
+            start: Optional[date] = None,
+            end: Optional[date] = None
+        ) -> tuple[list[tuple[str, int, float]], int]:
+        """
+        Rank the users or products with valid amounts in a range of days, matching DailyTotals.top
+
+        Args:
+            column: "user_id" or "product_id"
+            by: "spend" to rank by total amount, "count" to rank by number of transactions
+            limit: how many of the highest ranked values to return
+            start: optional first day to include
+            end: optional day to stop before, it is not included
+
+        Returns:
+            tuple: the (key, count, total) of the top values, highest first with ties in key order,
+                and how many values had transactions in the range
+        """
+        if column not in ("user_id", "product_id"):
+            raise ValueError(f"Cannot rank by {column}")
+        order = "SUM(transaction_amount)" if by == "spend" else "COUNT(transaction_amount)"
+
+        lower, upper = _bounds(start, end)
+        rows = self._connection().execute(
+            f"""
+            SELECT {column}, COUNT(transaction_amount), SUM(transaction_amount), COUNT(*) OVER ()
+            FROM transactions
+            WHERE timestamp >= ? AND timestamp < ?
+            GROUP BY {column}
+            HAVING COUNT(transaction_amount) > 0
+            ORDER BY {order} DESC, {column}
+            LIMIT ?
+            """,
+            (lower, upper, limit)
+        ).fetchall()
+
+        return [(key, count, total) for key, count, total, _ in rows], rows[0][3] if rows else 0
+
+    async def refresh(self, csv_path: Path) -> DatasetVersion:
+        """
+        Import a newly uploaded file, replacing the database once the import is complete
+
+        Args:
+            csv_path: the validated transactions file
+
+        Returns:
+            DatasetVersion: The version of the new database
+        """
+        # Parsing and inserting hold the GIL throughout, so the import runs in another process
+        await run_in_process(import_csv, csv_path, self.path, self._next_generation())
+        return self.current_version()
+
+    async def append(self, csv_path: Path) -> DatasetVersion:
+        """
+        Add the rows of a newly uploaded file to the database, which maintains its index as they go in
+
+        Args:
+            csv_path: the validated rows to add, removed once they are in the database
+
+        Returns:
+            DatasetVersion: The version of the database including the new rows
+        """
+        try:
+            if not self.path.exists():
+                return await self.refresh(csv_path) # Nothing to append to yet
+            await run_in_process(append_csv, csv_path, self.path, self._next_generation())
+            return self.current_version()
+        finally:
+            csv_path.unlink(missing_ok=True)
+
+    def _next_generation(self) -> int:
+        with self._lock:
+            try:
+                return self.current_version().generation + 1
+            except (FileNotFoundError, sqlite3.Error):
+                return 1
+
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection to the current database file"""
+        identity = os.stat(self.path).st_ino
+        cached = getattr(self._local, "connection", None)
+        if cached is not None and cached[0] == identity:
+            return cached[1]
+
+        if cached is not None:
+            cached[1].close() # The file was replaced, the old one is only kept alive by this connection
+        connection = sqlite3.connect(f"{self.path.as_uri()}?mode=ro", uri=True)
+        self._local.connection = (identity, connection)
+        return connection
+
+def import_csv(csv_path: Path, database_path: Path, generation: int) -> None:
+    """
+    Load a transactions CSV into a new database and swap it in place of the current one.
+    Runs on the process pool
+
+    Args:
+        csv_path: the validated transactions file
+        database_path: the database to replace
+        generation: the generation to record for the new database
+    """
+    temp_path = database_path.with_name(f"{database_path.name}.tmp-{os.getpid()}")
+    temp_path.unlink(missing_ok=True)
+
+    connection = sqlite3.connect(temp_path)
+    try:
+        # Nothing reads this file until it is complete, so there is no need for a journal or for syncing as we go
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.executescript(SCHEMA)
+
+        rows = 0
+        for chunk in _read_batches(csv_path):
+            with connection: # One transaction per batch
+                _insert_batch(connection, chunk)
+            rows += len(chunk)
+
+        if rows == 0:
+            raise StoreError("No transaction data available")
+
+        # Building the index once after loading is far quicker than maintaining it row by row
+        with connection:
+            connection.execute(INDEX)
+            connection.execute("INSERT INTO metadata VALUES (?)", (generation,))
+        connection.execute("ANALYZE")
+    except BaseException:
+        connection.close()
+        temp_path.unlink(missing_ok=True)
+        raise
+
+    connection.close()
+    os.replace(temp_path, database_path) # Readers switch to the new database in one step
+
+def append_csv(csv_path: Path, database_path: Path, generation: int) -> None:
+    """
+    Add the rows of a transactions CSV to the current database. Runs on the process pool
+
+    Args:
+        csv_path: the validated rows to add
+        database_path: the database to add them to
+        generation: the generation to record once they are added
+    """
+    connection = sqlite3.connect(database_path)
+    try:
+        # A single transaction, so readers see either none of the new rows or all of them. The index is kept up to date as rows go in
+        with connection:
+            rows = 0
+            for chunk in _read_batches(csv_path):
+                _insert_batch(connection, chunk)
+                rows += len(chunk)
+
+            if rows == 0:
+                raise StoreError("No transaction data available")
+            connection.execute("UPDATE metadata SET generation = ?", (generation,))
+    finally:
+        connection.close()
+
+def _read_batches(csv_path: Path) -> Iterator[pd.DataFrame]:
+    """Parse a transactions CSV a batch at a time, leaving out rows that can never be looked up"""
+    chunks = pd.read_csv(
+        csv_path,
+        usecols=REQUIRED_HEADERS,
+        dtype={'transaction_id': 'str', 'user_id': 'str', 'product_id': 'str', 'transaction_amount': 'float64'},
+        parse_dates=['timestamp'],
+        date_format=TIMESTAMP_FORMAT,
+        chunksize=IMPORT_BATCH_SIZE
+    )
+    for chunk in chunks:
+        yield chunk.dropna(subset=['user_id', 'timestamp'])
+
+def _insert_batch(connection: sqlite3.Connection, chunk: pd.DataFrame) -> None:
+    connection.executemany(
+        "INSERT INTO transactions VALUES (?, ?, ?, ?, ?)",
+        zip(
+            chunk['transaction_id'].tolist(),
+            chunk['user_id'].tolist(),
+            chunk['product_id'].tolist(),
+            chunk['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64).tolist(),
+            chunk['transaction_amount'].tolist() # NaN is stored as NULL, which the aggregates skip
+        )
+    )
+
+def _bounds(start: Optional[date], end: Optional[date]) -> tuple[int, int]:
+    """Epoch second bounds [lower, upper) for a range of days, open ends covering every timestamp"""
+    lower = _epoch_seconds(start) if start is not None else -2**63
+    upper = _epoch_seconds(end) if end is not None else 2**63 - 1
+    return lower, upper
+
+def _epoch_seconds(day: date) -> int:
+    """Timestamps are stored as naive UTC epoch seconds, as the CSV carries no timezone"""
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+transaction_store = SqliteStore(DATABASE_PATH)
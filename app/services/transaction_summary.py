@@ -1,8 +1,22 @@
-import pandas as pd
-import io
-from datetime import datetime
-from typing import TypedDict, Optional
-from .file_handler import load_from_disk
+from __future__ import annotations
+
+import asyncio
+from datetime import date, datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Generic, Iterator, NamedTuple, NotRequired, TypedDict, Optional, TypeVar
+
+import numpy as np
+
+from .aggregates import SERIES_BUCKETS, Aggregate, DailyRollup, Series, UserIndex
+from .dataset import dataset_cache, Dataset, DatasetError, DatasetVersion, StaleDatasetError
+from .executor import run_in_thread
+from .metrics import register_collector, timed
+from .result_cache import ResultCache
+from .sqlite_store import transaction_store
+from ..config import STORAGE_BACKEND, SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
 
 from fastapi import Query
 
@@ -15,6 +29,7 @@ class Summary(TypedDict):
     maximum: float
     minimum: float
     average: float
+    quantiles: NotRequired[dict[str, float]]
 
 REQUIRED_HEADERS = [
     "transaction_id", 
@@ -26,6 +41,38 @@ REQUIRED_HEADERS = [
 
 TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+# Percentiles returned when a summary asks for quantiles, p50 being the median
+SUMMARY_QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+
+T = TypeVar("T")
+
+class Versioned(NamedTuple, Generic[T]):
+    """A result together with the version of the data it was computed from, which its ETag is built from"""
+    version: DatasetVersion
+    value: T
+
+SQLITE = STORAGE_BACKEND == "sqlite"
+STALE_RETRIES = 5 # Attempts at a dataset whose file was replaced before the new version was published
+STALE_RETRY_DELAY = 0.2 # Seconds to wait between them, giving the upload time to publish
+
+summary_cache = ResultCache(SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL)
+
+def _cache_metrics() -> Iterator[str]:
+    """Summary cache counters in Prometheus text, read when metrics are scraped"""
+    stats = summary_cache.stats()
+    yield "# HELP transactions_summary_cache_lookups_total Summary cache lookups, by whether they hit"
+    yield "# TYPE transactions_summary_cache_lookups_total counter"
+    yield f'transactions_summary_cache_lookups_total{{result="hit"}} {stats["hits"]}'
+    yield f'transactions_summary_cache_lookups_total{{result="miss"}} {stats["misses"]}'
+    yield "# HELP transactions_summary_cache_hit_ratio Fraction of summary cache lookups that hit"
+    yield "# TYPE transactions_summary_cache_hit_ratio gauge"
+    yield f"transactions_summary_cache_hit_ratio {stats['hit_ratio']}"
+    yield "# HELP transactions_summary_cache_entries Summaries held in the cache"
+    yield "# TYPE transactions_summary_cache_entries gauge"
+    yield f"transactions_summary_cache_entries {stats['entries']}"
+
+register_collector(_cache_metrics)
+
 def parse_date(date_str: str):
     """Simple helper function to parse date queries"""
     try:
@@ -33,45 +80,167 @@ def parse_date(date_str: str):
     except ValueError:
         raise SummaryError(f"Invalid date format: {date_str}")
 
+def parse_date_range(date_from: Optional[str], date_to: Optional[str]) -> tuple[Optional[date], Optional[date]]:
+    """
+    Parse the optional date filters of a query
+
+    Args:
+        date_from: optional start date
+        date_to: optional end date
+
+    Returns:
+        tuple[Optional[date], Optional[date]]: the parsed dates, None where not given
+    """
+    # Try to parse the dates as real datetimes
+    date_from_parsed = parse_date(date_from) if date_from else None
+    date_to_parsed = parse_date(date_to) if date_to else None
+
+    # Safely checks if both dates are given, if so we must make sure that from is before to chronologically
+    if date_from_parsed and date_to_parsed:
+        if date_from_parsed > date_to_parsed:
+            raise SummaryError("date_from cannot be after date_to")
+
+    return date_from_parsed, date_to_parsed
+
 async def load_transactions_data() -> pd.DataFrame:
     """
-    Load transaction data from disk and prepare it for data extraction
+    Load transaction data prepared for data extraction, only re-parsing the file on disk
+    when it has changed since the last load
     
     Returns:
         pd.DataFrame: Clean dataframe ready for analysis
     """
+    return await _load_component(Dataset.frame)
+
+async def load_user_index() -> UserIndex:
+    """
+    Load the per-user aggregates of the current upload
+
+    Returns:
+        UserIndex: Aggregates for every user, keyed by user ID
+    """
+    return await _load_component(Dataset.user_index)
+
+async def load_daily_rollup() -> DailyRollup:
+    """
+    Load the per-user, per-day aggregates of the current upload
+
+    Returns:
+        DailyRollup: Daily aggregates for every user
+    """
+    return await _load_component(Dataset.daily_rollup)
+
+def current_version() -> DatasetVersion:
+    """
+    Returns:
+        DatasetVersion: The version of the data summaries are currently computed from, whichever backend holds it
+
+    Raises:
+        SummaryError: If nothing has been uploaded yet
+    """
+    if not SQLITE:
+        return current_dataset().version
+
+    try:
+        return transaction_store.current_version()
+    except FileNotFoundError:
+        raise SummaryError("No transaction file found. Please upload a CSV file first.")
+
+async def refresh_data(saved_file: str) -> None:
+    """
+    Load a newly saved upload into the configured backend, so summaries see it straight away
+
+    Args:
+        saved_file: The path the upload was saved to
+    """
+    if SQLITE:
+        await transaction_store.refresh(Path(saved_file))
+    else:
+        await dataset_cache.refresh()
+
+async def append_data(saved_file: str) -> None:
+    """
+    Add a newly saved upload to the data already held by the configured backend
+
+    Args:
+        saved_file: The path the upload was saved to, which the backend takes over
+    """
+    if SQLITE:
+        await transaction_store.append(Path(saved_file))
+    else:
+        await dataset_cache.append(Path(saved_file))
+
+async def warm_data() -> None:
+    """Load and index whatever the configured backend already holds, ahead of the first request"""
+    if SQLITE:
+        try:
+            await run_in_thread(transaction_store.current_version) # Opens the database and reads its version
+        except FileNotFoundError:
+            pass # Nothing imported yet
+        return
+
+    try:
+        dataset = current_dataset()
+    except SummaryError:
+        return # Nothing uploaded yet
+    await dataset.warm()
+
+def current_dataset() -> Dataset:
+    """
+    Returns:
+        Dataset: The dataset of the latest upload
+
+    Raises:
+        SummaryError: If nothing has been uploaded yet
+    """
+    try:
+        return dataset_cache.current()
+    except FileNotFoundError:
+        raise SummaryError("No transaction file found. Please upload a CSV file first.")
+
+async def with_current_dataset(work: Callable[[Dataset], Awaitable[T]]) -> T:
+    """
+    Run work against the current dataset. When shared, a file can be replaced before the process
+    uploading it publishes the new version, leaving a dataset that had not loaded yet with nothing
+    to read. The work is then started again on whichever version the header names next
+
+    Args:
+        work: Coroutine function taking the dataset to use
+
+    Returns:
+        The result of the work
+    """
+    for _ in range(STALE_RETRIES):
+        try:
+            return await work(current_dataset())
+        except StaleDatasetError:
+            await asyncio.sleep(STALE_RETRY_DELAY)
+    raise SummaryError("The transaction data is being replaced, please try again shortly")
+
+async def _load_component(component: Callable[[Dataset], Awaitable[T]], dataset: Optional[Dataset] = None) -> T:
+    """
+    Fetch one component of a dataset, translating load failures into summary errors
+
+    Args:
+        component: The Dataset method that builds the component
+        dataset: The dataset to load from, the current one if not given
+
+    Returns:
+        The loaded component
+    """
+    if dataset is None:
+        return await with_current_dataset(lambda current: _load_component(component, current))
     try:
-        # Load file content from disk
-        content = await load_from_disk()
-        
-        # Convert string content to file-like object for pandas
-        content_io = io.StringIO(content)
-        
-        # Read CSV with appropriate data types
-        dataframe = pd.read_csv(
-            content_io,
-            usecols=REQUIRED_HEADERS,
-            dtype={
-                'transaction_id': 'str',
-                'user_id': 'str', 
-                'product_id': 'str',
-                'transaction_amount': 'float64'
-            },
-            parse_dates=['timestamp'],
-            date_format=TIMESTAMP_FORMAT
-        )
-        
-        if dataframe.empty:
-            raise SummaryError("No transaction data available")
-        
-        # Sort the dataframe by timestamp for better indexing
-        dataframe = dataframe.sort_values('timestamp')
-        
-        return dataframe
+        with timed("dataset_load"): # Near zero once loaded, so slow samples show cold loads
+            return await component(dataset)
     
     # Precise error handling for debugging purposes
+    except StaleDatasetError:
+        raise # Left for with_current_dataset to retry
     except FileNotFoundError:
         raise SummaryError("No transaction file found. Please upload a CSV file first.")
+    except DatasetError as e:
+        raise SummaryError(str(e))
     except pd.errors.ParserError as e:
         raise SummaryError(f"Error parsing transaction data: {str(e)}")
     except Exception as e:
@@ -81,58 +250,302 @@ async def load_transactions_data() -> pd.DataFrame:
 async def get_summary(
         user_id: str, 
         date_from: Optional[str] = None, 
-        date_to: Optional[str] = None
-    ) -> Summary:
+        date_to: Optional[str] = None,
+        quantiles: bool = False
+    ) -> Versioned[Summary]:
     """
-    Return the summary statistics for a user
+    Return the summary statistics for a user, served from the result cache when the
+    same query was already answered for the current dataset
     
     Args:
         user_id: the id of the user that needs statistics
         date_from: optional start date for filtering
         date_to: optional end date for filtering
+        quantiles: whether to add the percentiles in SUMMARY_QUANTILES. The pandas backend estimates
+            them from sketches to within QUANTILE_ACCURACY relative error, SQLite computes them exactly
 
     Returns:
-        Summary: the three statistics required
+        Versioned[Summary]: the three statistics required, and the percentiles when asked for,
+            with the version they were computed from
     """
 
     try:
-        df = await load_transactions_data() # First attempt to load the csv file the user uploaded
-        
-        user_data = df[df['user_id'] == user_id]
-        if user_data.empty:
-            raise SummaryError(f"No transactions found for user {user_id}")
+        version = current_version() if SQLITE else None
+        date_from_parsed, date_to_parsed = parse_date_range(date_from, date_to)
+
+        # Parsed dates normalise the key, so equivalent spellings of a query share an entry
+        key = (user_id, date_from_parsed, date_to_parsed, quantiles)
+        if SQLITE:
+            return await _cached(version, key, lambda: run_in_thread(
+                _compute_stored_summary, user_id, date_from_parsed, date_to_parsed, quantiles
+            ))
+        # The version is the one of the dataset the summary is computed from, whatever is published meanwhile
+        return await with_current_dataset(lambda dataset: _cached(dataset.version, key, lambda: _compute_summary(
+            dataset, user_id, date_from_parsed, date_to_parsed, quantiles
+        )))
 
-        # Try to parse the dates as real datetimes
-        date_from_parsed = parse_date(date_from) if date_from else None
-        date_to_parsed = parse_date(date_to) if date_to else None
+    except Exception as e:
+        raise SummaryError(f"Error in summary extraction: {e}")
 
-        # Safely checks if both dates are given, if so we must make sure that from is before to chronologically
-        if date_from is not None or date_to is not None:
-            if date_from_parsed and date_to_parsed:
-                if date_from_parsed > date_to_parsed:
-                    raise SummaryError("date_from cannot be after date_to")
-            user_data = _filter_by_timeframe(user_data, date_from, date_to)
+async def _cached(version: DatasetVersion, key: tuple, compute: Callable[[], Awaitable[T]]) -> Versioned[T]:
+    """
+    Args:
+        version: The version of the data the result is computed from
+        key: The query, normalised
+        compute: Coroutine function computing the result on a cache miss
 
-        # dropna will help us to determine if any transactions exist for this user, if not then we raise an error
-        amounts = user_data['transaction_amount'].dropna()
-        if amounts.empty:
+    Returns:
+        Versioned: The cached result, or the freshly computed one after caching it, with its version
+    """
+    found, result = summary_cache.get(version, key)
+    if not found:
+        result = await compute()
+        summary_cache.put(version, key, result)
+    return Versioned(version, result)
+
+async def _compute_summary(
+        dataset: Dataset,
+        user_id: str,
+        date_from: Optional[date],
+        date_to: Optional[date],
+        quantiles: bool = False
+    ) -> Summary:
+    """
+    Compute the summary statistics for a user from the pre-computed aggregates
+
+    Args:
+        dataset: the dataset to summarise
+        user_id: the id of the user that needs statistics
+        date_from: optional first day to include
+        date_to: optional day to stop before
+        quantiles: whether to add percentiles, merged from the user's daily sketches
+
+    Returns:
+        Summary: the three statistics required
+    """
+    if date_from is None and date_to is None:
+        # Unfiltered summaries are answered straight from the per-user aggregates
+        index = await _load_component(Dataset.user_index, dataset)
+        with timed("aggregate"):
+            aggregate = index.get(user_id)
+        if aggregate is None:
+            raise SummaryError(f"No transactions found for user {user_id}")
+    else:
+        # Dates are whole days, so the daily rollup answers the range without touching raw rows
+        rollup = await _load_component(Dataset.daily_rollup, dataset)
+        if not rollup.has_user(user_id):
+            raise SummaryError(f"No transactions found for user {user_id}")
+
+        with timed("aggregate"):
+            aggregate = rollup.get(user_id, date_from, date_to)
+        if aggregate is None:
             raise SummaryError(f"No valid transaction amounts for user {user_id} in the given date range")
 
-        return Summary(
-            maximum = float(user_data['transaction_amount'].max()),
-            minimum = float(user_data['transaction_amount'].min()),
-            average = round(float(user_data['transaction_amount'].mean()), 2)
-        )
+    summary = _summary_from_aggregate(aggregate)
+    if quantiles:
+        sketches = await _load_component(Dataset.quantile_rollup, dataset)
+        with timed("aggregate"):
+            estimates = sketches.quantiles(user_id, tuple(SUMMARY_QUANTILES.values()), date_from, date_to)
+        summary["quantiles"] = _quantile_summary(estimates, aggregate)
+    return summary
+
+def _compute_stored_summary(user_id: str, date_from: Optional[date], date_to: Optional[date], quantiles: bool = False) -> Summary:
+    """
+    Compute the summary statistics for a user with one indexed query against the SQLite backend
+
+    Args:
+        user_id: the id of the user that needs statistics
+        date_from: optional first day to include
+        date_to: optional day to stop before
+        quantiles: whether to add percentiles, computed exactly from the user's amounts
+
+    Returns:
+        Summary: the three statistics required
+    """
+    with timed("query"):
+        aggregate = transaction_store.aggregate(user_id, date_from, date_to)
+    if aggregate is not None:
+        summary = _summary_from_aggregate(aggregate)
+        if quantiles:
+            with timed("query"):
+                amounts = transaction_store.amounts(user_id, date_from, date_to)
+            exact = np.quantile(amounts, list(SUMMARY_QUANTILES.values()), method="lower") # The rank the sketches are accurate to
+            summary["quantiles"] = _quantile_summary(exact.tolist(), aggregate)
+        return summary
+
+    # Matches the pandas backend, where the per-user index only holds users with valid amounts
+    if (date_from is None and date_to is None) or not transaction_store.has_user(user_id):
+        raise SummaryError(f"No transactions found for user {user_id}")
+    raise SummaryError(f"No valid transaction amounts for user {user_id} in the given date range")
+
+async def get_summary_series(
+        user_id: str,
+        bucket: str = "day",
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None
+    ) -> Versioned[Iterator[dict]]:
+    """
+    Return a user's summary statistics for every day, week or month with transactions, computed
+    in one vectorised pass over their daily aggregates rather than one summary per bucket
+
+    Args:
+        user_id: the id of the user that needs statistics
+        bucket: "day", "week" (starting on Mondays) or "month"
+        date_from: optional start date for filtering
+        date_to: optional end date for filtering
+
+    Returns:
+        Versioned[Iterator[dict]]: the count, total, maximum, minimum and average of each bucket, in
+            order, with the version they were computed from
+    """
+
+    try:
+        if bucket not in SERIES_BUCKETS:
+            raise SummaryError(f"Unknown bucket {bucket}, expected one of {', '.join(SERIES_BUCKETS)}")
+
+        version = current_version() if SQLITE else None
+        date_from_parsed, date_to_parsed = parse_date_range(date_from, date_to)
+
+        key = ("series", user_id, bucket, date_from_parsed, date_to_parsed)
+        if SQLITE:
+            series = await _cached(version, key, lambda: _compute_stored_series(user_id, bucket, date_from_parsed, date_to_parsed))
+        else:
+            # Cached under the version of the dataset whose rollup the series is read from
+            series = await with_current_dataset(lambda dataset: _cached(dataset.version, key, lambda: _compute_series(
+                dataset, user_id, bucket, date_from_parsed, date_to_parsed
+            )))
 
     except Exception as e:
         raise SummaryError(f"Error in summary extraction: {e}")
+
+    return Versioned(series.version, _series_entries(series.value))
+
+async def _compute_series(dataset: Dataset, user_id: str, bucket: str, date_from: Optional[date], date_to: Optional[date]) -> Series:
+    """Combine a user's daily aggregates into buckets, raising if the user has no transactions"""
+    rollup = await _load_component(Dataset.daily_rollup, dataset)
+    with timed("aggregate"):
+        series = rollup.series(user_id, bucket, date_from, date_to)
+    if series is None:
+        raise SummaryError(f"No transactions found for user {user_id}")
+    return series
+
+async def _compute_stored_series(user_id: str, bucket: str, date_from: Optional[date], date_to: Optional[date]) -> Series:
+    """Query a user's buckets from the SQLite backend, raising if the user has no transactions"""
+    with timed("query"):
+        series = await run_in_thread(transaction_store.series, user_id, bucket, date_from, date_to)
+    if series is None:
+        raise SummaryError(f"No transactions found for user {user_id}")
+    return series
+
+def _series_entries(series: Series) -> Iterator[dict]:
+    """Turn the bucket arrays into one entry per bucket, only as the response is written"""
+    columns = [series.starts.astype(str).tolist()] + [column.tolist() for column in series[1:]]
+    for start, count, total, minimum, maximum in zip(*columns):
+        aggregate = Aggregate(count, total, minimum, maximum)
+        yield {"start": start, "count": count, "total": round(total, 2), **_summary_from_aggregate(aggregate)}
+
+async def get_batch_summaries(
+        user_ids: Optional[list[str]] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None
+    ) -> Iterator[dict]:
+    """
+    Return the summary statistics for many users at once, computed in one vectorised pass
+
+    Args:
+        user_ids: the users that need statistics, or None for every user
+        date_from: optional start date for filtering
+        date_to: optional end date for filtering
+
+    Returns:
+        Iterator[dict]: one entry per user, holding either its summary under "data" or why there is none under "error"
+    """
+
+    try:
+        date_from_parsed, date_to_parsed = parse_date_range(date_from, date_to)
+
+        if SQLITE:
+            current_version() # Reports a missing upload the same way as the pandas backend
+            with timed("query"):
+                table = await run_in_thread(transaction_store.window, date_from_parsed, date_to_parsed)
+            known_users = set(await run_in_thread(transaction_store.user_ids))
+            all_users = sorted(known_users)
+            has_user = known_users.__contains__
+        else:
+            rollup = await load_daily_rollup()
+            if date_from_parsed is None and date_to_parsed is None:
+                table = await load_user_index()
+            else:
+                with timed("aggregate"):
+                    table = await run_in_thread(rollup.window, date_from_parsed, date_to_parsed)
+            all_users = map(str, rollup.user_ids)
+            has_user = rollup.has_user
+
+    except Exception as e:
+        raise SummaryError(f"Error in summary extraction: {e}")
+
+    requested = user_ids if user_ids is not None else all_users
+    return (_batch_entry(user_id, table, has_user) for user_id in requested)
+
+def _batch_entry(user_id: str, table: UserIndex, has_user: Callable[[str], bool]) -> dict:
+    """
+    Build one user's entry of a batch, reporting problems inline rather than failing the batch
+
+    Args:
+        user_id: the user to summarise
+        table: aggregates of every user within the requested dates
+        has_user: whether a user has any transactions at all, used to tell unknown users apart from users with no transactions in range
+
+    Returns:
+        dict: the user's summary or error
+    """
+    aggregate = table.get(user_id)
+    if aggregate is not None:
+        return {"user_id": user_id, "data": _summary_from_aggregate(aggregate)}
+
+    if not has_user(user_id):
+        return {"user_id": user_id, "error": f"No transactions found for user {user_id}"}
+    return {"user_id": user_id, "error": f"No valid transaction amounts for user {user_id} in the given date range"}
+
+def _summary_from_aggregate(aggregate: Aggregate) -> Summary:
+    """
+    Derive the summary statistics from pre-computed aggregates
+
+    Args:
+        aggregate: the count, total, minimum and maximum of the transactions
+
+    Returns:
+        Summary: the three statistics required
+    """
+    return Summary(
+        maximum = aggregate.maximum,
+        minimum = aggregate.minimum,
+        average = round(aggregate.total / aggregate.count, 2)
+    )
     
+def _quantile_summary(values: list[float], aggregate: Aggregate) -> dict[str, float]:
+    """
+    Name and round the percentiles of a summary
+
+    Args:
+        values: the value of each of SUMMARY_QUANTILES, in order
+        aggregate: the aggregates of the same transactions
+
+    Returns:
+        dict[str, float]: each percentile by name
+    """
+    # The exact minimum and maximum bound every quantile, which also makes p0 and p100 exact
+    return {
+        name: round(min(max(value, aggregate.minimum), aggregate.maximum), 2)
+        for name, value in zip(SUMMARY_QUANTILES, values)
+    }
+
 def _filter_by_timeframe(df: pd.DataFrame, date_from: Optional[str], date_to: Optional[str]) -> pd.DataFrame:
     """
     Filter the dataframe by the dates entered by the user
 
     Args:
-        df: the dataframe to be filtered
+        df: the dataframe to be filtered, sorted by timestamp
         date_from: optional start date to filter from
         date_to: optional end date to filter up to
 
@@ -142,17 +555,16 @@ def _filter_by_timeframe(df: pd.DataFrame, date_from: Optional[str], date_to: Op
 
     try:
         # Convert optional params to datetime pandas understands
+        start_date = pd.to_datetime(date_from) if date_from is not None else None
+        end_date = pd.to_datetime(date_to) if date_to is not None else None
 
-        if date_from is not None:
-            start_date = pd.to_datetime(date_from)
-            df = df[df["timestamp"] >= date_from]
-        
-        if date_to is not None:
-            end_date = pd.to_datetime(date_to)
-            df = df[df["timestamp"] < date_to]
+        # The rows are already in timestamp order, so the range is found by binary search rather than masking every row
+        with timed("filter"):
+            timestamps = df["timestamp"]
+            first = timestamps.searchsorted(start_date, side="left") if start_date is not None else 0
+            last = timestamps.searchsorted(end_date, side="left") if end_date is not None else len(df)
 
-        # Creates a new dataframe by extracting the lines where the condition of the timestamp is between the two dates
-        return df
+            return df.iloc[first:max(first, last)]
 
     except Exception as e:
-        raise SummaryError(f"Failed to filter by timestamp: {e}")
\ No newline at end of file
+        raise SummaryError(f"Failed to filter by timestamp: {e}")
@@ -1,9 +1,23 @@
-import pandas as pd
+from __future__ import annotations
+
+import codecs
 import io
-from datetime import datetime
+from collections import deque
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import numpy as np
 from fastapi import UploadFile
 
-from .file_handler import load_file, FileTooLargeError
+from ..config import DUPLICATE_IDS, VALIDATION_WORKERS
+from .duplicates import DUPLICATE_MODES, IdHashes, hash_ids
+from .executor import run_in_thread, validation_pool
+from .metrics import bytes_processed, rows_processed, timed
+from .file_handler import read_upload, UploadWriter, StreamDecompressor, FileTooLargeError, DecompressionError
+from .lazy import lazy_import
+
+pd = lazy_import("pandas")
 
 class ValidationError(Exception):
     """Custom exception to raise during file validation, for better categorisation"""
@@ -18,7 +32,133 @@ REQUIRED_HEADERS = [
 ]
 
 TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S" # We always expect this form for the timestamp value
- 
+VALIDATION_CHUNK_SIZE = 4 * 1024 * 1024 # Characters of CSV text parsed at a time, which bounds memory use during validation
+MAX_CHUNKS_IN_FLIGHT = 2 * max(VALIDATION_WORKERS, 1) # Enough to keep every worker busy without holding the whole file in memory
+FIRST_DATA_LINE = 2 # Line 1 of the file is the header
+
+@dataclass
+class IngestResult:
+    """What was saved by an upload"""
+    path: str # The raw path of the saved file
+    rows: int # Rows in the upload as sent
+    duplicates: int # Rows repeating an earlier transaction ID, dropped from the saved file with "keep_first"
+
+class CsvStreamValidator:
+    """
+    Validates a CSV file fed to it piece by piece, so it never needs the whole file in memory.
+
+    Bytes are decoded incrementally and split on record boundaries into bounded chunks, so a quoted
+    field holding a line break is never cut in two. Given an
+    executor, each complete chunk is validated there while the rest of the file arrives, so
+    chunks are checked in parallel. Results are taken in file order, which makes the earliest
+    error in the file the one reported, and once any chunk fails no further chunks are started.
+    """
+
+    def __init__(self, chunk_size: int = VALIDATION_CHUNK_SIZE, executor: Optional[Executor] = None, track_ids: bool = False):
+        self.chunk_size = chunk_size
+        self._executor = executor
+        self._task = validate_chunk_ids if track_ids else validate_chunk
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._header: Optional[str] = None
+        self._pending = "" # Text after the last complete record, waiting for the rest of it
+        self._lines: list[str] = []
+        self._buffered = 0
+        self._next_line = FIRST_DATA_LINE # File line number of the first row in the next chunk
+        self._in_flight: deque[Future] = deque() # Submitted chunks, in file order
+        self.rows = 0 # Data rows validated so far
+        self.ids: Optional[IdHashes] = IdHashes() if track_ids else None # Hashed transaction IDs, when tracked
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Args:
+            chunk: The next bytes of the file
+        """
+        self._add_text(self._decoder.decode(chunk))
+
+    def close(self) -> None:
+        """Validate whatever remains once the whole file has been fed"""
+        self._add_text(self._decoder.decode(b"", final=True))
+        if self._pending:
+            self._lines.append(self._pending + "\n") # The last line may have no trailing newline
+            self._pending = ""
+        self._validate_lines()
+        self._collect(wait=True)
+
+        if self._header is None or self.rows == 0:
+            raise ValidationError("CSV is empty.")
+
+    def flush(self) -> None:
+        """Validate every complete line fed so far, waiting for the results"""
+        self._validate_lines()
+        self._collect(wait=True)
+
+    def cancel(self) -> None:
+        """Abandon any chunks still waiting to be validated"""
+        while self._in_flight:
+            self._in_flight.popleft().cancel()
+
+    def _add_text(self, text: str) -> None:
+        text = self._pending + text
+        end = _last_record_end(text)
+        self._pending = text[end:]
+        if end == 0:
+            return
+
+        complete = text[:end]
+        if self._header is None:
+            header_end = _first_record_end(complete)
+            self._header, complete = complete[:header_end], complete[header_end:]
+
+        self._lines.append(complete)
+        self._buffered += len(complete)
+        if self._buffered >= self.chunk_size:
+            self._validate_lines()
+
+    def _validate_lines(self) -> None:
+        if self._header is None or not self._lines:
+            return
+
+        text = "".join(self._lines)
+        first_line = self._next_line
+        self._next_line += text.count("\n")
+        self._lines = []
+        self._buffered = 0
+
+        if self._executor is None:
+            self._record(self._task(self._header, text, first_line))
+            return
+
+        self._in_flight.append(self._executor.submit(self._task, self._header, text, first_line))
+        self._collect(wait=False)
+
+    def _record(self, result) -> None:
+        """Take the result of one chunk, a row count with the chunk's ID hashes when they are tracked"""
+        if self.ids is None:
+            self.rows += result
+            return
+        rows, hashes = result
+        self.rows += rows
+        self.ids.add(hashes)
+
+    def _collect(self, wait: bool) -> None:
+        """
+        Take the results of finished chunks, oldest first
+
+        Args:
+            wait: Whether to wait for every submitted chunk, rather than only as many as needed
+                to stay within the in-flight limit
+        """
+        # A failure anywhere means waiting on the chunks before it, in case one holds an earlier error
+        failed = any(future.done() and future.exception() is not None for future in self._in_flight)
+        while self._in_flight and (
+                wait or failed or self._in_flight[0].done() or len(self._in_flight) > MAX_CHUNKS_IN_FLIGHT
+            ):
+            try:
+                self._record(self._in_flight.popleft().result())
+            except BaseException:
+                self.cancel() # Later chunks cannot produce an earlier error
+                raise
+
 async def validate_file(file: UploadFile) -> None:
     """
     Verifies the file, uploaded by the user, meets the schema requirements
@@ -26,40 +166,229 @@ async def validate_file(file: UploadFile) -> None:
     Args:
         file: The file the user wishes to upload
     """
+    await _process_upload(file)
+
+async def ingest_file(
+        file: UploadFile,
+        destination: Optional[Path] = None,
+        encoding: Optional[str] = None,
+        duplicates: str = DUPLICATE_IDS
+    ) -> IngestResult:
+    """
+    Validates the uploaded file and saves it in a single pass over its contents. The saved
+    file is only replaced once the whole upload has been validated.
+
+    Args:
+        file: The file the user wishes to upload
+        destination: Where to save the file, the latest upload if not given
+        encoding: How the upload is compressed, "gzip" or "zstd". It is decompressed as it
+            streams through validation and saved as plain CSV
+        duplicates: What to do with rows repeating an earlier transaction ID, one of DUPLICATE_MODES
+
+    Returns:
+        IngestResult: The path of the saved file, with its row and duplicate counts
+    """
+    if duplicates not in DUPLICATE_MODES:
+        raise ValidationError(f"Duplicate handling must be one of: {', '.join(DUPLICATE_MODES)}")
+
+    writer = UploadWriter(destination) if destination is not None else UploadWriter()
+    with writer:
+        validator = await _process_upload(file, writer, encoding, track_ids=duplicates != "allow")
+        repeated = await run_in_thread(resolve_duplicates, validator, duplicates, writer)
+        return IngestResult(writer.commit(), validator.rows, repeated)
+
+def resolve_duplicates(validator: CsvStreamValidator, duplicates: str, writer: Optional[UploadWriter] = None) -> int:
+    """
+    Act on the rows of a validated upload that repeat an earlier transaction ID
+
+    Args:
+        validator: The closed validator the upload went through
+        duplicates: One of DUPLICATE_MODES
+        writer: Where the upload was saved, from which "keep_first" drops the repeats
+
+    Returns:
+        int: The number of rows repeating an earlier transaction ID, 0 if IDs were not tracked
+
+    Raises:
+        ValidationError: If duplicates are rejected and the upload holds any
+    """
+    if validator.ids is None:
+        return 0
+
+    with timed("duplicates"):
+        repeated = validator.ids.duplicates()
+        if len(repeated) > 0 and duplicates == "reject":
+            raise ValidationError(
+                f"Found {len(repeated)} rows repeating an earlier transaction_id, the first is data row {repeated[0] + 1}"
+            )
+        if len(repeated) > 0 and duplicates == "keep_first" and writer is not None:
+            writer.drop_records(repeated)
+    return len(repeated)
+
+async def _process_upload(
+        file: UploadFile,
+        writer: Optional[UploadWriter] = None,
+        encoding: Optional[str] = None,
+        track_ids: bool = False
+    ) -> CsvStreamValidator:
+    """
+    Stream the upload through the validator, and the writer if one is given
+
+    Args:
+        file: The file the user wishes to upload
+        writer: Optional destination for the validated bytes
+        encoding: Optional compression to undo on the way through
+        track_ids: Whether to hash every transaction ID so duplicates can be found
+
+    Returns:
+        CsvStreamValidator: The closed validator, holding the row count and any ID hashes
+    """
+    validator = CsvStreamValidator(executor=validation_pool(), track_ids=track_ids)
+    # The raw size limit still applies to the compressed bytes, the decompressor limits what they inflate to
+    decompressor = StreamDecompressor(encoding) if encoding is not None else None
     try:
-        # Read the file into memory and decode the content into a CSV format
-        content_bytes = await load_file(file)
-
-        # Convert bytes to string and create file-like object for pandas
-        content_str = content_bytes.decode('utf-8')
-        content_io = io.StringIO(content_str)
-        
-        # Read CSV with clear schema header columns to verify against
-        dataframe = pd.read_csv(content_io, 
-            usecols=REQUIRED_HEADERS,
-            dtype={
-                'transaction_id': 'str',
-                'user_id': 'str', 
-                'product_id': 'str',
-                'timestamp': 'str',
-                'transaction_amount': 'str'
-            })
-
-        if dataframe.empty:
-            raise ValidationError("CSV is empty.")
-        
-        # Validate all rows in the file
-        _validate_dataframe(dataframe)
-            
-    # Custom error handling for better catgeorisation
-    except FileTooLargeError:
-        raise ValidationError("File uploaded exceeds 95mb limit")
-    except UnicodeDecodeError:
-        raise ValidationError("File must be UTF-8 encoded")
-    except pd.errors.ParserError as e:
-        raise ValidationError(f"CSV error occurred during parsing: {str(e)}")
+        with timed("validate"):
+            async for chunk in read_upload(file):
+                # Decompressing, writing and splitting run on the thread pool so other requests are served in the meantime
+                await run_in_thread(_consume_chunk, chunk, validator, writer, decompressor)
+            if decompressor is not None:
+                decompressor.close()
+                bytes_processed.inc(decompressor.size, "decompress")
+            await run_in_thread(validator.close)
+        rows_processed.inc(validator.rows, "validate")
     except Exception as e:
-        raise ValidationError(f"Invalid CSV format: {str(e)}")
+        raise as_validation_error(e)
+    finally:
+        validator.cancel()
+    return validator
+
+def as_validation_error(error: Exception) -> ValidationError:
+    """
+    Describe a failure met while validating an upload in the terms reported to the user
+
+    Args:
+        error: The exception raised while reading or validating the upload
+
+    Returns:
+        ValidationError: The error to report
+    """
+    # Custom error handling for better catgeorisation
+    if isinstance(error, (FileTooLargeError, DecompressionError)):
+        return ValidationError(str(error))
+    if isinstance(error, UnicodeDecodeError):
+        return ValidationError("File must be UTF-8 encoded")
+    if isinstance(error, pd.errors.ParserError):
+        return ValidationError(f"CSV error occurred during parsing: {str(error)}")
+    return ValidationError(f"Invalid CSV format: {str(error)}")
+
+def _consume_chunk(
+        chunk: bytes,
+        validator: CsvStreamValidator,
+        writer: Optional[UploadWriter],
+        decompressor: Optional[StreamDecompressor] = None
+    ) -> None:
+    pieces = decompressor.decompress(chunk) if decompressor is not None else (chunk,)
+    for piece in pieces:
+        if writer is not None:
+            writer.write(piece)
+        validator.feed(piece)
+
+def validate_chunk(header: str, text: str, first_line: int) -> int:
+    """
+    Validate one chunk of complete CSV records. Runs in a worker process, so it is kept at module level.
+
+    Args:
+        header: The header line of the file
+        text: Complete data records from the file
+        first_line: The line number, within the whole file, of the first line of text
+
+    Returns:
+        int: The number of rows validated
+    """
+    return len(_read_chunk(header, text, first_line))
+
+def validate_chunk_ids(header: str, text: str, first_line: int) -> tuple[int, np.ndarray]:
+    """
+    Validate one chunk like validate_chunk, also hashing its transaction IDs so duplicates can be found
+
+    Returns:
+        tuple[int, np.ndarray]: The number of rows validated, and the hash of each row's transaction ID
+    """
+    dataframe = _read_chunk(header, text, first_line)
+    return len(dataframe), hash_ids(dataframe['transaction_id'])
+
+def _last_record_end(text: str) -> int:
+    """
+    Args:
+        text: CSV text starting at the beginning of a record
+
+    Returns:
+        int: The position just after the last line break that ends a record, 0 if none does. A line
+            break only ends a record with an even number of quotes before it, otherwise it is inside
+            a quoted field, and escaped quotes are doubled so they never change the count's parity
+    """
+    end = text.rfind("\n")
+    quotes = text.count('"', 0, end) if end >= 0 else 0
+    while quotes % 2 == 1: # Step back over the lines of a quoted field still open at the end
+        previous = text.rfind("\n", 0, end)
+        if previous < 0:
+            return 0
+        quotes -= text.count('"', previous, end)
+        end = previous
+    return end + 1
+
+def _first_record_end(text: str) -> int:
+    """
+    Args:
+        text: Complete CSV records
+
+    Returns:
+        int: The position just after the line break ending the first record
+    """
+    end = text.index("\n")
+    while text.count('"', 0, end) % 2 == 1:
+        end = text.index("\n", end + 1)
+    return end + 1
+
+def _record_lines(text: str, first_line: int) -> np.ndarray:
+    """
+    Args:
+        text: Complete CSV records
+        first_line: The line number, within the whole file, of the first line of text
+
+    Returns:
+        np.ndarray: The file line number each record starts on, skipping blank lines as the parser does
+    """
+    starts = []
+    quoted = False
+    for number, line in enumerate(text.split("\n")[:-1], first_line):
+        if not quoted and line.strip():
+            starts.append(number)
+        if line.count('"') % 2 == 1:
+            quoted = not quoted
+    return np.array(starts, dtype=np.int64)
+
+def _read_chunk(header: str, text: str, first_line: int) -> pd.DataFrame:
+    """Parse and validate one chunk, indexed by line number in the file"""
+    # Read CSV with clear schema header columns to verify against
+    dataframe = pd.read_csv(io.StringIO(header + text),
+        usecols=REQUIRED_HEADERS,
+        dtype={
+            'transaction_id': 'str',
+            'user_id': 'str',
+            'product_id': 'str',
+            'timestamp': 'str',
+            'transaction_amount': 'str'
+        })
+    # Index by line number in the file, so errors point at the right line. Lines only need counting
+    # record by record when the chunk has blank lines or fields spanning lines
+    if len(dataframe) == text.count("\n"):
+        dataframe.index += first_line
+    else:
+        dataframe.index = _record_lines(text, first_line)
+
+    _validate_dataframe(dataframe)
+    return dataframe
 
 def _validate_dataframe(df: pd.DataFrame) -> None:
     """
@@ -68,7 +397,7 @@ def _validate_dataframe(df: pd.DataFrame) -> None:
     Args:
         df: A pd.DataFrame to validate
     """
-    
+
     # Validate all timestamps in rows
     validate_timestamps = pd.to_datetime(df['timestamp'], format=TIMESTAMP_FORMAT, errors='coerce')
     # Validate all transaction_amount in rows
@@ -83,9 +412,9 @@ def _validate_dataframe(df: pd.DataFrame) -> None:
         first_error = invalid_timestamps_indexes[0] # We only need the first error which will get sent back to the user
         error_val = df.at[first_error, 'timestamp'] # Extract the particular error raised
         raise ValidationError(f"Invalid timestamp found on line {first_error}: {error_val}")
-    
+
     invalid_amount_indexes = df[amount_series.isnull()].index # Get index of the array with invalid transaction amounts
     if len(invalid_amount_indexes) > 0:
-        first_error = invalid_amount_indexes[0] 
+        first_error = invalid_amount_indexes[0]
         error_val = df.at[first_error, 'transaction_amount']
-        raise ValidationError(f"Invailid transaction amount found on line {first_error}: {error_val}")
\ No newline at end of file
+        raise ValidationError(f"Invailid transaction amount found on line {first_error}: {error_val}")
@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from ..config import DUPLICATE_IDS, UPLOADS_DIR, MAX_PART_SIZE, MAX_SESSION_SIZE, UPLOAD_SESSION_TTL
+from .duplicates import DUPLICATE_MODES
+from .executor import run_in_thread, validation_pool
+from .file_handler import CHUNK_SIZE, UploadWriter
+from .transaction_validator import CsvStreamValidator, IngestResult, as_validation_error, resolve_duplicates
+
+class UploadSessionError(Exception):
+    """Raised when a part or session of a chunked upload cannot be accepted"""
+    pass
+
+class SessionNotFoundError(UploadSessionError):
+    """Raised for an upload session that does not exist, or has expired"""
+    pass
+
+SESSIONS_DIR = UPLOADS_DIR / "sessions"
+MAX_PARTS = 10_000 # Part numbers run from 1 to this
+UPLOAD_MODES = ("replace", "append")
+SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}") # Session IDs become directory names, so nothing else is accepted
+
+@dataclass
+class UploadSession:
+    """The state of one chunked upload, persisted so it can be resumed after a dropped connection"""
+    session_id: str
+    mode: str # Whether the assembled file replaces the stored transactions or is appended to them
+    created: float
+    parts: dict[str, dict] = field(default_factory=dict) # Size and SHA-256 of each received part, by part number
+    validated: int = 0 # Parts validated so far, always parts 1 to this
+    error: Optional[str] = None # Why validation failed, after which no more parts are accepted
+    duplicates: str = DUPLICATE_IDS # What to do with rows repeating an earlier transaction ID, one of DUPLICATE_MODES
+
+    @property
+    def size(self) -> int:
+        return sum(part["size"] for part in self.parts.values())
+
+class UploadSessions:
+    """
+    Chunked uploads, assembled from numbered parts that may arrive in any order.
+
+    Each part is streamed straight to disk and hashed on the way, so memory stays bounded by
+    the read size however large the file. Parts are validated as soon as every part before
+    them has arrived, so a bad file is rejected long before it has been sent in full.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._session_locks: dict[str, threading.Lock] = {}
+        self._validators: dict[str, CsvStreamValidator] = {} # Validation progress, only kept in memory
+
+    def create(self, mode: str = "replace", duplicates: str = DUPLICATE_IDS) -> UploadSession:
+        """
+        Start a new upload session, clearing out any that have expired
+
+        Args:
+            mode: "replace" or "append", applied once the upload is completed
+            duplicates: What to do with rows repeating an earlier transaction ID, one of DUPLICATE_MODES
+
+        Returns:
+            UploadSession: The new, empty session
+        """
+        if mode not in UPLOAD_MODES:
+            raise UploadSessionError(f"Upload mode must be one of: {', '.join(UPLOAD_MODES)}")
+        if duplicates not in DUPLICATE_MODES:
+            raise UploadSessionError(f"Duplicate handling must be one of: {', '.join(DUPLICATE_MODES)}")
+        self._remove_expired()
+
+        session = UploadSession(uuid.uuid4().hex, mode, time.time(), duplicates=duplicates)
+        self._session_dir(session.session_id).mkdir(parents=True)
+        self._save(session)
+        return session
+
+    def get(self, session_id: str) -> UploadSession:
+        """
+        Args:
+            session_id: The session to look up
+
+        Returns:
+            UploadSession: The session's current state, listing every part received so far
+
+        Raises:
+            SessionNotFoundError: If there is no such session
+        """
+        if not SESSION_ID_PATTERN.fullmatch(session_id):
+            raise SessionNotFoundError(f"Upload session {session_id} not found")
+        try:
+            with open(self._session_dir(session_id) / "session.json") as f:
+                return UploadSession(**json.load(f))
+        except FileNotFoundError:
+            raise SessionNotFoundError(f"Upload session {session_id} not found")
+
+    async def write_part(
+            self,
+            session_id: str,
+            number: int,
+            chunks: AsyncIterator[bytes],
+            checksum: Optional[str] = None
+        ) -> UploadSession:
+        """
+        Stream one part to disk and validate every part that is now ready
+
+        Args:
+            session_id: The session the part belongs to
+            number: The part's position in the file, from 1
+            chunks: The part's bytes as they arrive
+            checksum: Optional hex SHA-256 of the part, which it must match to be accepted
+
+        Returns:
+            UploadSession: The session including the new part
+        """
+        session = self.get(session_id)
+        if session.error is not None:
+            raise UploadSessionError(session.error)
+        if not 1 <= number <= MAX_PARTS:
+            raise UploadSessionError(f"Part numbers must be between 1 and {MAX_PARTS}")
+
+        part_dir = self._session_dir(session_id)
+        temp_path = part_dir / f".{number:06d}.{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+        # Other parts' sizes bound this one, so the assembled file can never exceed the limit
+        allowed = min(MAX_PART_SIZE, MAX_SESSION_SIZE - session.size + session.parts.get(str(number), {}).get("size", 0))
+        try:
+            with open(temp_path, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > allowed:
+                        raise UploadSessionError(
+                            f"Part exceeds the {MAX_PART_SIZE} byte part limit or the {MAX_SESSION_SIZE} byte upload limit"
+                        )
+                    digest.update(chunk)
+                    await run_in_thread(f.write, chunk)
+
+            sha256 = digest.hexdigest()
+            if checksum is not None and checksum.strip().lower() != sha256:
+                raise UploadSessionError(f"Checksum mismatch for part {number}, expected {checksum} but received {sha256}")
+
+            return await run_in_thread(self._store_part, session_id, number, temp_path, size, sha256)
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    async def complete(self, session_id: str, destination: Path) -> IngestResult:
+        """
+        Finish validating the upload and assemble its parts into one file
+
+        Args:
+            session_id: The session to complete
+            destination: Where to save the assembled file
+
+        Returns:
+            IngestResult: The path of the assembled file, with its row and duplicate counts. The
+                session no longer exists afterwards
+        """
+        return await run_in_thread(self._complete, session_id, destination)
+
+    def abort(self, session_id: str) -> None:
+        """Discard a session and every part received for it"""
+        self.get(session_id)
+        with self._session_lock(session_id):
+            self._discard(session_id)
+
+    def _store_part(self, session_id: str, number: int, temp_path: Path, size: int, sha256: str) -> UploadSession:
+        with self._session_lock(session_id):
+            session = self.get(session_id)
+            existing = session.parts.get(str(number))
+            if number <= session.validated:
+                if existing is not None and existing["sha256"] == sha256:
+                    return session # A retry of a part that already arrived intact
+                raise UploadSessionError(f"Part {number} has already been validated and cannot be replaced")
+            # Checked again under the lock, as parts streamed in parallel were each measured against an older total
+            if session.size - (existing["size"] if existing is not None else 0) + size > MAX_SESSION_SIZE:
+                raise UploadSessionError(f"Part would take the upload past the {MAX_SESSION_SIZE} byte upload limit")
+
+            os.replace(temp_path, self._part_path(session_id, number))
+            session.parts[str(number)] = {"size": size, "sha256": sha256}
+            self._validate_ready(session)
+            self._save(session)
+            if session.error is not None:
+                raise UploadSessionError(session.error)
+            return session
+
+    def _validate_ready(self, session: UploadSession) -> None:
+        """Feed the validator every part that directly follows the parts already validated"""
+        validator = self._validators.get(session.session_id)
+        if validator is None:
+            # Progress is lost on a restart, so validation starts again from the first part
+            validator = self._validators[session.session_id] = CsvStreamValidator(
+                executor=validation_pool(), track_ids=session.duplicates != "allow"
+            )
+            session.validated = 0
+
+        try:
+            while str(session.validated + 1) in session.parts:
+                with open(self._part_path(session.session_id, session.validated + 1), "rb") as f:
+                    while chunk := f.read(CHUNK_SIZE):
+                        validator.feed(chunk)
+                session.validated += 1
+            validator.flush() # Report a bad row in the part that carried it, not in some later one
+        except Exception as e:
+            validator.cancel()
+            self._validators.pop(session.session_id, None)
+            session.error = str(as_validation_error(e))
+
+    def _complete(self, session_id: str, destination: Path) -> IngestResult:
+        with self._session_lock(session_id):
+            session = self.get(session_id)
+            if session.error is not None:
+                raise UploadSessionError(session.error)
+
+            count = len(session.parts)
+            missing = [number for number in range(1, count + 1) if str(number) not in session.parts]
+            if count == 0 or missing:
+                raise UploadSessionError(f"Upload is missing parts: {missing or [1]}")
+
+            self._validate_ready(session)
+            validator = self._validators.pop(session_id, None)
+            if session.error is None:
+                try:
+                    validator.close() # Checks the final line, and waits for any chunks still being validated
+                except Exception as e:
+                    session.error = str(as_validation_error(e))
+            if session.error is not None:
+                self._save(session)
+                raise UploadSessionError(session.error)
+
+            with UploadWriter(destination) as writer:
+                for number in range(1, count + 1):
+                    with open(self._part_path(session_id, number), "rb") as f:
+                        while chunk := f.read(CHUNK_SIZE):
+                            writer.write(chunk)
+                try:
+                    repeated = resolve_duplicates(validator, session.duplicates, writer)
+                except Exception as e:
+                    session.error = str(e)
+                    self._save(session)
+                    raise UploadSessionError(session.error)
+                result = IngestResult(writer.commit(), validator.rows, repeated)
+
+            self._discard(session_id)
+            return result
+
+    def _discard(self, session_id: str) -> None:
+        validator = self._validators.pop(session_id, None)
+        if validator is not None:
+            validator.cancel()
+        shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+        with self._lock:
+            self._session_locks.pop(session_id, None)
+
+    def _remove_expired(self) -> None:
+        if not self.directory.is_dir():
+            return
+        cutoff = time.time() - UPLOAD_SESSION_TTL
+        for session_dir in self.directory.iterdir():
+            if session_dir.is_dir() and session_dir.stat().st_mtime < cutoff:
+                self._discard(session_dir.name)
+
+    def _save(self, session: UploadSession) -> None:
+        path = self._session_dir(session.session_id) / "session.json"
+        temp_path = path.with_name("session.json.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(asdict(session), f)
+        os.replace(temp_path, path) # A crash mid-write never leaves a truncated session behind
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        with self._lock:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def _session_dir(self, session_id: str) -> Path:
+        return self.directory / session_id
+
+    def _part_path(self, session_id: str, number: int) -> Path:
+        return self._session_dir(session_id) / f"{number:06d}.part"
+
+upload_sessions = UploadSessions(SESSIONS_DIR)
@@ -0,0 +1,65 @@
+import logging
+import time
+from typing import Optional
+
+from .executor import run_in_thread
+from .transaction_summary import warm_data
+
+logger = logging.getLogger(__name__)
+
+class WarmUp:
+    """
+    Progress of getting the process ready to answer queries quickly: the deferred imports first,
+    then loading and indexing any data already stored. Readiness checks report it until it is done.
+    A failed warm-up never counts as ready, until an upload has loaded data that works.
+    """
+
+    def __init__(self):
+        self.stage = "starting"
+        self.error: Optional[str] = None
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.stage == "ready"
+
+    def data_loaded(self) -> None:
+        """Record that an upload has loaded and indexed fresh data, which recovers from a failed warm-up"""
+        if self.stage == "failed":
+            self.stage = "ready"
+            self.error = None
+
+    async def run(self) -> None:
+        """Work through every stage, recording a failure rather than raising it"""
+        try:
+            self.stage = "importing"
+            await run_in_thread(_import_libraries)
+
+            self.stage = "loading data"
+            await warm_data()
+            self.stage = "ready"
+        except Exception as e:
+            # Queries load the data on demand anyway, so the process still takes uploads that fix it
+            logger.exception("Warm-up failed")
+            self.stage = "failed"
+            self.error = str(e)
+        finally:
+            self.finished = time.monotonic()
+
+    def status(self) -> dict:
+        """
+        Returns:
+            dict: The current stage, how long warming has taken so far and any error
+        """
+        elapsed = (self.finished or time.monotonic()) - self.started
+        status = {"status": self.stage, "elapsed_seconds": round(elapsed, 3)}
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+def _import_libraries() -> None:
+    """Import the libraries deferred at start-up, so the first query does not pay for them"""
+    import pandas # noqa: F401
+
+warm_up = WarmUp()
@@ -0,0 +1,76 @@
+import time
+import tracemalloc
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+SEED = 42 # Fixed seed so every run benchmarks the same data
+START = np.datetime64("2025-01-01 00:00:00")
+SPAN_SECONDS = 365 * 24 * 60 * 60
+
+def make_transactions(rows: int, users: int = 1000, products: int = 500, seed: int = SEED) -> pd.DataFrame:
+    """
+    Build an in-memory transactions dataframe shaped like a parsed upload
+
+    Args:
+        rows: The number of transactions to generate
+        users: The number of distinct user IDs
+        products: The number of distinct product IDs
+        seed: Seed for the random generator
+
+    Returns:
+        pd.DataFrame: Transactions sorted by timestamp, as the summary service holds them
+    """
+    rng = np.random.default_rng(seed)
+    offsets = rng.integers(0, SPAN_SECONDS, rows).astype("timedelta64[s]")
+
+    frame = pd.DataFrame({
+        "transaction_id": np.arange(rows).astype(str),
+        "user_id": rng.integers(1, users + 1, rows).astype(str),
+        "product_id": rng.integers(1, products + 1, rows).astype(str),
+        "timestamp": (START + offsets).astype("datetime64[ns]"),
+        "transaction_amount": np.round(rng.uniform(5.0, 500.0, rows), 2)
+    })
+    return frame.sort_values("timestamp")
+
+def time_call(function: Callable[[], object], repeat: int = 1000) -> float:
+    """
+    Time a call, returning the best average of a few rounds to limit noise
+
+    Args:
+        function: A zero argument callable to time
+        repeat: How many calls make up one round
+
+    Returns:
+        float: Seconds per call
+    """
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best
+
+def measure(function: Callable[[], object], repeat: int = 1) -> tuple[float, float]:
+    """
+    Args:
+        function: A zero argument callable to measure
+        repeat: How many timed runs to take the fastest of
+
+    Returns:
+        tuple[float, float]: seconds taken and peak memory allocated in MB
+    """
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    # Memory is traced on a second run, as tracing slows down every allocation
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
@@ -0,0 +1,33 @@
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import make_transactions, time_call
+from app.services.snapshot import read_snapshot, write_snapshot
+
+SIZES = [100_000, 1_000_000]
+
+def footprint(df) -> float:
+    """Memory held by a dataframe in MB, counting the Python objects inside object columns"""
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
+
+def run() -> None:
+    """Compare the memory footprint and user lookup speed of the parsed, full and compact dataset representations"""
+
+    print(f"{'rows':>10} {'layout':>8} {'memory (MB)':>12} {'user mask (ms)':>15}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in SIZES:
+            parsed = make_transactions(rows).reset_index(drop=True)
+            path = Path(directory) / f"latest.{rows}.columns"
+            write_snapshot(parsed, path)
+
+            layouts = {
+                "parsed": parsed,
+                "full": read_snapshot(path, compact=False),
+                "compact": read_snapshot(path, compact=True)
+            }
+            for name, df in layouts.items():
+                mask = time_call(lambda: df['user_id'] == "305", repeat=20)
+                print(f"{rows:>10} {name:>8} {footprint(df):>12.1f} {mask * 1e3:>15.2f}")
+
+if __name__ == "__main__":
+    run()
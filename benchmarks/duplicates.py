@@ -0,0 +1,81 @@
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import SEED, measure
+from app.services.duplicates import IdHashes, hash_ids
+from scripts.sample_generation import generate
+
+SIZES = [1_000_000, 3_000_000]
+DUPLICATE_RATE = 0.05 # Fraction of rows given the ID of an earlier row
+CHUNK_ROWS = 100_000 # IDs arrive a validation chunk at a time, and only the chunk being read is held as strings
+
+def make_ids(rows: int) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: Generated UUIDs as fixed width bytes, with DUPLICATE_RATE of them repeating an earlier one
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        [path] = generate(Path(directory) / "sample.csv", rows, seed=SEED)
+        ids = pd.read_csv(path, usecols=["transaction_id"])["transaction_id"].to_numpy().astype("S36")
+
+    rng = np.random.default_rng(SEED)
+    repeats = rng.choice(np.arange(1, rows), round(rows * DUPLICATE_RATE), replace=False)
+    ids[repeats] = ids[(rng.random(len(repeats)) * repeats).astype(np.int64)]
+    return ids
+
+def with_set(ids: np.ndarray) -> np.ndarray:
+    """Positions of repeated IDs, keeping every ID seen so far as a string in a set"""
+    seen = set()
+    repeated = []
+    for start in range(0, len(ids), CHUNK_ROWS):
+        for position, value in enumerate(ids[start:start + CHUNK_ROWS].astype(str).tolist(), start):
+            if value in seen:
+                repeated.append(position)
+            else:
+                seen.add(value)
+    return np.array(repeated, dtype=np.int64)
+
+def with_hashes(ids: np.ndarray) -> np.ndarray:
+    """Positions of repeated IDs, keeping 64-bit hashes of the IDs and sorting them once at the end"""
+    hashes = IdHashes()
+    for start in range(0, len(ids), CHUNK_ROWS):
+        chunk = pd.Series(ids[start:start + CHUNK_ROWS].astype(str).astype(object))
+        hashes.add(hash_ids(chunk))
+    return hashes.duplicates()
+
+def hashed(ids: np.ndarray) -> IdHashes:
+    """The hashes an upload's validation workers send back, ready to be checked"""
+    hashes = IdHashes()
+    hashes.add(hash_ids(pd.Series(ids.astype(str).astype(object))))
+    return hashes
+
+def run() -> None:
+    """
+    Compare finding repeated transaction IDs with a set of the ID strings against sorting their hashes.
+    The hash columns include hashing every chunk, which an upload spreads over its validation workers,
+    and the sort columns time the single sort left for the request once every chunk is in
+    """
+
+    print(
+        f"{'rows':>10} {'repeats':>8} {'set (s)':>8} {'set (MB)':>9} {'hash (s)':>9} {'hash (MB)':>10} "
+        f"{'sort (s)':>9} {'sort (MB)':>10}"
+    )
+    for rows in SIZES:
+        ids = make_ids(rows)
+        expected = with_set(ids)
+        assert np.array_equal(with_hashes(ids), expected)
+
+        set_time, set_memory = measure(lambda: with_set(ids))
+        hash_time, hash_memory = measure(lambda: with_hashes(ids))
+        hashes = hashed(ids)
+        sort_time, sort_memory = measure(hashes.duplicates, repeat=3)
+        print(
+            f"{rows:>10} {len(expected):>8} {set_time:>8.2f} {set_memory:>9.0f} {hash_time:>9.2f} {hash_memory:>10.0f} "
+            f"{sort_time:>9.2f} {sort_memory:>10.0f}"
+        )
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import httpx
+import numpy as np
+
+from benchmarks.common import SEED
+from scripts.sample_generation import generate
+
+ROWS = 1_000_000
+USERS = 1000
+CONCURRENCY = 32
+DURATION = 10.0 # Seconds of load
+DATE_RANGES = [(None, None), ("2025-01-01", "2025-04-01"), ("2025-03-01", "2025-09-01"), ("2025-06-01", None), (None, "2025-10-01")]
+
+async def summary_worker(
+        client: httpx.AsyncClient,
+        worker: int,
+        deadline: float,
+        latencies: list[tuple[float, float, bool]]
+    ) -> None:
+    """
+    Request summaries of random users and date ranges back to back until the deadline
+
+    Args:
+        client: The client to send requests with
+        worker: Number of this worker, which seeds its choice of queries
+        deadline: perf_counter time to stop at
+        latencies: Where to record the start time, latency and success of each request
+    """
+    rng = np.random.default_rng([SEED, worker])
+    while (start := time.perf_counter()) < deadline:
+        date_from, date_to = DATE_RANGES[rng.integers(len(DATE_RANGES))]
+        params = {key: value for key, value in (("date_from", date_from), ("date_to", date_to)) if value is not None}
+        response = await client.get(f"/summary/{rng.integers(1, USERS + 1)}", params=params)
+        latencies.append((start, time.perf_counter() - start, response.status_code == 200))
+
+async def upload(client: httpx.AsyncClient, csv_path: Path) -> tuple[float, float]:
+    """
+    Upload a transactions file, as the service would receive it
+
+    Returns:
+        tuple[float, float]: perf_counter times the upload started and finished
+    """
+    start = time.perf_counter()
+    with open(csv_path, "rb") as f:
+        response = await client.post("/upload", files={"file": ("latest.csv", f, "text/csv")}, timeout=None)
+    response.raise_for_status()
+    return start, time.perf_counter()
+
+def report(label: str, latencies: list[tuple[float, float, bool]], window: float) -> None:
+    """Print the latency percentiles and throughput of a set of requests made over window seconds"""
+    if not latencies:
+        print(f"{label:>14} {'no requests':>10}")
+        return
+    seconds = np.array([latency for _, latency, _ in latencies])
+    errors = sum(not ok for _, _, ok in latencies)
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1000
+    print(f"{label:>14} {len(seconds):>9} {len(seconds) / window:>9.0f} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f} {errors:>7}")
+
+async def run(
+        url: Optional[str] = None,
+        rows: int = ROWS,
+        concurrency: int = CONCURRENCY,
+        duration: float = DURATION,
+        upload_during: bool = False
+    ) -> None:
+    """
+    Drive concurrent summary requests at the service and report their latency, optionally while
+    a new file is being uploaded
+
+    Args:
+        url: Base URL of a running server, the app is driven in this process when not given
+        rows: Rows in the generated file that is uploaded before the load starts
+        concurrency: Requests in flight at once
+        duration: Seconds to keep the load up for
+        upload_during: Whether to upload the file again part way through
+    """
+    if url is None:
+        from app.main import app # Only imported when driving the app in this process
+        transport = httpx.ASGITransport(app=app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://app", timeout=60)
+    else:
+        client = httpx.AsyncClient(base_url=url, timeout=60)
+
+    with tempfile.TemporaryDirectory() as directory:
+        [csv_path] = generate(Path(directory) / "latest.csv", rows, users=USERS, seed=SEED)
+        async with client:
+            await upload(client, csv_path)
+            await client.get("/summary/1") # Loads the dataset, so the first requests measured are not cold
+
+            latencies: list[tuple[float, float, bool]] = []
+            start = time.perf_counter()
+            deadline = start + duration
+            workers = [asyncio.create_task(summary_worker(client, worker, deadline, latencies)) for worker in range(concurrency)]
+
+            upload_window = None
+            if upload_during:
+                await asyncio.sleep(duration / 4)
+                upload_window = await upload(client, csv_path)
+            await asyncio.gather(*workers)
+            end = time.perf_counter()
+
+    print(f"{rows} rows, {concurrency} concurrent requests for {duration:.0f}s {'against ' + url if url else 'in process'}")
+    print(f"{'':>14} {'requests':>9} {'req/s':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}")
+    report("all", latencies, end - start)
+    if upload_window is not None:
+        upload_start, upload_end = upload_window
+        during = [entry for entry in latencies if upload_start <= entry[0] < upload_end]
+        report("during upload", during, upload_end - upload_start)
+        report("otherwise", [entry for entry in latencies if not upload_start <= entry[0] < upload_end], (end - start) - (upload_end - upload_start))
+        print(f"Upload took {upload_end - upload_start:.2f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure summary latency and throughput under concurrent load")
+    parser.add_argument("--url", help="Base URL of a running server, e.g. http://127.0.0.1:8000. Drives the app in process if left out")
+    parser.add_argument("--rows", type=int, default=ROWS, help="Rows in the uploaded dataset")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Requests in flight at once")
+    parser.add_argument("--duration", type=float, default=DURATION, help="Seconds to keep the load up for")
+    parser.add_argument("--upload-during", action="store_true", help="Upload the dataset again while the load is running")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.rows, args.concurrency, args.duration, args.upload_during))
@@ -0,0 +1,33 @@
+import numpy as np
+
+from benchmarks.common import make_transactions, time_call
+from app.services.range_index import UserSlices
+
+SIZES = [10_000, 100_000, 1_000_000]
+START = np.datetime64("2025-03-01 09:30:00", "ns")
+END = np.datetime64("2025-09-15 17:45:00", "ns")
+
+def run() -> None:
+    """Compare locating a user's rows in a sub-day range through the user slices against masking the full dataframe"""
+
+    print(f"{'rows':>10} {'build (ms)':>12} {'slice query (us)':>17} {'mask scan (us)':>15}")
+    for rows in SIZES:
+        df = make_transactions(rows)
+        build = time_call(lambda: UserSlices.from_frame(df), repeat=1)
+        slices = UserSlices.from_frame(df)
+
+        def scan():
+            user_rows = df[df['user_id'] == "305"]
+            return user_rows[(user_rows['timestamp'] >= START) & (user_rows['timestamp'] < END)].index.to_numpy()
+
+        def locate():
+            first, last = slices.locate("305", START, END)
+            return slices.rows[first:last]
+
+        query = time_call(locate, repeat=10_000)
+        masked = time_call(scan, repeat=10)
+
+        print(f"{rows:>10} {build * 1e3:>12.1f} {query * 1e6:>17.2f} {masked * 1e6:>15.0f}")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,29 @@
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import make_transactions, measure
+from app.services.dataset import Dataset, DatasetVersion
+from app.services.snapshot import read_snapshot, snapshot_path, write_snapshot
+
+SIZES = [100_000, 1_000_000]
+
+def run() -> None:
+    """Compare a cold load of the dataset from CSV against memory-mapping its columnar snapshot"""
+
+    print(f"{'rows':>10} {'csv (s)':>9} {'csv (MB)':>9} {'mmap (s)':>9} {'mmap (MB)':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in SIZES:
+            csv_path = Path(directory) / "latest.csv"
+            make_transactions(rows).to_csv(csv_path, index=False, date_format="%Y-%m-%d %H:%M:%S")
+
+            dataset = Dataset(csv_path, DatasetVersion(0, 0, rows))
+            columns_path = snapshot_path(csv_path, dataset.source)
+            write_snapshot(dataset._parse_csv(), columns_path)
+
+            csv_time, csv_memory = measure(dataset._parse_csv)
+            mmap_time, mmap_memory = measure(lambda: read_snapshot(columns_path))
+
+            print(f"{rows:>10} {csv_time:>9.2f} {csv_memory:>9.0f} {mmap_time:>9.2f} {mmap_memory:>10.0f}")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
+from benchmarks.common import SEED, time_call
+from app.services.aggregates import DailyRollup, UserIndex
+from app.services.dataset import parse_transactions_csv
+from app.services.sqlite_store import SqliteStore, import_csv
+from scripts.sample_generation import generate
+
+SIZES = [100_000, 1_000_000, 10_000_000]
+USER = "305"
+START, END = date(2025, 3, 1), date(2025, 9, 1)
+
+def run(sizes: list[int] = SIZES) -> None:
+    """
+    Compare summary latency of the pandas backend's pre-computed aggregates against indexed SQLite queries.
+    Load is the time from the uploaded CSV to a backend ready to answer
+    """
+
+    print(f"{'rows':>10} {'backend':>8} {'load (s)':>9} {'all time (us)':>14} {'range (us)':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            csv_path = Path(directory) / "latest.csv"
+            generate(csv_path, rows, seed=SEED, workers=os.cpu_count() or 1)
+
+            start = time.perf_counter()
+            df = parse_transactions_csv(csv_path)
+            index, rollup = UserIndex.from_frame(df), DailyRollup.from_frame(df)
+            load = time.perf_counter() - start
+            del df
+            unfiltered = time_call(lambda: index.get(USER), repeat=10_000)
+            ranged = time_call(lambda: rollup.get(USER, START, END), repeat=1000)
+            print(f"{rows:>10} {'pandas':>8} {load:>9.2f} {unfiltered * 1e6:>14.2f} {ranged * 1e6:>11.2f}")
+
+            database_path = Path(directory) / "transactions.db"
+            start = time.perf_counter()
+            import_csv(csv_path, database_path, 1)
+            load = time.perf_counter() - start
+            store = SqliteStore(database_path)
+            unfiltered = time_call(lambda: store.aggregate(USER), repeat=100)
+            ranged = time_call(lambda: store.aggregate(USER, START, END), repeat=100)
+            print(f"{rows:>10} {'sqlite':>8} {load:>9.2f} {unfiltered * 1e6:>14.2f} {ranged * 1e6:>11.2f}")
+
+if __name__ == "__main__":
+    # Row counts may be given on the command line, as the largest size takes a while to generate
+    run([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+from datetime import date
+from pathlib import Path
+from typing import AsyncIterator, Callable, Optional
+
+from fastapi import UploadFile
+
+from benchmarks.common import SEED, measure, time_call
+from app.services import executor
+from app.services.aggregates import DailyRollup, UserIndex
+from app.services.dataset import parse_transactions_csv
+from app.services.file_handler import CHUNK_SIZE, MAX_FILE_SIZE, UploadWriter, read_upload
+from app.services.transaction_summary import _filter_by_timeframe, _summary_from_aggregate
+from app.services.transaction_validator import ingest_file, validate_file
+from scripts.sample_generation import generate
+
+SIZES = [100_000, 1_000_000]
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json" # Machine specific, so it is not committed
+TOLERANCE = 0.25 # A stage this much slower than its baseline counts as a regression
+REPEAT = 3 # Timed runs per stage, the fastest is kept to limit noise
+USER = "305"
+START, END = date(2025, 3, 1), date(2025, 9, 1)
+
+# Stages too quick for a memory trace to mean anything are timed over many calls instead
+FAST_STAGES = {"summary_all_time", "summary_range"}
+
+def run_stages(csv_path: Path) -> dict[str, dict[str, Optional[float]]]:
+    """
+    Time each stage an upload and a summary pass through, on one file
+
+    Args:
+        csv_path: The transactions file to benchmark with
+
+    Returns:
+        dict: Seconds and peak allocated MB of every stage, by name
+    """
+    stages: dict[str, Callable[[], object]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        destination = Path(directory) / "saved.csv"
+
+        # The upload stages go through the request size limit, so they only run on files within it
+        if csv_path.stat().st_size <= MAX_FILE_SIZE:
+            stages["read_upload"] = lambda: asyncio.run(_drain(read_upload(_upload(csv_path))))
+            stages["validate_file"] = lambda: asyncio.run(validate_file(_upload(csv_path)))
+            stages["save_file"] = lambda: _save(csv_path, destination)
+            stages["ingest_file"] = lambda: asyncio.run(ingest_file(_upload(csv_path), destination))
+
+        results = {name: _stage_result(*measure(stage, REPEAT)) for name, stage in stages.items()}
+
+    # load_transactions_data parses the file like this whenever it has changed
+    frame = parse_transactions_csv(csv_path)
+    results["parse_csv"] = _stage_result(*measure(lambda: parse_transactions_csv(csv_path), REPEAT))
+    results["build_aggregates"] = _stage_result(*measure(lambda: (UserIndex.from_frame(frame), DailyRollup.from_frame(frame)), REPEAT))
+    results["filter_by_timeframe"] = _stage_result(*measure(lambda: _filter_by_timeframe(frame, str(START), str(END)), REPEAT))
+
+    index, rollup = UserIndex.from_frame(frame), DailyRollup.from_frame(frame)
+    results["summary_all_time"] = _stage_result(time_call(lambda: _summary_from_aggregate(index.get(USER)), repeat=10_000))
+    results["summary_range"] = _stage_result(time_call(lambda: _summary_from_aggregate(rollup.get(USER, START, END)), repeat=1000))
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    """
+    Args:
+        results: This run's stage results, by row count
+        baseline: Stored stage results, by row count
+        tolerance: How much slower than its baseline a stage may be
+
+    Returns:
+        list[str]: A description of each stage that regressed
+    """
+    regressions = []
+    for rows, stages in results.items():
+        for name, result in stages.items():
+            previous = baseline.get(rows, {}).get(name)
+            if previous is not None and result["seconds"] > previous["seconds"] * (1 + tolerance):
+                regressions.append(
+                    f"{name} at {rows} rows: {_format_seconds(result['seconds'], name)} against {_format_seconds(previous['seconds'], name)}"
+                )
+    return regressions
+
+def run(sizes: list[int] = SIZES, baseline_path: Path = BASELINE_PATH, save: bool = False, tolerance: float = TOLERANCE) -> int:
+    """
+    Benchmark every stage at each size and compare against the stored baseline
+
+    Returns:
+        int: Exit status, 1 if any stage regressed
+    """
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    results = {}
+
+    print(f"{'rows':>10} {'stage':>20} {'time':>10} {'peak (MB)':>10} {'vs baseline':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            [csv_path] = generate(Path(directory) / "latest.csv", rows, seed=SEED)
+            results[str(rows)] = stages = run_stages(csv_path)
+
+            for name, result in stages.items():
+                previous = baseline.get(str(rows), {}).get(name)
+                change = f"{result['seconds'] / previous['seconds'] - 1:>+11.0%}" if previous else f"{'-':>11}"
+                peak = f"{result['peak_mb']:>10.1f}" if result["peak_mb"] is not None else f"{'-':>10}"
+                print(f"{rows:>10} {name:>20} {_format_seconds(result['seconds'], name):>10} {peak} {change:>12}")
+    executor.shutdown()
+
+    if save:
+        baseline_path.write_text(json.dumps({**baseline, **results}, indent=2))
+        print(f"Baseline saved to {baseline_path}")
+        return 0
+
+    regressions = compare(results, baseline, tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+async def _drain(chunks: AsyncIterator[bytes]) -> None:
+    async for _ in chunks:
+        pass
+
+def _upload(csv_path: Path) -> UploadFile:
+    """A fresh upload of the file, as the upload endpoint receives it"""
+    return UploadFile(open(csv_path, "rb"), filename=csv_path.name)
+
+def _save(csv_path: Path, destination: Path) -> None:
+    with open(csv_path, "rb") as source, UploadWriter(destination) as writer:
+        while chunk := source.read(CHUNK_SIZE):
+            writer.write(chunk)
+        writer.commit()
+
+def _stage_result(seconds: float, peak_mb: Optional[float] = None) -> dict[str, Optional[float]]:
+    return {"seconds": seconds, "peak_mb": peak_mb}
+
+def _format_seconds(seconds: float, name: str) -> str:
+    return f"{seconds * 1e6:.2f}us" if name in FAST_STAGES else f"{seconds:.3f}s"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every stage of an upload and a summary, and compare against a baseline")
+    parser.add_argument("sizes", nargs="*", type=int, default=SIZES, help="Row counts to benchmark at")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="Baseline results to compare against")
+    parser.add_argument("--save", action="store_true", help="Record this run as the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Fraction slower than the baseline that counts as a regression")
+    args = parser.parse_args()
+    sys.exit(run(args.sizes, args.baseline, args.save, args.tolerance))
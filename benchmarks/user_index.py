@@ -0,0 +1,21 @@
+from benchmarks.common import make_transactions, time_call
+from app.services.aggregates import UserIndex
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+def run() -> None:
+    """Compare unfiltered summary lookups through the user index against masking the full dataframe"""
+
+    print(f"{'rows':>10} {'build (ms)':>12} {'index lookup (us)':>18} {'mask scan (us)':>15}")
+    for rows in SIZES:
+        df = make_transactions(rows)
+        build = time_call(lambda: UserIndex.from_frame(df), repeat=1)
+        index = UserIndex.from_frame(df)
+
+        lookup = time_call(lambda: index.get("305"), repeat=10_000)
+        scan = time_call(lambda: df[df['user_id'] == "305"]['transaction_amount'].agg(['max', 'min', 'mean']), repeat=10)
+
+        print(f"{rows:>10} {build * 1e3:>12.1f} {lookup * 1e6:>18.2f} {scan * 1e6:>15.0f}")
+
+if __name__ == "__main__":
+    run()
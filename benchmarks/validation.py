@@ -0,0 +1,57 @@
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from benchmarks.common import SEED
+from app.services.file_handler import CHUNK_SIZE
+from app.services.transaction_validator import CsvStreamValidator
+from scripts.sample_generation import generate
+
+ROWS = 1_000_000
+
+def validate(content: bytes, workers: int) -> float:
+    """
+    Returns:
+        float: seconds taken to validate the content, fed in upload sized pieces
+    """
+    if workers == 0:
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        # Start every worker up front, so process start-up is not part of the measurement
+        list(pool.map(abs, range(workers)))
+
+    try:
+        start = time.perf_counter()
+        validator = CsvStreamValidator(executor=pool)
+        for offset in range(0, len(content), CHUNK_SIZE):
+            validator.feed(content[offset:offset + CHUNK_SIZE])
+        validator.close()
+        return time.perf_counter() - start
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+def run() -> None:
+    """Compare validating an upload in the calling thread against process pools of increasing size"""
+
+    with tempfile.TemporaryDirectory() as directory:
+        [path] = generate(Path(directory) / "sample.csv", ROWS, seed=SEED)
+        content = path.read_bytes()
+    print(f"{ROWS} rows, {len(content) / 1024 / 1024:.0f} MB")
+
+    baseline = validate(content, 0)
+    print(f"{'workers':>8} {'time (s)':>9} {'rows/s':>11} {'speed-up':>9}")
+    print(f"{'inline':>8} {baseline:>9.2f} {ROWS / baseline:>11.0f} {1.0:>9.2f}")
+
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        elapsed = validate(content, workers)
+        print(f"{workers:>8} {elapsed:>9.2f} {ROWS / elapsed:>11.0f} {baseline / elapsed:>9.2f}")
+        workers *= 2
+
+if __name__ == "__main__":
+    run()
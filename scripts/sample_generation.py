@@ -1,7 +1,10 @@
-import csv
-import random
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from faker import Faker
+from typing import Iterator, Optional
+
+import numpy as np
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent # Root path of the current sample file
 TEST_DATA_DIR = PROJECT_ROOT / "tests" / "test-data" # The route of the sample test data directory
@@ -10,12 +13,15 @@ TEST_DATA_DIR.mkdir(parents=True, exist_ok=True)
 TRANSACTIONS = 1000000
 HEADERS = ["transaction_id", "user_id", "product_id", "timestamp", "transaction_amount"]
 
-# Initialize Faker
-fake = Faker()
+SEED = 42 # Fixed default seed, so the same options always produce the same file
+BATCH_ROWS = 500_000 # Rows built at once, which bounds memory at roughly 100 bytes per row
+START_DATE = "2025-01-01"
+DAYS = 365
+MIN_AMOUNT = 5.0
+MAX_AMOUNT = 500.0
 
-# Pre-generate reusable data pools for major performance boost (files were taking too long to generate)
-UUID_POOL = [fake.uuid4() for _ in range(10000)]
-TIMESTAMP_POOL = [fake.date_time_between(start_date="-1y", end_date="now") for _ in range(5000)]
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+CORRUPTION_LETTERS = np.frombuffer(b"abcdefghijklmnopqrstuvwxyz", dtype=np.uint8)
 
 def generate_sample():
     """Main function to generate sample data for tests"""
@@ -26,90 +32,205 @@ def generate_sample():
 
     # Only generate the data of the files that do not exist in the test directory
     if not valid_file.exists():
-        _generate_valid_sample(TRANSACTIONS, valid_file)
+        generate(valid_file, TRANSACTIONS)
 
     if not large_file.exists():
-        _generate_valid_sample(1_500_000, large_file)
-    
-    if not invalid_file.exists():
-        _generate_invalid_sample(100_000, invalid_file)
+        generate(large_file, 1_500_000, seed=SEED + 1) # Over the 95mb upload limit
 
-
-def _generate_valid_sample(rows: int, file_name: str):
+    if not invalid_file.exists():
+        generate(invalid_file, 100_000, corruption_rate=0.001, seed=SEED + 2)
+
+def generate(
+        output: Path,
+        rows: int,
+        users: int = 1000,
+        products: int = 500,
+        start: str = START_DATE,
+        days: int = DAYS,
+        skew: float = 0.0,
+        corruption_rate: float = 0.0,
+        seed: int = SEED,
+        shards: int = 1,
+        workers: int = 1
+    ) -> list[Path]:
     """
-    Generate valid sample data
+    Generate a transactions CSV a column at a time with NumPy, rather than a row at a time.
 
-    Args:
-        rows: The number of random transactions to generate
-        file_name: The particular sample data we are generating - either a valid or large sample
-    """
-    # Open the CSV file for writing
-    with Path(file_name).open(mode="w", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=HEADERS)
-        writer.writeheader()
-
-        # Generate dummy data in batches for massive performance improvement
-        batch_size = 10000
-        for batch_start in range(0, rows, batch_size):
-            batch_data = []
-            current_batch_size = min(batch_size, rows - batch_start)
-            
-            for _ in range(current_batch_size):
-                batch_data.append({
-                    "transaction_id": random.choice(UUID_POOL),
-                    "user_id": fake.random_int(min=1, max=1000),
-                    "product_id": fake.random_int(min=1, max=500),
-                    "timestamp": random.choice(TIMESTAMP_POOL),
-                    "transaction_amount": round(random.uniform(5.0, 500.0), 2),
-                })
-            
-            writer.writerows(batch_data)
-
-
-def _generate_invalid_sample(rows: int, file_name: str):
-    """
-    Generates a sample with some invalid data
+    Every batch draws from its own generator seeded by (seed, shard, batch), so the output
+    only depends on the options given, never on how many workers produced it.
 
     Args:
-        rows: The number of random transactions to generate
-        file_name: The path of the invalid sample to be written to
+        output: The file to write. With several shards, each is written beside it as {stem}-{shard}.csv
+        rows: Total number of transactions, split evenly across the shards
+        users: Number of distinct user IDs
+        products: Number of distinct product IDs
+        start: First day of the transactions (YYYY-MM-DD)
+        days: Number of days the transactions are spread over
+        skew: Zipf exponent of how transactions are spread across users, 0 spreads them evenly
+        corruption_rate: Fraction of rows given an invalid timestamp or amount
+        seed: Seed for every random draw
+        shards: Number of files to split the transactions across
+        workers: Processes generating batches in parallel, 1 generates in this process
+
+    Returns:
+        list[Path]: The files written
     """
-    # Open the CSV file for writing
-    with Path(file_name).open(mode="w", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=HEADERS)
-        writer.writeheader()
-
-        # Generate dummy data in batches
-        batch_size = 10000
-        corruption_letters = "abcdefghijklmnopqrstuvwxyz"
-        
-        for batch_start in range(0, rows, batch_size):
-            batch_data = []
-            current_batch_size = min(batch_size, rows - batch_start)
-            
-            for i in range(current_batch_size):
-                global_i = batch_start + i
-
-                row = {
-                    "transaction_id": random.choice(UUID_POOL),
-                    "user_id": fake.random_int(min=1, max=1000),
-                    "product_id": fake.random_int(min=1, max=500),
-                    "timestamp": random.choice(TIMESTAMP_POOL),
-                    "transaction_amount": round(random.uniform(5.0, 500.0), 2),
-                }
-
-                # On every 100,000th row we add some invalid data
-                if global_i % 100_000 == 0:
-                    ts_str = row["timestamp"].strftime("%Y-%m-%d %H:%M:%S") # Convert to string first as we cannot modify a datetime object
-                    row["timestamp"] = ts_str[:3] + random.choice(corruption_letters) + ts_str[3:] # At position 3 we will insert some random letter in the timestamp
-
-                    amount = str(row["transaction_amount"])
-                    row["transaction_amount"] = amount[:5] + random.choice("abcdefgh") + amount[5:] # At position 5 we will insert some random letter in the transaction amount
-                
-                batch_data.append(row)
-            
-            writer.writerows(batch_data)
-
+    output = Path(output)
+    paths = [output] if shards == 1 else [output.with_name(f"{output.stem}-{shard:05d}{output.suffix}") for shard in range(shards)]
+    jobs = [
+        (seed, shard, batch, batch_rows, users, products, start, days, skew, corruption_rate)
+        for shard in range(shards)
+        for batch, batch_rows in enumerate(_batch_sizes(rows * (shard + 1) // shards - rows * shard // shards))
+    ]
+
+    files = [path.open("wb") for path in paths]
+    try:
+        for file in files:
+            file.write((",".join(HEADERS) + "\n").encode())
+
+        if workers > 1:
+            with ProcessPoolExecutor(workers) as executor:
+                # Batches come back in order, so each shard is written exactly as a single process would write it
+                for job, content in zip(jobs, executor.map(_generate_batch, *zip(*jobs))):
+                    files[job[1]].write(content)
+        else:
+            for job in jobs:
+                files[job[1]].write(_generate_batch(*job))
+    finally:
+        for file in files:
+            file.close()
+    return paths
+
+def _batch_sizes(rows: int) -> Iterator[int]:
+    for batch_start in range(0, rows, BATCH_ROWS):
+        yield min(BATCH_ROWS, rows - batch_start)
+
+def _generate_batch(
+        seed: int,
+        shard: int,
+        batch: int,
+        rows: int,
+        users: int,
+        products: int,
+        start: str,
+        days: int,
+        skew: float,
+        corruption_rate: float
+    ) -> bytes:
+    """Build one batch of CSV rows. Runs in a worker process, so it is kept at module level"""
+    rng = np.random.default_rng([seed, shard, batch])
+
+    user_ids = _draw_users(rng, rows, users, skew)
+    product_ids = rng.integers(1, products + 1, rows)
+    seconds = np.datetime64(start, "s") + rng.integers(0, days * 24 * 60 * 60, rows).astype("timedelta64[s]")
+    cents = rng.integers(round(MIN_AMOUNT * 100), round(MAX_AMOUNT * 100) + 1, rows)
+
+    # Every field is rendered into a fixed width byte matrix, padded with zero bytes that are dropped at the end
+    timestamps = _timestamps(seconds)
+    amounts = _amounts(cents)
+    if corruption_rate > 0:
+        _corrupt(rng, timestamps, amounts, round(rows * corruption_rate))
+
+    matrix = np.hstack([
+        _uuids(rng, rows), _constant(rows, ","),
+        _digits(user_ids, len(str(users))), _constant(rows, ","),
+        _digits(product_ids, len(str(products))), _constant(rows, ","),
+        timestamps, _constant(rows, ","),
+        amounts, _constant(rows, "\n")
+    ]).ravel()
+    return matrix[matrix != 0].tobytes()
+
+def _constant(rows: int, character: str) -> np.ndarray:
+    """A one byte column holding the same character on every row"""
+    return np.full((rows, 1), ord(character), dtype=np.uint8)
+
+def _draw_users(rng: np.random.Generator, rows: int, users: int, skew: float) -> np.ndarray:
+    """User IDs from 1 to users, Zipf distributed so user 1 is the busiest when skewed"""
+    if skew <= 0:
+        return rng.integers(1, users + 1, rows)
+    weights = 1.0 / np.arange(1, users + 1, dtype=np.float64) ** skew
+    cumulative = np.cumsum(weights)
+    return np.searchsorted(cumulative, rng.random(rows) * cumulative[-1], side="right") + 1
+
+def _digits(values: np.ndarray, width: int, zero_pad: bool = False) -> np.ndarray:
+    """ASCII digits of non-negative integers, right aligned in width bytes"""
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    matrix = ((values[:, None] // powers) % 10 + ord("0")).astype(np.uint8)
+    if not zero_pad:
+        leading = values[:, None] < powers
+        leading[:, -1] = False # Zero itself is still written
+        matrix[leading] = 0
+    return matrix
+
+def _uuids(rng: np.random.Generator, rows: int) -> np.ndarray:
+    """Random version 4 UUIDs, as 36 byte rows"""
+    raw = rng.integers(0, 256, (rows, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40 # Version
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80 # Variant
+    nibbles = np.empty((rows, 32), dtype=np.uint8)
+    nibbles[:, 0::2] = raw >> 4
+    nibbles[:, 1::2] = raw & 0x0F
+    hex_text = HEX_DIGITS[nibbles]
+
+    dash = _constant(rows, "-")
+    return np.hstack([hex_text[:, :8], dash, hex_text[:, 8:12], dash, hex_text[:, 12:16], dash, hex_text[:, 16:20], dash, hex_text[:, 20:]])
+
+def _timestamps(seconds: np.ndarray) -> np.ndarray:
+    """YYYY-MM-DD HH:MM:SS timestamps, as 19 byte rows"""
+    days = seconds.astype("datetime64[D]")
+    months = seconds.astype("datetime64[M]")
+    years = seconds.astype("datetime64[Y]")
+    clock = (seconds - days).astype(np.int64)
+
+    rows = len(seconds)
+    return np.hstack([
+        _digits(years.astype(np.int64) + 1970, 4, zero_pad=True), _constant(rows, "-"),
+        _digits(months.astype(np.int64) % 12 + 1, 2, zero_pad=True), _constant(rows, "-"),
+        _digits((days - months.astype("datetime64[D]")).astype(np.int64) + 1, 2, zero_pad=True), _constant(rows, " "),
+        _digits(clock // 3600, 2, zero_pad=True), _constant(rows, ":"),
+        _digits(clock // 60 % 60, 2, zero_pad=True), _constant(rows, ":"),
+        _digits(clock % 60, 2, zero_pad=True)
+    ])
+
+def _amounts(cents: np.ndarray) -> np.ndarray:
+    """Amounts with exactly two decimal places"""
+    whole = cents // 100
+    return np.hstack([_digits(whole, len(str(int(whole.max(initial=0))))), _constant(len(cents), "."), _digits(cents % 100, 2, zero_pad=True)])
+
+def _corrupt(rng: np.random.Generator, timestamps: np.ndarray, amounts: np.ndarray, count: int) -> None:
+    """Put a letter into the timestamp or the amount of count distinct rows, chosen at random"""
+    if count == 0:
+        return
+    rows = rng.choice(len(timestamps), size=min(count, len(timestamps)), replace=False)
+    letters = CORRUPTION_LETTERS[rng.integers(0, len(CORRUPTION_LETTERS), len(rows))]
+    in_timestamp = rng.random(len(rows)) < 0.5
+    timestamps[rows[in_timestamp], 3] = letters[in_timestamp] # e.g. 202u-12-15 00:35:47
+    amounts[rows[~in_timestamp], -1] = letters[~in_timestamp] # e.g. 253.1d
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Generate sample transaction data. Without an output, the test samples are generated")
+    parser.add_argument("output", nargs="?", type=Path, help="CSV file to write")
+    parser.add_argument("--rows", type=int, default=TRANSACTIONS, help="Number of transactions")
+    parser.add_argument("--users", type=int, default=1000, help="Number of distinct user IDs")
+    parser.add_argument("--products", type=int, default=500, help="Number of distinct product IDs")
+    parser.add_argument("--start", default=START_DATE, help="First day of the transactions (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=DAYS, help="Number of days the transactions span")
+    parser.add_argument("--skew", type=float, default=0.0, help="Zipf exponent for transactions per user, 0 for uniform")
+    parser.add_argument("--corruption-rate", type=float, default=0.0, help="Fraction of rows with an invalid timestamp or amount")
+    parser.add_argument("--seed", type=int, default=SEED, help="Random seed, the same seed always produces the same data")
+    parser.add_argument("--shards", type=int, default=1, help="Number of files to split the transactions across")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes generating in parallel")
+    args = parser.parse_args(arguments)
+
+    if args.output is None:
+        generate_sample()
+        return
+
+    for path in generate(
+            args.output, args.rows, args.users, args.products, args.start, args.days,
+            args.skew, args.corruption_rate, args.seed, args.shards, args.workers
+        ):
+        print(path)
 
 if __name__ == "__main__":
-    generate_sample() # Execute the script with the main guard if needed directly for demonstrative purposes
\ No newline at end of file
+    main() # Execute the script with the main guard if needed directly for demonstrative purposes
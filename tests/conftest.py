@@ -13,7 +13,7 @@ from scripts.sample_generation import generate_sample
 @pytest.fixture(scope="session")
 def sample_data():
     """Generate sample data once per test session"""
-    print("Starting sample data generation... (this may take up to a minute!)")
+    print("Starting sample data generation... (this takes a few seconds on the first run)")
     result = generate_sample()
     print("Sample data generation complete!")
     return result
@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+import pytest
+from datetime import date
+
+from app.services.aggregates import DailyRollup, ProductTotals, QuantileRollup, UserIndex, UserTotals
+from app.services.dataset import parse_transactions_csv
+from scripts.sample_generation import generate
+
+QUANTILES = (0.0, 0.01, 0.25, 0.5, 0.9, 0.99, 1.0)
+
+@pytest.fixture
+def transactions() -> pd.DataFrame:
+    """A handful of transactions across two users"""
+    return pd.DataFrame({
+        "user_id": ["1", "2", "1", "1"],
+        "timestamp": pd.to_datetime([
+            "2025-01-01 10:00:00", "2025-01-01 11:00:00", "2025-01-02 09:00:00", "2025-01-05 18:30:00"
+        ]),
+        "transaction_amount": [10.0, 5.5, 30.0, 20.0]
+    })
+
+def test_user_index_aggregates(transactions):
+    """Aggregates match those computed directly from the rows"""
+
+    index = UserIndex.from_frame(transactions)
+
+    aggregate = index.get("1")
+    assert aggregate.count == 3
+    assert aggregate.total == 60.0
+    assert aggregate.minimum == 10.0
+    assert aggregate.maximum == 30.0
+    assert index.get("3") is None
+
+def test_user_index_persistence(transactions, tmp_path):
+    """A persisted index is only reused for the file it was built from"""
+
+    path = tmp_path / "latest.user_index.npz"
+    UserIndex.from_frame(transactions).save(path, (123, 456))
+
+    loaded = UserIndex.load(path, (123, 456))
+    assert loaded is not None
+    assert loaded.get("2") == UserIndex.from_frame(transactions).get("2")
+
+    assert UserIndex.load(path, (123, 789)) is None
+    assert UserIndex.load(tmp_path / "missing.npz", (123, 456)) is None
+
+@pytest.mark.parametrize("start, end", [
+    (None, None),
+    (date(2025, 1, 2), None),
+    (None, date(2025, 1, 5)),
+    (date(2025, 1, 1), date(2025, 1, 2)),
+])
+def test_daily_rollup_matches_rows(transactions, start, end):
+    """Combining daily records gives the same result as filtering the raw rows"""
+
+    rollup = DailyRollup.from_frame(transactions)
+
+    rows = transactions[transactions["user_id"] == "1"]
+    if start is not None:
+        rows = rows[rows["timestamp"] >= pd.Timestamp(start)]
+    if end is not None:
+        rows = rows[rows["timestamp"] < pd.Timestamp(end)]
+
+    aggregate = rollup.get("1", start, end)
+    assert aggregate.count == len(rows)
+    assert aggregate.total == rows["transaction_amount"].sum()
+    assert aggregate.minimum == rows["transaction_amount"].min()
+    assert aggregate.maximum == rows["transaction_amount"].max()
+
+def test_daily_rollup_empty_window(transactions):
+    """A window with no transactions is distinguished from an unknown user"""
+
+    rollup = DailyRollup.from_frame(transactions)
+
+    assert rollup.get("1", date(2025, 1, 3), date(2025, 1, 5)) is None
+    assert rollup.has_user("1")
+    assert not rollup.has_user("3")
+
+def test_daily_rollup_window(transactions):
+    """Windowing every user at once agrees with looking each user up on their own"""
+
+    rollup = DailyRollup.from_frame(transactions)
+    window = rollup.window(date(2025, 1, 2), None)
+
+    assert window.get("1") == rollup.get("1", date(2025, 1, 2), None)
+    assert window.get("2") is None
+
+def test_merge_matches_combined_rows(transactions):
+    """Merging the aggregates of two sets of rows gives the aggregates of all of them together"""
+
+    appended = pd.DataFrame({
+        "user_id": ["1", "3"],
+        "timestamp": pd.to_datetime(["2025-01-02 20:00:00", "2025-01-03 08:00:00"]),
+        "transaction_amount": [50.0, 7.0]
+    })
+    combined = pd.concat([transactions, appended], ignore_index=True)
+
+    index = UserIndex.from_frame(transactions).merge(UserIndex.from_frame(appended))
+    expected_index = UserIndex.from_frame(combined)
+    for user_id in ["1", "2", "3"]:
+        assert index.get(user_id) == expected_index.get(user_id)
+
+    rollup = DailyRollup.from_frame(transactions).merge(DailyRollup.from_frame(appended))
+    expected_rollup = DailyRollup.from_frame(combined)
+    for user_id in ["1", "2", "3"]:
+        assert rollup.get(user_id) == expected_rollup.get(user_id)
+        assert rollup.get(user_id, date(2025, 1, 2), date(2025, 1, 3)) == expected_rollup.get(user_id, date(2025, 1, 2), date(2025, 1, 3))
+
+
+@pytest.fixture(scope="module")
+def generated(tmp_path_factory) -> pd.DataFrame:
+    """A generated dataset with enough rows per user for quantiles to be meaningful"""
+    [path] = generate(tmp_path_factory.mktemp("quantiles") / "latest.csv", 50_000, users=20, skew=0.8)
+    return parse_transactions_csv(path)
+
+@pytest.mark.parametrize("accuracy", [0.01, 0.05])
+@pytest.mark.parametrize("start, end", [
+    (None, None),
+    (date(2025, 3, 1), date(2025, 9, 1)),
+    (date(2025, 7, 14), date(2025, 7, 15)),
+])
+def test_quantiles_within_accuracy(generated, accuracy, start, end):
+    """Every estimate is within the relative accuracy of the exact quantile NumPy finds"""
+
+    sketches = QuantileRollup.from_frame(generated, accuracy)
+
+    for user_id in map(str, range(1, 21)):
+        rows = generated[generated["user_id"] == user_id]
+        if start is not None:
+            rows = rows[(rows["timestamp"] >= pd.Timestamp(start)) & (rows["timestamp"] < pd.Timestamp(end))]
+        amounts = rows["transaction_amount"].to_numpy()
+
+        estimates = sketches.quantiles(user_id, QUANTILES, start, end)
+        if len(amounts) == 0:
+            assert estimates is None
+            continue
+        exact = np.quantile(amounts, QUANTILES, method="lower")
+        assert np.all(np.abs(np.array(estimates) - exact) <= accuracy * np.abs(exact) * (1 + 1e-9))
+
+def test_quantiles_of_signed_amounts():
+    """Negative amounts and zero keep their order and their accuracy"""
+
+    amounts = [-250.0, -3.5, 0.0, 0.0, 1e-12, 7.25, 99.99, 1200.0]
+    frame = pd.DataFrame({
+        "user_id": ["1"] * len(amounts),
+        "timestamp": pd.to_datetime(["2025-01-01 10:00:00"] * len(amounts)),
+        "transaction_amount": amounts
+    })
+
+    estimates = QuantileRollup.from_frame(frame).quantiles("1", QUANTILES)
+    for estimate, exact in zip(estimates, np.quantile(amounts, QUANTILES, method="lower")):
+        assert estimate == pytest.approx(exact, rel=0.01, abs=1e-9)
+
+def test_quantile_merge_matches_combined_rows(generated):
+    """Merging sketches loses nothing, so it matches sketching every row together"""
+
+    half = len(generated) // 2
+    merged = QuantileRollup.from_frame(generated.iloc[:half]).merge(QuantileRollup.from_frame(generated.iloc[half:]))
+    expected = QuantileRollup.from_frame(generated)
+
+    assert np.array_equal(merged.counts, expected.counts) and np.array_equal(merged.buckets, expected.buckets)
+    assert merged.quantiles("3", QUANTILES, date(2025, 2, 1)) == expected.quantiles("3", QUANTILES, date(2025, 2, 1))
+    assert merged.quantiles("unknown", QUANTILES) is None
+
+    with pytest.raises(ValueError):
+        merged.merge(QuantileRollup.from_frame(generated, 0.05))
+
+def test_quantile_persistence(transactions, tmp_path):
+    """Persisted sketches are only reused for the same file at the same accuracy"""
+
+    path = tmp_path / "latest.quantile_rollup.npz"
+    QuantileRollup.from_frame(transactions, 0.01).save(path, (123, 456))
+
+    loaded = QuantileRollup.load(path, (123, 456), 0.01)
+    assert loaded is not None
+    assert loaded.quantiles("1", (0.5,)) == QuantileRollup.from_frame(transactions, 0.01).quantiles("1", (0.5,))
+
+    assert QuantileRollup.load(path, (123, 456), 0.05) is None
+    assert QuantileRollup.load(path, (123, 789), 0.01) is None
+
+@pytest.mark.parametrize("totals_class", [UserTotals, ProductTotals])
+@pytest.mark.parametrize("by", ["spend", "count"])
+def test_top_matches_group_by(generated, totals_class, by):
+    """Ranking from daily totals agrees with grouping the raw rows of the window"""
+
+    rows = generated[(generated["timestamp"] >= "2025-03-01") & (generated["timestamp"] < "2025-06-01")]
+    grouped = rows.groupby(totals_class.column, observed=True)["transaction_amount"].agg(["count", "sum"])
+    grouped["key"] = grouped.index.astype(str)
+    expected = grouped.sort_values(["sum" if by == "spend" else "count", "key"], ascending=[False, True]).head(5)
+
+    ranked, entries = totals_class.from_frame(generated).top(by, 5, date(2025, 3, 1), date(2025, 6, 1))
+
+    assert entries == len(grouped)
+    assert [key for key, _, _ in ranked] == expected["key"].tolist()
+    assert [count for _, count, _ in ranked] == expected["count"].tolist()
+    assert [total for _, _, total in ranked] == pytest.approx(expected["sum"].tolist())
+
+def test_top_breaks_ties_by_key(transactions):
+    """Equal values are ranked in key order, and keys without transactions in the window are left out"""
+
+    totals = UserTotals.from_frame(transactions)
+
+    assert totals.top("count", 10, date(2025, 1, 1), date(2025, 1, 2)) == ([("1", 1, 10.0), ("2", 1, 5.5)], 2)
+    assert totals.top("spend", 1) == ([("1", 3, 60.0)], 2)
+    assert totals.top("spend", 5, date(2025, 2, 1)) == ([], 0)
+
+def test_totals_merge_matches_combined_rows(generated):
+    """Merged daily totals rank the same as totals built from every row"""
+
+    half = len(generated) // 2
+    merged = ProductTotals.from_frame(generated.iloc[:half]).merge(ProductTotals.from_frame(generated.iloc[half:]))
+    expected = ProductTotals.from_frame(generated)
+
+    ranked, entries = merged.top("count", 20, date(2025, 2, 1))
+    expected_ranked, expected_entries = expected.top("count", 20, date(2025, 2, 1))
+    assert entries == expected_entries
+    assert [entry[:2] for entry in ranked] == [entry[:2] for entry in expected_ranked]
+
+@pytest.mark.parametrize("bucket, rule", [("day", "D"), ("week", "W-MON"), ("month", "MS")])
+def test_series_matches_resample(generated, bucket, rule):
+    """Buckets combined from daily aggregates match resampling the user's raw rows"""
+
+    series = DailyRollup.from_frame(generated).series("4", bucket, date(2025, 2, 10), date(2025, 11, 20))
+
+    rows = generated[(generated["user_id"] == "4") & (generated["timestamp"] >= "2025-02-10") & (generated["timestamp"] < "2025-11-20")]
+    expected = rows.set_index("timestamp")["transaction_amount"].resample(rule, label="left", closed="left").agg(["count", "sum", "min", "max"])
+    expected = expected[expected["count"] > 0]
+
+    assert series.starts.astype(str).tolist() == expected.index.strftime("%Y-%m-%d").tolist()
+    assert series.counts.tolist() == expected["count"].tolist()
+    assert series.totals == pytest.approx(expected["sum"].to_numpy())
+    assert series.minimums.tolist() == expected["min"].tolist()
+    assert series.maximums.tolist() == expected["max"].tolist()
+
+def test_series_edges(transactions):
+    """Unknown users give None, an empty window gives an empty series"""
+
+    rollup = DailyRollup.from_frame(transactions)
+
+    assert rollup.series("3", "day") is None
+    assert len(rollup.series("1", "month", date(2025, 2, 1)).starts) == 0
+    with pytest.raises(ValueError):
+        rollup.series("1", "year")
@@ -0,0 +1,248 @@
+import asyncio
+import os
+import numpy as np
+import pytest
+
+from app.services import dataset as dataset_module
+from app.services.dataset import DatasetCache
+
+CSV_HEADER = "transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+
+@pytest.fixture
+def dataset_file(tmp_path):
+    """A small transactions file written outside of the uploads directory"""
+    path = tmp_path / "latest.csv"
+    path.write_text(
+        CSV_HEADER
+        + "t1,1,10,2025-01-02 10:00:00,10.00\n"
+        + "t2,1,11,2025-01-01 09:00:00,20.00\n"
+        + "t3,2,10,2025-01-03 12:00:00,30.00\n"
+    )
+    return path
+
+def test_dataset_cached_between_lookups(dataset_file):
+    """The same version of the file is only parsed once"""
+
+    cache = DatasetCache(dataset_file)
+    first = asyncio.run(cache.current().frame())
+    second = asyncio.run(cache.current().frame())
+
+    assert first is second
+    assert list(first["transaction_amount"]) == [20.0, 10.0, 30.0] # Sorted by timestamp
+
+def test_dataset_invalidated_by_file_change(dataset_file):
+    """Changing the file out-of-band makes the next lookup load the new contents"""
+
+    cache = DatasetCache(dataset_file)
+    first = asyncio.run(cache.current().frame())
+
+    dataset_file.write_text(CSV_HEADER + "t4,3,12,2025-02-01 08:00:00,40.00\n")
+    stat = os.stat(dataset_file)
+    os.utime(dataset_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000)) # Guard against coarse mtime resolution
+
+    second = asyncio.run(cache.current().frame())
+    assert second is not first
+    assert list(second["transaction_amount"]) == [40.0]
+
+def test_dataset_refresh_bumps_version(dataset_file):
+    """A refresh always produces a new version, even if the file looks unchanged"""
+
+    cache = DatasetCache(dataset_file)
+    before = cache.current().version
+    after = asyncio.run(cache.refresh()).version
+
+    assert after != before
+    assert after.generation == before.generation + 1
+
+def test_dataset_concurrent_loads_shared(dataset_file):
+    """Concurrent requests for a stale version share a single load"""
+
+    cache = DatasetCache(dataset_file)
+    dataset = cache.current()
+    calls = 0
+    original = dataset._read_frame
+
+    async def counting_read():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05) # Give the other callers time to queue up behind this load
+        return await original()
+
+    dataset._read_frame = counting_read
+
+    async def load_many():
+        return await asyncio.gather(*(dataset.frame() for _ in range(5)))
+
+    frames = asyncio.run(load_many())
+    assert calls == 1
+    assert all(frame is frames[0] for frame in frames)
+
+def test_user_index_survives_restart(dataset_file):
+    """A new process reuses the persisted user index without parsing the file"""
+
+    asyncio.run(DatasetCache(dataset_file).refresh())
+
+    restarted = DatasetCache(dataset_file).current()
+
+    async def fail_read():
+        raise AssertionError("The transactions file should not be parsed")
+
+    restarted._read_frame = fail_read
+    index = asyncio.run(restarted.user_index())
+    assert index.get("1").count == 2
+
+def test_frame_survives_restart(dataset_file, monkeypatch):
+    """A new process maps the columnar snapshot instead of parsing the CSV again"""
+
+    original = asyncio.run(DatasetCache(dataset_file).current().frame())
+
+    restarted = DatasetCache(dataset_file).current()
+    monkeypatch.setattr(dataset_module, "convert_to_snapshot", lambda *args: pytest.fail("The transactions file should not be parsed"))
+
+    frame = asyncio.run(restarted.frame())
+    assert list(frame["transaction_amount"]) == list(original["transaction_amount"])
+
+def test_shared_dataset_switches_on_published_version(dataset_file):
+    """Other processes keep serving the published version until the uploading process publishes a new one"""
+
+    uploader = DatasetCache(dataset_file, shared=True)
+    worker = DatasetCache(dataset_file, shared=True)
+    first = asyncio.run(uploader.refresh()).version
+    assert worker.current().version == first
+
+    dataset_file.write_text(CSV_HEADER + "t4,3,12,2025-02-01 08:00:00,40.00\n")
+    stat = os.stat(dataset_file)
+    os.utime(dataset_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert worker.current().version == first # Not published yet
+
+    second = asyncio.run(uploader.refresh()).version
+    assert second.generation == first.generation + 1
+    assert worker.current().version == second
+    assert list(asyncio.run(worker.current().frame())["transaction_amount"]) == [40.0]
+
+def test_shared_dataset_replaced_before_loading(dataset_file):
+    """A dataset whose file was replaced before it loaded writes nothing under its own, older version"""
+
+    uploader = DatasetCache(dataset_file, shared=True)
+    asyncio.run(uploader.refresh())
+    stale = DatasetCache(dataset_file, shared=True).current()
+    loading = DatasetCache(dataset_file, shared=True).current()
+    asyncio.run(loading.frame()) # Mapped before the replacement, the aggregates are still to come
+
+    dataset_file.write_text(CSV_HEADER + "t4,3,12,2025-02-01 08:00:00,40.00\n")
+    stat = os.stat(dataset_file)
+    os.utime(dataset_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    replaced = asyncio.run(uploader.refresh())
+
+    with pytest.raises(dataset_module.StaleDatasetError):
+        asyncio.run(stale.frame())
+    assert not dataset_module.snapshot_path(dataset_file, stale.source).exists()
+
+    assert asyncio.run(loading.user_index()).get("1").count == 2
+    persisted = dataset_module.UserIndex.load(dataset_module.derived_path(dataset_file, "user_index"), replaced.source)
+    assert persisted is not None and persisted.get("3").count == 1
+
+def test_stale_dataset_retried_on_published_version(dataset_file, monkeypatch):
+    """Work on a dataset whose file was replaced starts again on whichever version is current next"""
+    from app.services import transaction_summary
+
+    cache = DatasetCache(dataset_file, shared=True)
+    asyncio.run(cache.refresh())
+    datasets = iter([dataset_module.Dataset(dataset_file, dataset_module.DatasetVersion(0, 1, 1), True), cache.current()])
+    monkeypatch.setattr(transaction_summary, "current_dataset", lambda: next(datasets))
+    monkeypatch.setattr(transaction_summary, "STALE_RETRY_DELAY", 0)
+
+    frame = asyncio.run(transaction_summary.with_current_dataset(dataset_module.Dataset.frame))
+    assert list(frame["transaction_amount"]) == [20.0, 10.0, 30.0]
+
+def test_shared_dataset_maps_published_structures(dataset_file, monkeypatch):
+    """A process joining a shared dataset maps what was published instead of building its own copy"""
+
+    published = asyncio.run(DatasetCache(dataset_file, shared=True).refresh())
+    asyncio.run(published.user_slices()) # Built on first use, then published for every other process
+
+    worker = DatasetCache(dataset_file, shared=True).current()
+    monkeypatch.setattr(dataset_module.UserSlices, "from_frame", lambda *args: pytest.fail("The slices should be mapped"))
+
+    slices = asyncio.run(worker.user_slices())
+    assert isinstance(slices.timestamps, np.memmap)
+    assert isinstance(slices.rows, np.memmap)
+    first, last = slices.locate("1")
+    assert last - first == 2
+
+def test_append_only_aggregates_new_rows(dataset_file, tmp_path, monkeypatch):
+    """An append reads and aggregates only its own rows, building on what is already loaded"""
+
+    cache = DatasetCache(dataset_file)
+    before = asyncio.run(cache.refresh())
+
+    aggregated = []
+    original = dataset_module.UserIndex.from_frame
+    monkeypatch.setattr(dataset_module.UserIndex, "from_frame", lambda df: aggregated.append(len(df)) or original(df))
+
+    segment = tmp_path / "append.csv"
+    segment.write_text(CSV_HEADER + "t4,1,12,2025-01-01 12:00:00,40.00\n" + "t5,3,12,2025-01-04 08:00:00,5.00\n")
+    after = asyncio.run(cache.append(segment))
+
+    assert aggregated == [2]
+    assert after.version.segments == 1 and after.version.tag != before.version.tag
+    assert asyncio.run(after.user_index()).get("1") == (3, 70.0, 10.0, 40.0)
+    assert list(asyncio.run(after.frame())["transaction_amount"]) == [20.0, 40.0, 10.0, 30.0, 5.0]
+
+    # A restart rebuilds the same view from the file and its segments
+    assert asyncio.run(DatasetCache(dataset_file).current().user_index()).get("1") == (3, 70.0, 10.0, 40.0)
+
+def test_append_publishes_current_dataset(dataset_file, tmp_path):
+    """Writing a segment's snapshot never makes the dataset an append just published look stale"""
+
+    cache = DatasetCache(dataset_file)
+    asyncio.run(cache.refresh())
+    segment = tmp_path / "append.csv"
+    segment.write_text(CSV_HEADER + "t4,1,12,2025-01-01 12:00:00,40.00\n")
+    appended = asyncio.run(cache.append(segment))
+
+    assert list(cache.segments_dir.glob("*.columns")) # The snapshot sits beside the segment
+    assert cache.current() is appended
+    assert cache.current_version() == appended.version
+
+def test_compaction_survives_reload_of_live_dataset(dataset_file, tmp_path, monkeypatch):
+    """A cold load of the segmented dataset while compacting never removes either snapshot"""
+
+    cache = DatasetCache(dataset_file)
+    asyncio.run(cache.refresh())
+    segment = tmp_path / "append.csv"
+    segment.write_text(CSV_HEADER + "t4,1,12,2025-01-01 12:00:00,40.00\n")
+    asyncio.run(cache.append(segment))
+
+    original_warm = dataset_module.Dataset.warm
+    async def warm_after_reload(dataset):
+        if dataset.version.generation == 0: # The compacted dataset, prepared before the swap
+            await DatasetCache(dataset_file).current().frame() # Another process loading the live dataset cold
+        await original_warm(dataset)
+    monkeypatch.setattr(dataset_module.Dataset, "warm", warm_after_reload)
+
+    compacted = asyncio.run(cache.compact())
+    assert len(asyncio.run(compacted.frame())) == 4
+    assert len(asyncio.run(DatasetCache(dataset_file).current().frame())) == 4
+    assert len(list(dataset_file.parent.glob("latest.*.columns"))) == 1 # The replaced file's snapshot is removed after the swap
+
+def test_compaction_folds_segments_into_file(dataset_file, tmp_path):
+    """Compacting leaves a single file holding every row, and the same answers as before"""
+
+    cache = DatasetCache(dataset_file)
+    asyncio.run(cache.refresh())
+    for i, line in enumerate(["t4,1,12,2025-01-01 12:00:00,40.00\n", "t5,3,12,2025-01-04 08:00:00,5.00\n"]):
+        segment = tmp_path / f"append-{i}.csv"
+        # Columns in a different order are matched up with the file when it is compacted
+        segment.write_text(CSV_HEADER + line if i == 0 else "user_id,transaction_id,product_id,timestamp,transaction_amount\n3,t5,12,2025-01-04 08:00:00,5.00\n")
+        asyncio.run(cache.append(segment))
+
+    segmented = asyncio.run(cache.current().frame())
+    compacted = asyncio.run(cache.compact())
+
+    assert compacted.segments == () and compacted.version.segments == 0
+    assert not list(cache.segments_dir.glob("*.csv"))
+    assert dataset_file.read_text().count("\n") == 6
+    assert list(asyncio.run(compacted.frame())["transaction_amount"]) == list(segmented["transaction_amount"])
+    assert asyncio.run(compacted.user_index()).get("1") == (3, 70.0, 10.0, 40.0)
+    assert asyncio.run(cache.compact()) is None # Nothing left to compact
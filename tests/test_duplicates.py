@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.duplicates import IdHashes, hash_ids
+from app.services.transaction_validator import CsvStreamValidator
+
+CSV_HEADER = "transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+
+def test_duplicates_match_pandas():
+    """Repeats are found across chunks validated in parallel, keeping the first line of each ID"""
+
+    rng = np.random.default_rng(7)
+    ids = rng.integers(0, 3000, 5000).astype(str)
+    content = CSV_HEADER + "".join(f"t{i},1,p,2025-01-01 10:00:00,1.00\n" for i in ids)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        validator = CsvStreamValidator(chunk_size=2000, executor=executor, track_ids=True)
+        validator.feed(content.encode("utf-8"))
+        validator.close()
+
+    expected = np.flatnonzero(pd.Series(ids).duplicated(keep="first").to_numpy())
+    assert np.array_equal(validator.ids.duplicates(), expected)
+    assert validator.ids.nbytes == 8 * len(ids)
+
+def test_duplicates_by_record():
+    """Positions count records as the parser does, so quoted line breaks and blank lines shift nothing, and missing IDs never match"""
+
+    rows = ['a,1,p,2025-01-01 10:00:00,1.00', '', 'b,"multi\nline",p,2025-01-01 10:00:00,1.00', '  ', ',1,p,2025-01-01 10:00:00,1.00', ',1,p,2025-01-01 10:00:00,1.00', 'a,1,p,2025-01-01 10:00:00,1.00']
+    validator = CsvStreamValidator(track_ids=True)
+    validator.feed((CSV_HEADER + "\n".join(rows) + "\n").encode("utf-8"))
+    validator.close()
+
+    assert validator.rows == 5
+    assert validator.ids.duplicates().tolist() == [4]
+
+def test_no_duplicates():
+    """Unique IDs, or none at all, come back empty"""
+
+    hashes = IdHashes()
+    assert len(hashes.duplicates()) == 0
+    hashes.add(hash_ids(pd.Series(["a", "b", "c"])))
+    hashes.add(hash_ids(pd.Series(["d"])))
+    assert len(hashes.duplicates()) == 0
@@ -0,0 +1,48 @@
+import asyncio
+import math
+import pytest
+
+from app.config import MAX_CONCURRENT_UPLOADS
+from app.services.executor import run_in_process, run_in_thread, upload_slot, UploadsBusyError
+
+def test_upload_slots_limit_concurrency():
+    """Uploads beyond the limit are turned away until a slot is released"""
+
+    slots = [upload_slot() for _ in range(MAX_CONCURRENT_UPLOADS)]
+    for slot in slots:
+        slot.__enter__()
+
+    with pytest.raises(UploadsBusyError):
+        with upload_slot():
+            pass
+
+    slots[0].__exit__(None, None, None)
+    with upload_slot(): # A released slot can be taken again
+        pass
+
+    for slot in slots[1:]:
+        slot.__exit__(None, None, None)
+
+def test_upload_rejected_when_busy(client, get_test_file):
+    """The upload endpoint answers 429 rather than queueing more work"""
+
+    slots = [upload_slot() for _ in range(MAX_CONCURRENT_UPLOADS)]
+    for slot in slots:
+        slot.__enter__()
+    try:
+        with open(get_test_file("valid_sample.csv"), "rb") as f:
+            res = client.post("/upload", files={"file": ("valid.csv", f, "text/csv")})
+    finally:
+        for slot in slots:
+            slot.__exit__(None, None, None)
+
+    assert res.status_code == 429
+    assert "Retry-After" in res.headers
+
+def test_pools_run_work():
+    """Work handed to either pool comes back with its result"""
+
+    async def run_both():
+        return await run_in_thread(math.factorial, 5), await run_in_process(math.factorial, 6)
+
+    assert asyncio.run(run_both()) == (120, 720)
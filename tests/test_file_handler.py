@@ -0,0 +1,45 @@
+import gzip
+
+import pytest
+
+from app.services.file_handler import StreamDecompressor, FileTooLargeError, DecompressionError, upload_encoding
+
+def _decompress(decompressor, data, chunk_size=1000):
+    output = b"".join(
+        piece
+        for start in range(0, len(data), chunk_size)
+        for piece in decompressor.decompress(data[start:start + chunk_size])
+    )
+    decompressor.close()
+    return output
+
+def test_gzip_members_are_joined():
+    """Concatenated gzip members decompress to one stream, however the input is split"""
+    data = gzip.compress(b"a,b\n1,2\n") + gzip.compress(b"3,4\n")
+    assert _decompress(StreamDecompressor("gzip"), data, chunk_size=7) == b"a,b\n1,2\n3,4\n"
+
+def test_decompressed_limit_stops_bombs():
+    """Output is counted as it is produced, so a highly compressible file is stopped early"""
+    data = gzip.compress(b"0" * 50_000_000)
+    decompressor = StreamDecompressor("gzip", max_size=10_000_000)
+    with pytest.raises(FileTooLargeError, match="once decompressed"):
+        _decompress(decompressor, data, chunk_size=len(data))
+    assert decompressor.size <= 11 * 1024 * 1024
+
+def test_truncated_and_corrupt_files():
+    data = gzip.compress(b"a,b\n1,2\n")
+    with pytest.raises(DecompressionError, match="truncated"):
+        _decompress(StreamDecompressor("gzip"), data[:-5])
+    with pytest.raises(DecompressionError, match="could not be decompressed"):
+        _decompress(StreamDecompressor("gzip"), b"not gzip at all")
+
+def test_upload_encoding():
+    """Compression comes from the Content-Encoding header, falling back to the file name"""
+    assert upload_encoding("data.csv") is None
+    assert upload_encoding("data.CSV.GZ") == "gzip"
+    assert upload_encoding("data.csv", "gzip") == "gzip"
+    assert upload_encoding("data.csv.gz", "identity") == "gzip"
+    with pytest.raises(DecompressionError):
+        upload_encoding("data.txt")
+    with pytest.raises(DecompressionError):
+        upload_encoding("data.csv", "br")
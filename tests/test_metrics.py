@@ -0,0 +1,38 @@
+from app.services.metrics import Histogram, Counter, server_timing
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "Test histogram", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, "parse")
+
+    lines = list(histogram.render())
+    assert 'test_seconds_bucket{stage="parse",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="parse",le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{stage="parse",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{stage="parse"} 4' in lines
+
+def test_counter_escapes_labels():
+    counter = Counter("test_total", "Test counter", ("stage",))
+    counter.inc(2, 'say "hi"')
+    counter.inc(3, 'say "hi"')
+    assert 'test_total{stage="say \\"hi\\""} 5' in list(counter.render())
+
+def test_server_timing_format():
+    assert server_timing({"parse": 0.0125}, 0.02) == "parse;dur=12.500, total;dur=20.000"
+
+def test_metrics_endpoint(client):
+    """Requests report their stages in Server-Timing, and the same stages are exposed for scraping"""
+    data = b"transaction_id,user_id,product_id,timestamp,transaction_amount\nt1,metrics-user,1,2025-03-01 10:00:00,12.50\n"
+    res = client.post("/upload", files={"file": ("data.csv", data, "text/csv")})
+    assert "validate;dur=" in res.headers["Server-Timing"]
+
+    res = client.get("/summary/metrics-user")
+    assert "aggregate;dur=" in res.headers["Server-Timing"]
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    assert 'transactions_stage_duration_seconds_count{stage="validate"}' in res.text
+    assert 'transactions_http_request_duration_seconds_count{method="GET",route="/summary/{user_id}",status="200"}' in res.text
+    assert 'transactions_rows_processed_total{stage="validate"}' in res.text
+    assert "transactions_summary_cache_hit_ratio" in res.text
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.range_index import UserSlices
+from app.services.transaction_summary import _filter_by_timeframe
+
+@pytest.fixture
+def transactions() -> pd.DataFrame:
+    """A few thousand random transactions, sorted by timestamp like the loaded dataset"""
+    rng = np.random.default_rng(7)
+    rows = 5000
+    frame = pd.DataFrame({
+        "user_id": rng.integers(1, 20, rows).astype(str),
+        "timestamp": np.datetime64("2025-01-01") + rng.integers(0, 90 * 86400, rows).astype("timedelta64[s]"),
+        "transaction_amount": np.round(rng.uniform(5.0, 500.0, rows), 2)
+    })
+    return frame.sort_values("timestamp", ignore_index=True)
+
+@pytest.mark.parametrize("start, end", [
+    (None, None),
+    ("2025-01-15 12:30:00", None),
+    (None, "2025-02-01 06:00:00"),
+    ("2025-02-10 08:15:00", "2025-02-11 17:45:00"),
+])
+def test_user_slices_match_rows(transactions, start, end):
+    """Binary-searched spans hold exactly the rows found by masking, in timestamp order"""
+
+    slices = UserSlices.from_frame(transactions)
+    start_ts = np.datetime64(start, "ns") if start else None
+    end_ts = np.datetime64(end, "ns") if end else None
+
+    for user_id in ["1", "7", "19"]:
+        rows = transactions[transactions["user_id"] == user_id]
+        if start:
+            rows = rows[rows["timestamp"] >= start]
+        if end:
+            rows = rows[rows["timestamp"] < end]
+
+        first, last = slices.locate(user_id, start_ts, end_ts)
+        assert slices.rows[first:last].tolist() == rows.index.tolist()
+
+def test_user_slices_unknown_or_empty(transactions):
+    """Unknown users and empty ranges locate nothing"""
+
+    slices = UserSlices.from_frame(transactions)
+
+    assert not slices.has_user("unknown") and slices.locate("unknown") == (0, 0)
+    first, last = slices.locate("1", np.datetime64("2030-01-01", "ns"))
+    assert slices.has_user("1") and first == last
+
+def test_user_slices_saved_and_mapped(transactions, tmp_path):
+    """Mapped slices answer exactly as the slices they were saved from"""
+
+    built = UserSlices.from_frame(transactions)
+    built.save(tmp_path / "latest.user_slices.1-1")
+    mapped = UserSlices.load(tmp_path / "latest.user_slices.1-1")
+
+    start, end = np.datetime64("2025-01-15", "ns"), np.datetime64("2025-02-03 12:30", "ns")
+    for user_id in built.user_ids.tolist():
+        first, last = built.locate(user_id, start, end)
+        assert mapped.locate(user_id, start, end) == (first, last)
+        assert mapped.rows[first:last].tolist() == built.rows[first:last].tolist()
+
+    built.save(tmp_path / "latest.user_slices.2-2") # Publishing a new version removes the old one
+    assert UserSlices.load(tmp_path / "latest.user_slices.1-1") is None
+
+def test_filter_by_timeframe(transactions):
+    """Filtering keeps exactly the rows in [date_from, date_to)"""
+
+    filtered = _filter_by_timeframe(transactions, "2025-01-10", "2025-01-20")
+
+    assert filtered["timestamp"].min() >= pd.Timestamp("2025-01-10")
+    assert filtered["timestamp"].max() < pd.Timestamp("2025-01-20")
+    assert len(filtered) == transactions["timestamp"].between("2025-01-10", "2025-01-20", inclusive="left").sum()
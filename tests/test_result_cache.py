@@ -0,0 +1,50 @@
+import time
+
+from app.services.result_cache import ResultCache
+
+def test_result_cache_hits_and_misses():
+    """Stored results are returned and counted"""
+
+    cache = ResultCache(max_entries=10, ttl_seconds=60)
+
+    assert cache.get("v1", "a") == (False, None)
+    cache.put("v1", "a", 1)
+    assert cache.get("v1", "a") == (True, 1)
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+def test_result_cache_evicts_least_recently_used():
+    """The cache never holds more than its limit, dropping the entry used longest ago"""
+
+    cache = ResultCache(max_entries=2, ttl_seconds=60)
+    cache.get("v1", "a")
+    cache.put("v1", "a", 1)
+    cache.put("v1", "b", 2)
+    cache.get("v1", "a") # Make "b" the least recently used
+    cache.put("v1", "c", 3)
+
+    assert cache.get("v1", "a") == (True, 1)
+    assert cache.get("v1", "b") == (False, None)
+    assert cache.get("v1", "c") == (True, 3)
+
+def test_result_cache_expires_entries():
+    """Entries older than the time-to-live are not served"""
+
+    cache = ResultCache(max_entries=10, ttl_seconds=0.01)
+    cache.get("v1", "a")
+    cache.put("v1", "a", 1)
+    time.sleep(0.02)
+
+    assert cache.get("v1", "a") == (False, None)
+
+def test_result_cache_new_version_invalidates():
+    """A lookup for a new dataset version drops every older result, and late results for the old version are ignored"""
+
+    cache = ResultCache(max_entries=10, ttl_seconds=60)
+    cache.get("v1", "a")
+    cache.put("v1", "a", 1)
+
+    assert cache.get("v2", "a") == (False, None)
+    cache.put("v1", "a", 1)
+    assert cache.get("v2", "a") == (False, None)
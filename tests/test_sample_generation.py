@@ -0,0 +1,42 @@
+import pandas as pd
+
+from scripts import sample_generation
+from scripts.sample_generation import generate, HEADERS
+
+def test_output_is_deterministic(tmp_path, monkeypatch):
+    """The same options give the same bytes, however many workers share the work"""
+    monkeypatch.setattr(sample_generation, "BATCH_ROWS", 1000)
+    [single] = generate(tmp_path / "single.csv", 5000, seed=7)
+    [parallel] = generate(tmp_path / "parallel.csv", 5000, seed=7, workers=2)
+    assert single.read_bytes() == parallel.read_bytes()
+
+    [other] = generate(tmp_path / "other.csv", 5000, seed=8)
+    assert other.read_bytes() != single.read_bytes()
+
+def test_generated_rows_follow_the_schema(tmp_path):
+    [path] = generate(tmp_path / "sample.csv", 10_000, users=50, start="2024-02-28", days=3)
+    frame = pd.read_csv(path, dtype=str)
+
+    assert list(frame.columns) == HEADERS
+    assert len(frame) == 10_000 and frame["transaction_id"].is_unique
+    timestamps = pd.to_datetime(frame["timestamp"], format="%Y-%m-%d %H:%M:%S")
+    assert timestamps.min() >= pd.Timestamp("2024-02-28") and timestamps.max() < pd.Timestamp("2024-03-02")
+    assert timestamps.dt.day.isin([28, 29, 1]).all() # Leap day included
+    amounts = frame["transaction_amount"].astype(float)
+    assert amounts.between(5, 500).all()
+    assert frame["transaction_amount"].str.fullmatch(r"\d+\.\d\d").all()
+    assert frame["user_id"].astype(int).between(1, 50).all()
+
+def test_skew_shards_and_corruption(tmp_path):
+    """Zipf skew favours the first users, rows split evenly across shards, and corrupt rows are exact"""
+    paths = generate(tmp_path / "sample.csv", 9_000, users=100, skew=1.2, corruption_rate=0.01, shards=3)
+    assert [path.name for path in paths] == ["sample-00000.csv", "sample-00001.csv", "sample-00002.csv"]
+
+    frame = pd.concat([pd.read_csv(path, dtype=str) for path in paths])
+    assert len(frame) == 9_000
+    counts = frame["user_id"].value_counts()
+    assert counts.index[0] == "1" and counts.iloc[0] > 10 * counts.get("100", 0)
+
+    invalid_timestamps = pd.to_datetime(frame["timestamp"], format="%Y-%m-%d %H:%M:%S", errors="coerce").isna()
+    invalid_amounts = pd.to_numeric(frame["transaction_amount"], errors="coerce").isna()
+    assert (invalid_timestamps | invalid_amounts).sum() == 90
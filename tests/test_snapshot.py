@@ -0,0 +1,88 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.snapshot import read_snapshot, restore_amounts, snapshot_path, write_snapshot
+
+@pytest.fixture
+def transactions() -> pd.DataFrame:
+    """A few transactions including repeated IDs, in timestamp order"""
+    return pd.DataFrame({
+        "transaction_id": ["a", "b", "a", "c"],
+        "user_id": ["1", "2", "1", "3"],
+        "product_id": ["10", "10", "11", "12"],
+        "timestamp": pd.to_datetime([
+            "2025-01-01 10:00:00", "2025-01-01 11:00:00", "2025-01-02 09:00:00", "2025-01-05 18:30:00"
+        ]),
+        "transaction_amount": [10.0, 5.5, 30.0, 20.0]
+    })
+
+def test_snapshot_round_trip(transactions, tmp_path):
+    """Reading a full snapshot back gives the same values and types that were written"""
+
+    path = snapshot_path(tmp_path / "latest.csv", (1, 2))
+    write_snapshot(transactions, path)
+
+    loaded = read_snapshot(path, compact=False)
+    for column in transactions.columns:
+        assert list(loaded[column]) == list(transactions[column])
+    assert loaded["transaction_amount"].dtype == np.float64
+    assert loaded["timestamp"].dtype == "datetime64[ns]"
+
+def test_snapshot_compact(transactions, tmp_path):
+    """Compact snapshots drop transaction_id and keep narrowed, memory-mapped columns"""
+
+    path = snapshot_path(tmp_path / "latest.csv", (1, 2))
+    write_snapshot(transactions, path)
+
+    loaded = read_snapshot(path)
+    assert "transaction_id" not in loaded.columns
+    assert loaded["user_id"].cat.codes.dtype == np.int8
+    assert loaded["timestamp"].dtype == "datetime64[s]"
+    assert list(loaded["timestamp"]) == list(transactions["timestamp"])
+
+    amounts = loaded["transaction_amount"].to_numpy()
+    assert amounts.dtype == np.float32
+    assert not amounts.flags.writeable # Backed by the read-only mapping rather than a private copy
+    assert list(restore_amounts(amounts)) == list(transactions["transaction_amount"])
+
+def test_snapshot_keeps_float64_when_unsafe(transactions, tmp_path):
+    """Amounts that float32 cannot restore exactly stay at full width"""
+
+    transactions["transaction_amount"] = [10.0, 5.5, 123456789.01, 20.0]
+    path = snapshot_path(tmp_path / "latest.csv", (1, 2))
+    write_snapshot(transactions, path)
+
+    amounts = read_snapshot(path)["transaction_amount"].to_numpy()
+    assert amounts.dtype == np.float64
+    assert list(amounts) == list(transactions["transaction_amount"])
+
+def test_snapshot_replaces_older_versions(transactions, tmp_path):
+    """Publishing a snapshot removes those of earlier uploads"""
+
+    old_path = snapshot_path(tmp_path / "latest.csv", (1, 2))
+    new_path = snapshot_path(tmp_path / "latest.csv", (3, 4))
+    write_snapshot(transactions, old_path)
+    write_snapshot(transactions, new_path)
+
+    assert not old_path.exists()
+    assert read_snapshot(new_path) is not None
+    assert read_snapshot(old_path) is None
+
+def test_snapshot_keeps_live_and_newer_versions(transactions, tmp_path):
+    """The snapshot of the file on disk, and any newer one, outlive a snapshot written after them"""
+
+    dataset_path = tmp_path / "latest.csv"
+    dataset_path.write_text("transactions")
+    stat = os.stat(dataset_path)
+    live_path = snapshot_path(dataset_path, (stat.st_mtime_ns, stat.st_size))
+    newer_path = snapshot_path(dataset_path, (stat.st_mtime_ns + 10, 1))
+    older_path = snapshot_path(dataset_path, (stat.st_mtime_ns - 10, 1))
+
+    write_snapshot(transactions, older_path)
+    write_snapshot(transactions, newer_path) # A compaction preparing the next file
+    write_snapshot(transactions, live_path) # A cold load of the file being served
+
+    assert live_path.exists() and newer_path.exists()
+    assert not older_path.exists()
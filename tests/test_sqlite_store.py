@@ -0,0 +1,145 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from app.services import transaction_summary
+from app.services.sqlite_store import SqliteStore, StoreError, import_csv
+from app.services.transaction_summary import SummaryError, get_batch_summaries, get_summary
+
+CSV_HEADER = "transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+
+@pytest.fixture
+def store(tmp_path):
+    """A database imported from a small transactions file"""
+    csv_path = tmp_path / "latest.csv"
+    csv_path.write_text(
+        CSV_HEADER
+        + "t1,1,10,2025-01-02 10:00:00,10.00\n"
+        + "t2,1,11,2025-01-01 09:00:00,20.00\n"
+        + "t3,1,11,2025-01-05 23:59:59,\n"
+        + "t4,2,10,2025-01-03 12:00:00,30.00\n"
+        + "t5,3,10,2025-01-03 12:00:00,\n"
+    )
+    store = SqliteStore(tmp_path / "transactions.db")
+    asyncio.run(store.refresh(csv_path))
+    return store
+
+def test_store_aggregates_user_range(store):
+    """Range queries include the first day and stop before the last, skipping missing amounts"""
+
+    assert store.aggregate("1") == (2, 30.0, 10.0, 20.0)
+    assert store.aggregate("1", date(2025, 1, 2)) == (1, 10.0, 10.0, 10.0)
+    assert store.aggregate("1", None, date(2025, 1, 2)) == (1, 20.0, 20.0, 20.0)
+    assert store.aggregate("1", date(2025, 1, 3), date(2025, 1, 6)) is None
+    assert store.aggregate("unknown") is None
+
+    assert store.has_user("3") and not store.has_user("unknown")
+    assert store.user_ids() == ["1", "2", "3"]
+
+def test_store_window(store):
+    """Every user with valid amounts in the range is aggregated at once"""
+
+    window = store.window(date(2025, 1, 2))
+
+    assert len(window) == 2
+    assert window.get("1") == (1, 10.0, 10.0, 10.0)
+    assert window.get("2") == (1, 30.0, 30.0, 30.0)
+    assert window.get("3") is None
+
+def test_store_series(store):
+    """Buckets are combined from the days the index yields, skipping missing amounts"""
+
+    days = store.series("1", "day")
+    assert days.starts.astype(str).tolist() == ["2025-01-01", "2025-01-02"]
+    assert days.totals.tolist() == [20.0, 10.0]
+
+    weeks = store.series("1", "week")
+    assert weeks.starts.astype(str).tolist() == ["2024-12-30"]
+    assert weeks.counts.tolist() == [2]
+
+    assert len(store.series("3", "day").starts) == 0
+    assert store.series("unknown", "day") is None
+
+def test_store_series_before_1970(tmp_path):
+    """Timestamps before the epoch fall on the day they were made, as in the daily rollup"""
+
+    csv_path = tmp_path / "latest.csv"
+    csv_path.write_text(CSV_HEADER + "t1,1,10,1969-12-31 23:00:00,10.00\n" + "t2,1,10,1970-01-01 01:00:00,20.00\n")
+    store = SqliteStore(tmp_path / "transactions.db")
+    asyncio.run(store.refresh(csv_path))
+
+    days = store.series("1", "day")
+    assert days.starts.astype(str).tolist() == ["1969-12-31", "1970-01-01"]
+    assert days.totals.tolist() == [10.0, 20.0]
+
+def test_store_top(store):
+    """Rankings skip missing amounts and break ties in key order"""
+
+    assert store.top("user_id", "spend", 10) == ([("1", 2, 30.0), ("2", 1, 30.0)], 2)
+    assert store.top("user_id", "count", 1) == ([("1", 2, 30.0)], 2)
+    assert store.top("product_id", "count", 10, date(2025, 1, 2)) == ([("10", 2, 40.0)], 1)
+    with pytest.raises(ValueError):
+        store.top("timestamp", "count", 10)
+
+def test_store_rows_pages(store):
+    """Pages of a user's rows continue from the last row of the one before"""
+
+    first = store.rows("1", None, None, None, 2)
+    assert [row[0] for row in first] == ["t2", "t1"]
+    assert first[0][3] == "2025-01-01 09:00:00"
+
+    rest = store.rows("1", None, None, tuple(first[-1][-2:]), 2)
+    assert [row[0] for row in rest] == ["t3"] and rest[0][4] is None
+    assert [row[0] for row in store.rows("1", date(2025, 1, 2), None, None, 10)] == ["t1", "t3"]
+
+def test_store_reimport_bumps_version(store, tmp_path):
+    """Each import replaces the database under a new generation"""
+
+    before = store.current_version()
+    csv_path = tmp_path / "latest.csv"
+    csv_path.write_text(CSV_HEADER + "t9,9,10,2025-02-01 08:00:00,5.00\n")
+    after = asyncio.run(store.refresh(csv_path))
+
+    assert after.generation == before.generation + 1
+    assert store.user_ids() == ["9"]
+
+def test_store_rejects_empty_file(tmp_path):
+    """A file without rows never replaces the database"""
+
+    csv_path = tmp_path / "latest.csv"
+    csv_path.write_text(CSV_HEADER)
+
+    with pytest.raises(StoreError):
+        import_csv(csv_path, tmp_path / "transactions.db", 1)
+    assert list(tmp_path.iterdir()) == [csv_path]
+
+def test_summaries_from_sqlite_backend(store, monkeypatch):
+    """Summaries and batches read the database when it is the configured backend"""
+
+    monkeypatch.setattr(transaction_summary, "SQLITE", True)
+    monkeypatch.setattr(transaction_summary, "transaction_store", store)
+    transaction_summary.summary_cache.clear()
+
+    assert asyncio.run(get_summary("1")).value == {"maximum": 20.0, "minimum": 10.0, "average": 15.0}
+    assert asyncio.run(get_summary("1", quantiles=True)).value["quantiles"] == {"p50": 10.0, "p90": 10.0, "p99": 10.0}
+    with pytest.raises(SummaryError, match="in the given date range"):
+        asyncio.run(get_summary("1", "2025-01-03"))
+    with pytest.raises(SummaryError, match="No transactions found"):
+        asyncio.run(get_summary("unknown", "2025-01-03"))
+
+    entries = list(asyncio.run(get_batch_summaries(None, "2025-01-02")))
+    assert [entry["user_id"] for entry in entries] == ["1", "2", "3"]
+    assert "data" in entries[1] and "error" in entries[2]
+
+def test_store_append_adds_rows(store, tmp_path):
+    """Appended rows are added to the existing ones under a new generation"""
+
+    before = store.current_version()
+    segment = tmp_path / "append.csv"
+    segment.write_text(CSV_HEADER + "t6,1,10,2025-01-06 10:00:00,40.00\n")
+    after = asyncio.run(store.append(segment))
+
+    assert after.generation == before.generation + 1
+    assert store.aggregate("1") == (3, 70.0, 10.0, 40.0)
+    assert not segment.exists()
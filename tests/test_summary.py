@@ -3,6 +3,7 @@ from fastapi.testclient import TestClient
 from app.main import app
 import shutil
 import os
+import json
 
 def validate_summary_response(data: dict) -> None:
     """Helper function to validate summary response structure"""
@@ -43,6 +44,20 @@ def test_summary_with_date_range(client):
 
     validate_summary_response(res.json()["data"])
 
+def test_summary_with_quantiles(client):
+    """Quantiles are only added when asked for, ordered and within the user's range of amounts"""
+
+    res = client.get("/summary/305?date_from=2025-03-01&date_to=2025-09-01&quantiles=true")
+    assert res.status_code == 200
+
+    data = res.json()["data"]
+    validate_summary_response(data)
+    quantiles = data["quantiles"]
+    assert list(quantiles) == ["p50", "p90", "p99"]
+    assert data["minimum"] <= quantiles["p50"] <= quantiles["p90"] <= quantiles["p99"] <= data["maximum"]
+
+    assert "quantiles" not in client.get("/summary/305?date_from=2025-03-01&date_to=2025-09-01").json()["data"]
+
 def test_summary_with_start_date(client):
     """Test summary for existing user with only start ranges"""
 
@@ -81,4 +96,181 @@ def test_summary_invalid_user_id(client):
     """Test summary for non-existing user"""
 
     res = client.get("/summary/30534324324342322344323542dsdssdf")
-    assert res.status_code == 400
\ No newline at end of file
+    assert res.status_code == 400
+
+
+def test_summary_batch(client):
+    """Batch summaries match the single user endpoint, with unknown users reported inline"""
+
+    res = client.post("/summary/batch", json={"user_ids": ["305", "unknown"], "date_from": "2025-01-01"})
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+
+    entries = [json.loads(line) for line in res.text.splitlines()]
+    assert [entry["user_id"] for entry in entries] == ["305", "unknown"]
+    assert entries[0]["data"] == client.get("/summary/305?date_from=2025-01-01").json()["data"]
+    assert "error" in entries[1]
+
+def test_summary_batch_all_users(client):
+    """Leaving out user_ids summarises every user"""
+
+    res = client.post("/summary/batch", json={})
+    assert res.status_code == 200
+
+    entries = [json.loads(line) for line in res.text.splitlines()]
+    assert len(entries) > 1
+    for entry in entries:
+        validate_summary_response(entry["data"])
+
+def test_summary_batch_invalid_date(client):
+    """An invalid date range fails the whole batch"""
+
+    res = client.post("/summary/batch", json={"date_from": "2025-01-01", "date_to": "2024-01-01"})
+    assert res.status_code == 400
+
+def test_summary_conditional_request(client):
+    """Summaries carry validators, and unchanged data is answered with 304 Not Modified"""
+
+    res = client.get("/summary/305")
+    assert res.status_code == 200
+    etag, last_modified = res.headers["ETag"], res.headers["Last-Modified"]
+
+    res = client.get("/summary/305", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+
+    res = client.get("/summary/305", headers={"If-Modified-Since": last_modified})
+    assert res.status_code == 304
+
+    res = client.get("/summary/305", headers={"If-None-Match": '"stale"'})
+    assert res.status_code == 200
+
+    # Requests that would fail are never answered with a 304, whatever the client has cached
+    assert client.get("/summary/unknown-user", headers={"If-None-Match": "*"}).status_code == 400
+    assert client.get("/summary/305?date_from=2025-01-01&date_to=2024-01-01", headers={"If-None-Match": "*"}).status_code == 400
+    assert client.get("/summary/unknown-user/series", headers={"If-None-Match": "*"}).status_code == 400
+    assert client.get("/leaderboard/users?date_from=2025-13-01", headers={"If-None-Match": "*"}).status_code == 400
+
+def test_validators_follow_the_version_computed_from(client, monkeypatch):
+    """The ETag names the version a result was computed from, not whichever version is current when it is sent"""
+    from app.routers import transactions
+    from app.services.dataset import DatasetVersion
+    from app.services.transaction_summary import Versioned
+
+    computed_from = DatasetVersion(7, 1_000_000_000, 1)
+
+    async def versioned(value, *args, **kwargs):
+        return Versioned(computed_from, value)
+
+    monkeypatch.setattr(transactions, "get_summary", lambda *args: versioned({"maximum": 1.0, "minimum": 1.0, "average": 1.0}))
+    monkeypatch.setattr(transactions, "get_summary_series", lambda *args: versioned(iter([])))
+    monkeypatch.setattr(transactions, "get_leaderboard", lambda *args: versioned({"data": []}))
+
+    for url in ["/summary/305", "/summary/305/series", "/leaderboard/users"]:
+        res = client.get(url)
+        assert res.status_code == 200 and res.headers["ETag"] == '"7-1000000000-1"'
+        assert client.get(url, headers={"If-None-Match": '"7-1000000000-1"'}).status_code == 304
+
+def test_summary_series(client):
+    """The series covers the same transactions as the summary of the whole range"""
+
+    res = client.get("/summary/305/series?bucket=month&date_from=2025-03-01&date_to=2025-09-01")
+    assert res.status_code == 200
+
+    data = res.json()["data"]
+    assert [entry["start"] for entry in data] == [f"2025-0{month}-01" for month in range(3, 9)]
+    for entry in data:
+        validate_summary_response(entry)
+
+    summary = client.get("/summary/305?date_from=2025-03-01&date_to=2025-09-01").json()["data"]
+    assert max(entry["maximum"] for entry in data) == summary["maximum"]
+    assert min(entry["minimum"] for entry in data) == summary["minimum"]
+
+    weeks = client.get("/summary/305/series?bucket=week").json()["data"]
+    assert sum(entry["count"] for entry in weeks) == sum(entry["count"] for entry in client.get("/summary/305/series").json()["data"])
+
+def test_summary_series_invalid(client):
+    """Unknown users and buckets are rejected before anything is streamed"""
+
+    assert client.get("/summary/unknown/series").status_code == 400
+    assert client.get("/summary/305/series?bucket=year").status_code == 422
+
+def test_leaderboard_pages(client):
+    """Pages follow on from each other and are ordered by the requested metric"""
+
+    res = client.get("/leaderboard/users?limit=10&date_from=2025-03-01")
+    assert res.status_code == 200
+    first = res.json()
+    assert first["next_offset"] == 10 and first["entries"] == 1000
+    assert [entry["rank"] for entry in first["data"]] == list(range(1, 11))
+
+    second = client.get("/leaderboard/users?limit=10&offset=10&date_from=2025-03-01").json()
+    combined = client.get("/leaderboard/users?limit=20&date_from=2025-03-01").json()
+    assert first["data"] + second["data"] == combined["data"]
+    totals = [entry["total"] for entry in combined["data"]]
+    assert totals == sorted(totals, reverse=True)
+
+    products = client.get("/leaderboard/products?by=count&limit=5").json()
+    counts = [entry["count"] for entry in products["data"]]
+    assert "product_id" in products["data"][0] and counts == sorted(counts, reverse=True)
+
+    stats = client.get("/cache/stats").json()["leaderboard"]
+    assert stats["hits"] >= 1
+
+def test_leaderboard_invalid_requests(client):
+    """Unknown boards, bad dates and pages past the ranked depth are rejected"""
+
+    assert client.get("/leaderboard/shops").status_code == 422
+    assert client.get("/leaderboard/users?date_from=2025-13-01").status_code == 400
+    assert client.get("/leaderboard/users?offset=1000&limit=10").status_code == 400
+
+def test_summary_cache_stats(client):
+    """Repeated queries are served from the result cache"""
+
+    before = client.get("/cache/stats").json()["summary"]
+    client.get("/summary/305?date_from=2025-02-01")
+    client.get("/summary/305?date_from=2025-02-01")
+    after = client.get("/cache/stats").json()["summary"]
+
+    assert after["hits"] >= before["hits"] + 1
+    assert after["misses"] >= before["misses"] + 1
+
+def test_summary_series_cached_under_its_dataset(tmp_path, monkeypatch):
+    """A series is cached under the version of the dataset it was read from, even if another is published meanwhile"""
+    import asyncio
+    from app.services import transaction_summary
+    from app.services.dataset import DatasetCache
+
+    datasets = []
+    for name, amount in [("before.csv", "10.00"), ("after.csv", "99.00")]:
+        path = tmp_path / name
+        path.write_text(f"transaction_id,user_id,product_id,timestamp,transaction_amount\nt1,1,10,2025-01-02 10:00:00,{amount}\n")
+        datasets.append(DatasetCache(path).current())
+    current = iter(datasets) # Each lookup of the current dataset sees the next upload
+    monkeypatch.setattr(transaction_summary, "current_dataset", lambda: next(current))
+    monkeypatch.setattr(transaction_summary, "SQLITE", False)
+
+    entries = list(asyncio.run(transaction_summary.get_summary_series("1")).value)
+    found, series = transaction_summary.summary_cache.get(datasets[0].version, ("series", "1", "day", None, None))
+    assert [entry["total"] for entry in entries] == [10.0]
+    assert found and series.totals.tolist() == [10.0]
+
+def test_leaderboard_cached_under_its_dataset(tmp_path, monkeypatch):
+    """A ranking is cached under the version of the dataset it was built from, even if another is published meanwhile"""
+    import asyncio
+    from app.services import leaderboard, transaction_summary
+    from app.services.dataset import DatasetCache
+
+    datasets = []
+    for name, user_id in [("before.csv", "early"), ("after.csv", "late")]:
+        path = tmp_path / name
+        path.write_text(f"transaction_id,user_id,product_id,timestamp,transaction_amount\nt1,{user_id},10,2025-01-02 10:00:00,10.00\n")
+        datasets.append(DatasetCache(path).current())
+    current = iter(datasets) # Each lookup of the current dataset sees the next upload
+    monkeypatch.setattr(transaction_summary, "current_dataset", lambda: next(current))
+    monkeypatch.setattr(leaderboard, "SQLITE", False)
+
+    page = asyncio.run(leaderboard.get_leaderboard("users")).value
+    found, (ranked, _) = leaderboard.leaderboard_cache.get(datasets[0].version, ("users", "spend", None, None))
+    assert [entry["user_id"] for entry in page["data"]] == ["early"]
+    assert found and [entry[0] for entry in ranked] == ["early"]
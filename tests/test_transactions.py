@@ -1,3 +1,5 @@
+import gzip
+import json
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
@@ -24,4 +26,155 @@ def test_upload_large_file(client, get_test_file):
     """
     with open(get_test_file("large_sample.csv"), "rb") as f:
         res = client.post("/upload", files={"file": ("large.csv", f, "text/csv")})
-    assert res.status_code == 400
\ No newline at end of file
+    assert res.status_code == 400
+
+
+def test_upload_append(client, get_test_file):
+    """
+    Test appending rows to an earlier upload
+    """
+    with open(get_test_file("valid_sample.csv"), "rb") as f:
+        client.post("/upload", files={"file": ("valid.csv", f, "text/csv")})
+
+    appended = b"transaction_id,user_id,product_id,timestamp,transaction_amount\nt1,appended-user,1,2025-03-01 10:00:00,12.50\n"
+    res = client.post("/upload?mode=append", files={"file": ("append.csv", appended, "text/csv")})
+    assert res.status_code == 200
+
+    res = client.get("/summary/appended-user")
+    assert res.json()["data"] == {"maximum": 12.5, "minimum": 12.5, "average": 12.5}
+
+def test_upload_append_keeps_exact_amounts(client):
+    """
+    Test amounts stay exact when an appended segment is merged with a snapshot that narrowed them
+    """
+    header = b"transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+    client.post("/upload", files={"file": ("data.csv", header + b"t1,u1,1,2025-03-01 10:00:00,392.86\n", "text/csv")})
+    appended = header + b"t2,u1,1,2025-03-02 10:00:00,1.234\n"
+    res = client.post("/upload?mode=append", files={"file": ("append.csv", appended, "text/csv")})
+    assert res.status_code == 200
+
+    exported = [json.loads(line) for line in client.get("/transactions/u1").text.splitlines()]
+    assert [row["transaction_amount"] for row in exported] == [392.86, 1.234]
+    assert client.get("/summary/u1").json()["data"] == {"maximum": 392.86, "minimum": 1.234, "average": 197.05}
+
+def test_upload_gzip_file(client, get_test_file):
+    """
+    Test a gzip compressed upload is decompressed as it is validated
+    """
+    with open(get_test_file("valid_sample.csv"), "rb") as f:
+        compressed = gzip.compress(f.read())
+    res = client.post("/upload", files={"file": ("valid.csv.gz", compressed, "application/gzip")})
+    assert res.status_code == 200
+
+    with open(get_test_file("valid_sample.csv"), "rb") as f:
+        res = client.post("/upload", files={"file": ("valid.csv", f, "text/csv")})
+    assert res.status_code == 200
+
+def test_upload_content_encoding(client):
+    """
+    Test a Content-Encoding header on the file part is honoured, and corrupt data rejected
+    """
+    data = b"transaction_id,user_id,product_id,timestamp,transaction_amount\nt1,gzip-user,1,2025-03-01 10:00:00,12.50\n"
+    res = client.post("/upload", files={"file": ("data.csv", gzip.compress(data), "text/csv", {"Content-Encoding": "gzip"})})
+    assert res.status_code == 200
+    assert client.get("/summary/gzip-user").json()["data"]["average"] == 12.5
+
+    res = client.post("/upload", files={"file": ("data.csv.gz", gzip.compress(data)[:-10], "application/gzip")})
+    assert res.status_code == 400
+    res = client.post("/upload", files={"file": ("data.csv.bz2", data, "application/x-bzip2")})
+    assert res.status_code == 400
+
+def test_export_transactions(client, get_test_file):
+    """
+    Test a user's transactions are exported a page at a time, in timestamp order
+    """
+    import pandas as pd
+
+    with open(get_test_file("valid_sample.csv"), "rb") as f:
+        client.post("/upload", files={"file": ("valid.csv", f, "text/csv")})
+    expected = pd.read_csv(get_test_file("valid_sample.csv"), dtype={"user_id": str, "transaction_id": str})
+    expected = expected[expected["user_id"] == "305"].sort_values("timestamp", kind="stable")
+
+    exported, cursor = [], None
+    while True:
+        res = client.get("/transactions/305", params={"limit": 300, **({"cursor": cursor} if cursor else {})})
+        assert res.status_code == 200
+        exported += [json.loads(line) for line in res.text.splitlines()]
+        cursor = res.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert [row["transaction_id"] for row in exported] == expected["transaction_id"].tolist()
+    assert exported[0]["timestamp"] == expected["timestamp"].iloc[0]
+
+    res = client.get("/transactions/305?format=csv&limit=5&date_from=2025-02-01")
+    lines = res.text.splitlines()
+    assert res.headers["content-type"].startswith("text/csv")
+    assert lines[0] == "transaction_id,user_id,product_id,timestamp,transaction_amount" and len(lines) == 6
+
+def test_export_rejects_bad_cursors(client, get_test_file):
+    """
+    Test cursors for another user, malformed cursors and cursors from replaced data are refused
+    """
+    with open(get_test_file("valid_sample.csv"), "rb") as f:
+        client.post("/upload", files={"file": ("valid.csv", f, "text/csv")})
+    cursor = client.get("/transactions/305?limit=1").headers["X-Next-Cursor"]
+
+    assert client.get(f"/transactions/306?cursor={cursor}").status_code == 400
+    assert client.get("/transactions/305?cursor=not-a-cursor").status_code == 400
+    assert client.get("/transactions/unknown-user").status_code == 400
+
+    appended = b"transaction_id,user_id,product_id,timestamp,transaction_amount\nt1,305,1,2025-03-01 10:00:00,12.50\n"
+    client.post("/upload?mode=append", files={"file": ("append.csv", appended, "text/csv")})
+    assert client.get(f"/transactions/305?cursor={cursor}").status_code == 409
+
+    res = client.get("/transactions/305?limit=10000&date_from=2025-03-01&date_to=2025-03-02")
+    exported = [json.loads(line) for line in res.text.splitlines()]
+    assert [row["timestamp"] for row in exported] == sorted(row["timestamp"] for row in exported)
+    assert {
+        "transaction_id": "t1", "user_id": "305", "product_id": "1",
+        "timestamp": "2025-03-01 10:00:00", "transaction_amount": 12.5
+    } in exported
+
+def test_upload_duplicate_ids(client):
+    """
+    Test repeated transaction IDs are counted, rejected or dropped keeping the first row
+    """
+    data = (
+        b"transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+        b"t1,dup-user,1,2025-03-01 10:00:00,10.00\n"
+        b"t2,dup-user,1,2025-03-01 11:00:00,20.00\n"
+        b"t1,dup-user,1,2025-03-01 10:00:00,10.00\n"
+    )
+    res = client.post("/upload", files={"file": ("data.csv", data, "text/csv")})
+    assert res.status_code == 200
+    assert (res.json()["rows"], res.json()["duplicates"]) == (3, 1)
+    assert client.get("/summary/dup-user").json()["data"]["average"] == 13.33
+
+    res = client.post("/upload?duplicates=reject", files={"file": ("data.csv", data, "text/csv")})
+    assert res.status_code == 400 and "data row 3" in res.json()["detail"]
+
+    res = client.post("/upload?duplicates=keep_first", files={"file": ("data.csv", data, "text/csv")})
+    assert res.status_code == 200 and res.json()["duplicates"] == 1
+    assert client.get("/summary/dup-user").json()["data"] == {"maximum": 20.0, "minimum": 10.0, "average": 15.0}
+
+    assert client.post("/upload?duplicates=ignore", files={"file": ("data.csv", data, "text/csv")}).status_code == 422
+
+
+def test_upload_duplicate_ids_multiline_fields(client):
+    """
+    Test quoted fields holding line breaks are counted and dropped as whole rows
+    """
+    data = (
+        b"transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+        b't1,multi-user,"first\nproduct",2025-03-01 10:00:00,10.00\n'
+        b"t2,multi-user,1,2025-03-01 11:00:00,20.00\n"
+        b't1,multi-user,"first\nproduct",2025-03-01 10:00:00,10.00\n'
+        b"t3,multi-user,1,2025-03-01 12:00:00,30.00\n"
+    )
+    res = client.post("/upload", files={"file": ("data.csv", data, "text/csv")})
+    assert res.status_code == 200
+    assert (res.json()["rows"], res.json()["duplicates"]) == (4, 1)
+
+    res = client.post("/upload?duplicates=keep_first", files={"file": ("data.csv", data, "text/csv")})
+    assert res.status_code == 200 and res.json()["duplicates"] == 1
+    assert client.get("/summary/multi-user").json()["data"] == {"maximum": 30.0, "minimum": 10.0, "average": 20.0}
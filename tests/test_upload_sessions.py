@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from app.services import upload_sessions as upload_sessions_module
+from app.services.upload_sessions import UploadSessions, UploadSessionError, SessionNotFoundError
+
+CSV_HEADER = b"transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+
+async def _chunks(data: bytes):
+    yield data
+
+def _write(sessions, session_id, number, data, checksum=None):
+    return asyncio.run(sessions.write_part(session_id, number, _chunks(data), checksum))
+
+@pytest.fixture
+def sessions(tmp_path):
+    return UploadSessions(tmp_path / "sessions")
+
+def test_parts_out_of_order_are_assembled(sessions, tmp_path):
+    """Parts may arrive in any order, lines may span parts, and validation waits for the gaps to fill"""
+    session = sessions.create()
+    _write(sessions, session.session_id, 2, b"00:00,12.50\nt2,2,10,2025-01-02 10:00:00,5.00\n")
+    assert sessions.get(session.session_id).validated == 0
+
+    _write(sessions, session.session_id, 1, CSV_HEADER + b"t1,1,10,2025-01-01 10:")
+    assert sessions.get(session.session_id).validated == 2
+
+    destination = tmp_path / "latest.csv"
+    result = asyncio.run(sessions.complete(session.session_id, destination))
+    assert (result.path, result.rows, result.duplicates) == (str(destination), 2, 0)
+    assert destination.read_bytes() == CSV_HEADER + b"t1,1,10,2025-01-01 10:00:00,12.50\nt2,2,10,2025-01-02 10:00:00,5.00\n"
+    with pytest.raises(SessionNotFoundError):
+        sessions.get(session.session_id)
+
+def test_checksum_mismatch_is_rejected(sessions):
+    """A part that does not match its checksum is never stored"""
+    session = sessions.create()
+    part = CSV_HEADER + b"t1,1,10,2025-01-01 10:00:00,12.50\n"
+    with pytest.raises(UploadSessionError, match="Checksum mismatch"):
+        _write(sessions, session.session_id, 1, part, "0" * 64)
+    assert sessions.get(session.session_id).parts == {}
+
+    _write(sessions, session.session_id, 1, part, hashlib.sha256(part).hexdigest())
+    assert sessions.get(session.session_id).parts["1"]["size"] == len(part)
+
+def test_invalid_row_is_reported_before_completion(sessions, tmp_path):
+    """An invalid row fails the part it arrives in, with its line in the assembled file"""
+    session = sessions.create()
+    _write(sessions, session.session_id, 1, CSV_HEADER + b"t1,1,10,2025-01-01 10:00:00,12.50\n")
+    with pytest.raises(UploadSessionError, match="3"):
+        _write(sessions, session.session_id, 2, b"t2,2,10,not a date,5.00\n")
+
+    with pytest.raises(UploadSessionError):
+        asyncio.run(sessions.complete(session.session_id, tmp_path / "latest.csv"))
+    assert not (tmp_path / "latest.csv").exists()
+
+def test_resent_parts(sessions):
+    """A validated part can be resent unchanged, but not replaced"""
+    session = sessions.create()
+    part = CSV_HEADER + b"t1,1,10,2025-01-01 10:00:00,12.50\n"
+    _write(sessions, session.session_id, 1, part)
+    _write(sessions, session.session_id, 1, part)
+    with pytest.raises(UploadSessionError, match="already been validated"):
+        _write(sessions, session.session_id, 1, part.replace(b"12.50", b"99.99"))
+
+def test_duplicate_ids_across_parts(sessions, tmp_path):
+    """Repeated transaction IDs are found across parts, and dropped or rejected once the upload completes"""
+    parts = [CSV_HEADER + b"t1,1,10,2025-01-01 10:00:00,12.50\nt2,2,10,2025-01-02 10:00:00,5.00\n", b"t1,1,10,2025-01-01 10:00:00,12.50\n"]
+
+    session = sessions.create(duplicates="keep_first")
+    for number, part in enumerate(parts, start=1):
+        _write(sessions, session.session_id, number, part)
+    result = asyncio.run(sessions.complete(session.session_id, tmp_path / "latest.csv"))
+    assert (result.rows, result.duplicates) == (3, 1)
+    assert (tmp_path / "latest.csv").read_bytes() == parts[0]
+
+    session = sessions.create(duplicates="reject")
+    for number, part in enumerate(parts, start=1):
+        _write(sessions, session.session_id, number, part)
+    with pytest.raises(UploadSessionError, match="data row 3"):
+        asyncio.run(sessions.complete(session.session_id, tmp_path / "rejected.csv"))
+    assert not (tmp_path / "rejected.csv").exists()
+
+    with pytest.raises(UploadSessionError, match="Duplicate handling"):
+        sessions.create(duplicates="ignore")
+
+def test_parallel_parts_respect_session_limit(sessions, monkeypatch):
+    """Parts streamed at the same time cannot add up to more than the upload limit"""
+    part = CSV_HEADER + b"t1,1,10,2025-01-01 10:00:00,12.50\n"
+    monkeypatch.setattr(upload_sessions_module, "MAX_SESSION_SIZE", len(part) + 10)
+    session = sessions.create()
+
+    async def slow_chunks(data: bytes):
+        await asyncio.sleep(0.01) # Both parts are measured against the empty session before either is stored
+        yield data
+
+    async def send_both():
+        return await asyncio.gather(
+            sessions.write_part(session.session_id, 1, slow_chunks(part)),
+            sessions.write_part(session.session_id, 2, slow_chunks(part)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(send_both())
+    assert sum(isinstance(result, UploadSessionError) for result in results) == 1
+    assert sessions.get(session.session_id).size == len(part)
+
+def test_missing_parts_prevent_completion(sessions, tmp_path):
+    session = sessions.create()
+    _write(sessions, session.session_id, 2, b"t1,1,10,2025-01-01 10:00:00,12.50\n")
+    with pytest.raises(UploadSessionError, match="missing parts"):
+        asyncio.run(sessions.complete(session.session_id, tmp_path / "latest.csv"))
+
+def test_unknown_sessions(sessions):
+    """Session IDs that could escape the sessions directory are never looked up"""
+    with pytest.raises(SessionNotFoundError):
+        sessions.get("../../etc")
+    with pytest.raises(SessionNotFoundError):
+        sessions.get("0" * 32)
+
+def test_chunked_upload_endpoints(client):
+    """A chunked upload can be resumed from its status, then completed into summaries"""
+    session_id = client.post("/uploads").json()["session_id"]
+    part = b"t1,chunked-user,10,2025-03-01 10:00:00,12.50\n"
+    res = client.put(
+        f"/uploads/{session_id}/parts/2",
+        content=part,
+        headers={"X-Checksum-SHA256": hashlib.sha256(part).hexdigest()}
+    )
+    assert res.status_code == 200
+
+    status = client.get(f"/uploads/{session_id}").json()
+    assert list(status["parts"]) == ["2"]
+
+    assert client.put(f"/uploads/{session_id}/parts/1", content=CSV_HEADER).status_code == 200
+    assert client.post(f"/uploads/{session_id}/complete").status_code == 200
+
+    res = client.get("/summary/chunked-user")
+    assert res.json()["data"] == {"maximum": 12.5, "minimum": 12.5, "average": 12.5}
+    assert client.get(f"/uploads/{session_id}").status_code == 404
@@ -0,0 +1,113 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.file_handler import UploadWriter
+from app.services.transaction_validator import CsvStreamValidator, ValidationError
+
+CSV_HEADER = "transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+
+def feed_in_pieces(validator: CsvStreamValidator, content: bytes, size: int) -> None:
+    """Feed content to the validator in fixed size pieces, as an upload would arrive"""
+    for start in range(0, len(content), size):
+        validator.feed(content[start:start + size])
+    validator.close()
+
+def test_stream_validator_splits_anywhere():
+    """Pieces may split lines and multi-byte characters without affecting the result"""
+
+    rows = "".join(f"t{i},ü{i},p{i},2025-01-01 10:00:00,{i}.50\n" for i in range(50))
+    validator = CsvStreamValidator(chunk_size=64)
+    feed_in_pieces(validator, (CSV_HEADER + rows).encode("utf-8"), 3)
+
+    assert validator.rows == 50
+
+def test_stream_validator_row_numbers_span_chunks():
+    """Errors in later chunks are reported with their line number in the whole file, counting the header"""
+
+    rows = [f"t{i},1,p,2025-01-01 10:00:00,1.00\n" for i in range(30)]
+    rows[25] = "t25,1,p,2025-01-01 10:00:00,abc\n"
+    validator = CsvStreamValidator(chunk_size=100)
+
+    with pytest.raises(ValidationError, match="line 27: abc"):
+        feed_in_pieces(validator, (CSV_HEADER + "".join(rows)).encode("utf-8"), 17)
+
+def test_stream_validator_keeps_quoted_line_breaks_together():
+    """Chunks never split a quoted field across a line break, and lines are counted per record"""
+
+    rows = [f"t{i},1,p,2025-01-01 10:00:00,1.00\n" for i in range(10)]
+    rows[2] = 't2,1,"a ""quoted""\nproduct\nname",2025-01-01 10:00:00,1.00\n'
+    rows[4] = "\n"
+    validator = CsvStreamValidator(chunk_size=10)
+    feed_in_pieces(validator, (CSV_HEADER + "".join(rows)).encode("utf-8"), 7)
+    assert validator.rows == 9
+
+    rows[8] = "t8,1,p,2025-01-01 10:00:00,abc\n"
+    validator = CsvStreamValidator(chunk_size=1000)
+    with pytest.raises(ValidationError, match="line 12: abc"):
+        feed_in_pieces(validator, (CSV_HEADER + "".join(rows)).encode("utf-8"), 1000)
+
+def test_stream_validator_parallel_reports_earliest_error():
+    """With chunks validated in parallel, the error earliest in the file wins"""
+
+    rows = [f"t{i},1,p,2025-01-01 10:00:00,1.00\n" for i in range(2000)]
+    rows[1500] = "t1500,1,p,2025-01-01 10:00:00,late\n"
+    rows[700] = "t700,1,p,not a timestamp,1.00\n"
+    content = (CSV_HEADER + "".join(rows)).encode("utf-8")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        validator = CsvStreamValidator(chunk_size=1000, executor=executor)
+        with pytest.raises(ValidationError, match="line 702: not a timestamp"):
+            feed_in_pieces(validator, content, 4096)
+
+def test_stream_validator_parallel_counts_rows():
+    """Every chunk's rows are counted once all of them have been validated"""
+
+    rows = "".join(f"t{i},1,p,2025-01-01 10:00:00,1.00\n" for i in range(2000))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        validator = CsvStreamValidator(chunk_size=1000, executor=executor)
+        feed_in_pieces(validator, (CSV_HEADER + rows).encode("utf-8"), 4096)
+
+    assert validator.rows == 2000
+
+def test_stream_validator_empty():
+    """A file with only a header is rejected"""
+
+    with pytest.raises(ValidationError, match="empty"):
+        feed_in_pieces(CsvStreamValidator(), CSV_HEADER.encode("utf-8"), 1024)
+
+def test_upload_writer_only_replaces_on_commit(tmp_path):
+    """An upload that fails part way leaves the previous file untouched"""
+
+    destination = tmp_path / "latest.csv"
+    destination.write_text("previous")
+
+    with pytest.raises(RuntimeError):
+        with UploadWriter(destination) as writer:
+            writer.write(b"partial")
+            raise RuntimeError("upload failed")
+
+    assert destination.read_text() == "previous"
+    assert list(tmp_path.iterdir()) == [destination]
+
+    with UploadWriter(destination) as writer:
+        writer.write(b"complete")
+        writer.commit()
+
+    assert destination.read_text() == "complete"
+    assert list(tmp_path.iterdir()) == [destination]
+
+def test_upload_writer_drops_records(tmp_path):
+    """Whole records are dropped by position after the header, however many lines a quoted field spans"""
+
+    destination = tmp_path / "latest.csv"
+    rows = [f"t{i},1,p,2025-01-01 10:00:00,1.00\n".encode("utf-8") for i in range(6)]
+    rows[2] = b't2,"two\nlines",p,2025-01-01 10:00:00,1.00\n'
+    rows[3] = b't3,"say ""hi""\n\nthere",p,2025-01-01 10:00:00,1.00\n'
+    with UploadWriter(destination) as writer:
+        writer.write(CSV_HEADER.encode("utf-8") + rows[0] + b"\n" + b"".join(rows[1:])[:-1])
+        writer.drop_records([0, 3, 5])
+        writer.write(b"\n")
+        writer.commit()
+
+    assert destination.read_bytes() == CSV_HEADER.encode("utf-8") + b"\n" + rows[1] + rows[2] + rows[4] + b"\n"
+    assert list(tmp_path.iterdir()) == [destination]
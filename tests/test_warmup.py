@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services import transaction_summary
+from app.services.warmup import WarmUp
+
+def test_warm_up_loads_stored_data(monkeypatch):
+    """Readiness only flips once the stored data has been loaded"""
+    loaded = []
+
+    async def warm_data():
+        assert not warm_up.ready
+        loaded.append(True)
+
+    monkeypatch.setattr("app.services.warmup.warm_data", warm_data)
+    warm_up = WarmUp()
+    assert warm_up.status()["status"] == "starting"
+
+    asyncio.run(warm_up.run())
+    assert loaded and warm_up.ready
+    assert warm_up.status()["status"] == "ready"
+
+def test_failed_warm_up_not_ready(monkeypatch):
+    """A failed warm-up is reported and never counts as ready, until an upload loads data that works"""
+    async def warm_data():
+        raise RuntimeError("corrupt file")
+
+    monkeypatch.setattr("app.services.warmup.warm_data", warm_data)
+    warm_up = WarmUp()
+    asyncio.run(warm_up.run())
+    assert not warm_up.ready
+    assert warm_up.status() | {"elapsed_seconds": 0} == {"status": "failed", "elapsed_seconds": 0, "error": "corrupt file"}
+
+    warm_up.data_loaded()
+    assert warm_up.ready and "error" not in warm_up.status()
+
+def test_readiness_endpoint(sample_data):
+    """Starting the app warms up in the background, reporting 503 until done"""
+    with TestClient(app) as client:
+        assert client.get("/health/live").status_code == 200
+        for _ in range(100):
+            res = client.get("/health/ready")
+            if res.status_code == 200:
+                break
+            assert res.status_code == 503
+            time.sleep(0.05)
+        assert res.json()["status"] == "ready"
+
+def test_warm_data_without_upload(monkeypatch):
+    """Nothing stored yet is not an error"""
+    def current_dataset():
+        raise transaction_summary.SummaryError("No transaction file found")
+
+    monkeypatch.setattr(transaction_summary, "current_dataset", current_dataset)
+    monkeypatch.setattr(transaction_summary, "SQLITE", False)
+    asyncio.run(transaction_summary.warm_data())